@@ -0,0 +1,531 @@
+"""
+Нагрузочный замер всех эндпоинтов polls/urls.py.
+
+База заполняется опросами, вопросами, вариантами и ответами
+пользователей через PollImporter, затем каждый сценарий выполняется
+--requests раз в --concurrency потоков. Для каждого сценария
+считаются пропускная способность, перцентили задержки p50/p95/p99
+и число запросов к базе на один запрос.
+
+По умолчанию запросы идут через тестовый клиент Django на отдельной
+базе SQLite. С --url запросы идут на запущенный сервер, а база
+заполняется по настройкам окружения (DJANGO_DB_*), общим с сервером;
+административные сценарии требуют --admin логин:пароль.
+
+    python benchmarks/api.py --output before.json
+    python benchmarks/api.py --compare before.json
+
+С --compare результат сравнивается с прошлым запуском: рост p95
+больше --threshold или рост числа запросов к базе на запрос считается
+регрессией, и скрипт завершается с кодом 1.
+"""
+import argparse
+import base64
+import datetime as dt
+import http.client
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from common import QueryCounter, latency_summary, setup
+
+QUESTION_TYPES = ('TEXT', 'CHOICE', 'MULTICHOICE')
+# промахи кэша при параллельных запросах дают дробный шум в числе
+# запросов, лишний запрос на каждый ответ (N+1) - это рост хотя бы на 1
+QUERIES_TOLERANCE = 0.5
+
+
+class Dataset:
+    """
+    Записи для PollImporter и сведения о них для сценариев
+    """
+
+    def __init__(self, args, rng):
+        self.args = args
+        self.rng = rng
+        self.polls = {}
+        self.active_polls = []
+        self.user_ids = list(range(1, args.users + 1))
+        self.new_user_ids = itertools.count(args.users + 1)
+        self.scratch_polls = []
+        self.created_polls = []
+        self.lock = threading.Lock()
+
+    def records(self):
+        today = dt.date.today()
+        question_ids = itertools.count(1)
+        choice_ids = itertools.count(1)
+        for poll_id in range(1, self.args.polls + 1):
+            active = self.rng.random() < 0.9
+            end_date = today + dt.timedelta(days=30 if active else -30)
+            yield {'model': 'polls.poll', 'pk': poll_id,
+                   'fields': {'title': f'Опрос {poll_id}',
+                              'description': 'Описание опроса',
+                              'start_date': str(today - dt.timedelta(60)),
+                              'end_date': str(end_date)}}
+            questions = []
+            for number in range(self.args.questions):
+                question_id = next(question_ids)
+                question_type = self.rng.choice(QUESTION_TYPES)
+                yield {'model': 'polls.question', 'pk': question_id,
+                       'fields': {'poll': poll_id,
+                                  'question_text': f'Вопрос {number}',
+                                  'question_type': question_type}}
+                choices = []
+                if question_type != 'TEXT':
+                    for choice_number in range(self.args.choices):
+                        choice_id = next(choice_ids)
+                        choices.append(choice_id)
+                        yield {'model': 'polls.questionchoice',
+                               'pk': choice_id,
+                               'fields': {'question': question_id,
+                                          'choice_text':
+                                              f'Вариант {choice_number}'}}
+                questions.append((question_id, question_type, choices))
+            self.polls[poll_id] = questions
+            if active:
+                self.active_polls.append(poll_id)
+        for user_id in self.user_ids:
+            polls = self.rng.sample(
+                self.active_polls,
+                min(self.args.polls_per_user, len(self.active_polls))
+            )
+            for poll_id in polls:
+                for attrs in self.answers(poll_id, user_id):
+                    yield {'model': 'polls.answer', 'pk': None,
+                           'fields': {'poll': poll_id,
+                                      'user_id': user_id,
+                                      'question': attrs['question'],
+                                      'choice': attrs.get('choice'),
+                                      'answer_text':
+                                          attrs.get('answer_text', '')}}
+
+    def load(self):
+        """
+        Сведения для сценариев из базы: активные опросы с вопросами
+        и вариантами, пользователи с ответами
+        """
+        from django.db.models import Max
+        from polls.models import Answer, Poll, Question, QuestionChoice
+        choices = {}
+        for question_id, choice_id in QuestionChoice.objects.values_list(
+                'question_id', 'id').order_by('id'):
+            choices.setdefault(question_id, []).append(choice_id)
+        self.polls = {}
+        for poll_id, question_id, question_type in Question.objects.filter(
+                poll__end_date__gte=dt.date.today()
+        ).values_list('poll_id', 'id', 'question_type').order_by('id'):
+            self.polls.setdefault(poll_id, []).append(
+                (question_id, question_type, choices.get(question_id, []))
+            )
+        self.active_polls = sorted(self.polls)
+        self.user_ids = list(Answer.objects.values_list(
+            'user_id', flat=True
+        ).distinct().order_by('user_id')) or [1]
+        last_user = Answer.objects.aggregate(Max('user_id'))['user_id__max']
+        self.new_user_ids = itertools.count((last_user or 0) + 1)
+        return Poll.objects.count()
+
+    def answers(self, poll_id, user_id):
+        """
+        Полные ответы пользователя на опрос в формате API
+        """
+        answers = []
+        for question_id, question_type, choices in self.polls[poll_id]:
+            if question_type == 'TEXT':
+                answers.append({'user_id': user_id, 'question': question_id,
+                                'answer_text': 'Ответ'})
+            elif question_type == 'CHOICE':
+                answers.append({'user_id': user_id, 'question': question_id,
+                                'choice': self.rng.choice(choices)})
+            else:
+                for choice_id in self.rng.sample(choices,
+                                                 min(2, len(choices))):
+                    answers.append({'user_id': user_id,
+                                    'question': question_id,
+                                    'choice': choice_id})
+        return answers
+
+    def poll(self):
+        return self.rng.choice(self.active_polls)
+
+    def user(self):
+        return self.rng.choice(self.user_ids)
+
+    def new_user(self):
+        with self.lock:
+            return next(self.new_user_ids)
+
+    def text_question(self, poll_id):
+        for question_id, question_type, _ in self.polls[poll_id]:
+            if question_type == 'TEXT':
+                return question_id
+        return None
+
+
+def seed(dataset, batch_size):
+    from django.core.management import call_command
+    from polls.importer import PollImporter
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    stats = PollImporter(batch_size).run(dataset.records())
+    return dict(stats)
+
+
+def scratch_polls(count):
+    """
+    Опросы без ответов для административных сценариев изменения
+    """
+    from polls.models import Poll, Question, QuestionChoice
+    today = dt.date.today()
+    polls = []
+    for number in range(count):
+        poll = Poll.objects.create(title=f'Черновик {number}',
+                                   description='Черновик',
+                                   start_date=today,
+                                   end_date=today + dt.timedelta(days=30))
+        question = Question.objects.create(poll=poll,
+                                           question_text='Вопрос',
+                                           question_type='CHOICE')
+        QuestionChoice.objects.create(question=question,
+                                      choice_text='Вариант')
+        polls.append((poll.id, question.id))
+    return polls
+
+
+def scenarios(dataset):
+    """
+    Сценарии: имя, метод, функция (номер запроса -> путь и тело),
+    нужен ли администратор
+    """
+    from django.urls import reverse
+
+    def get(name, kwargs=None, query=''):
+        def build(number):
+            path = reverse(name, kwargs=kwargs(number) if kwargs else None)
+            return path + query, None
+        return build
+
+    def create_answer(number):
+        poll_id = dataset.poll()
+        question_id = dataset.text_question(poll_id)
+        answer = {'user_id': dataset.new_user(), 'question': question_id,
+                  'answer_text': 'Ответ'}
+        if question_id is None:
+            answer = dataset.answers(poll_id, dataset.new_user())[0]
+        return (reverse('create_answer_view', kwargs={'poll_id': poll_id}),
+                answer)
+
+    def create_answer_batch(number):
+        poll_id = dataset.poll()
+        return (reverse('create_answer_view', kwargs={'poll_id': poll_id}),
+                dataset.answers(poll_id, dataset.new_user()))
+
+    def create_poll(number):
+        today = dt.date.today()
+        return reverse('poll-list'), {
+            'title': f'Новый опрос {number}',
+            'description': 'Описание',
+            'start_date': str(today),
+            'end_date': str(today + dt.timedelta(days=30)),
+        }
+
+    def scratch(number):
+        return dataset.scratch_polls[number % len(dataset.scratch_polls)]
+
+    def update_poll(number):
+        poll_id, _ = scratch(number)
+        return (reverse('poll-detail', kwargs={'pk': poll_id}),
+                {'description': f'Описание {number}'})
+
+    def create_question(number):
+        poll_id, _ = scratch(number)
+        return (reverse('question-list', kwargs={'poll_id': poll_id}),
+                {'question_text': f'Вопрос {number}',
+                 'question_type': 'CHOICE',
+                 'question_choice': [{'choice_text': 'Первый'},
+                                     {'choice_text': 'Второй'}]})
+
+    def update_question(number):
+        poll_id, question_id = scratch(number)
+        return (reverse('question-detail',
+                        kwargs={'poll_id': poll_id, 'pk': question_id}),
+                {'question_text': f'Вопрос {number}',
+                 'question_type': 'CHOICE',
+                 'question_choice': [{'choice_text': 'Вариант'},
+                                     {'choice_text': f'Вариант {number}'}]})
+
+    def delete_poll(number):
+        poll_id = dataset.created_polls[number]
+        return reverse('poll-detail', kwargs={'pk': poll_id}), None
+
+    poll = (lambda number: {'pk': dataset.poll()})
+    user = (lambda number: {'user_id': dataset.user()})
+    return [
+        ('poll_list', 'GET', get('poll_view'), False),
+        ('poll_list_page', 'GET',
+         get('poll_view', query='?page_size=20'), False),
+        ('poll_detail', 'GET', get('poll_detail_view', poll), False),
+        ('poll_questions', 'GET',
+         get('poll_questions_view', poll, '?page_size=20'), False),
+        ('poll_results', 'GET', get('poll_results_view', poll), False),
+        ('user_answers', 'GET', get('user_answer_view', user), False),
+        ('user_answers_page', 'GET',
+         get('user_answer_view', user, '?page_size=5'), False),
+        ('user_answers_stream', 'GET',
+         get('user_answer_view', user, '?stream=1'), False),
+        ('user_poll', 'GET',
+         get('user_poll_view',
+             lambda number: {'user_id': dataset.user(),
+                             'poll_id': dataset.poll()}), False),
+        ('create_answer', 'POST', create_answer, False),
+        ('create_answer_batch', 'POST', create_answer_batch, False),
+        ('admin_poll_create', 'POST', create_poll, True),
+        ('admin_poll_update', 'PATCH', update_poll, True),
+        ('admin_question_create', 'POST', create_question, True),
+        ('admin_question_update', 'PUT', update_question, True),
+        ('admin_export', 'GET',
+         get('poll-export', lambda number: {'pk': dataset.poll()},
+             '?output=ndjson'), True),
+        ('admin_poll_delete', 'DELETE', delete_poll, True),
+    ]
+
+
+class ClientTransport:
+    """
+    Запросы через тестовый клиент Django, по клиенту на поток
+    """
+
+    def __init__(self, admin):
+        self.admin = admin
+        self.local = threading.local()
+        self.queries = QueryCounter()
+
+    def client(self, admin):
+        from django.test import Client
+        name = 'admin' if admin else 'anonymous'
+        if not hasattr(self.local, name):
+            client = Client()
+            if admin:
+                client.force_login(self.admin)
+            setattr(self.local, name, client)
+        return getattr(self.local, name)
+
+    def request(self, method, path, body, admin):
+        client = self.client(admin)
+        queries = self.queries.value
+        started = time.perf_counter()
+        response = getattr(client, method.lower())(
+            path, json.dumps(body) if body is not None else None,
+            content_type='application/json'
+        )
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+        latency = time.perf_counter() - started
+        return (latency, response.status_code,
+                self.queries.value - queries, content)
+
+
+class HttpTransport:
+    """
+    Запросы к запущенному серверу, по соединению keep-alive на поток
+    """
+
+    def __init__(self, url, admin=None):
+        url = urllib.parse.urlsplit(url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.authorization = None
+        if admin:
+            self.authorization = 'Basic ' + base64.b64encode(
+                admin.encode()
+            ).decode()
+        self.local = threading.local()
+
+    def request(self, method, path, body, admin):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection(self.host,
+                                                               self.port)
+        headers = {'Content-Type': 'application/json'}
+        if admin and self.authorization:
+            headers['Authorization'] = self.authorization
+        started = time.perf_counter()
+        self.local.connection.request(
+            method, path,
+            json.dumps(body).encode() if body is not None else None,
+            headers
+        )
+        response = self.local.connection.getresponse()
+        content = response.read()
+        latency = time.perf_counter() - started
+        return latency, response.status, None, content
+
+
+def run_scenario(transport, scenario, args, count):
+    name, method, build, admin = scenario
+    requests = [build(number) for number in range(count)]
+
+    def request(item):
+        path, body = item
+        return transport.request(method, path, body, admin)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(request, requests))
+    elapsed = time.perf_counter() - started
+    result = {'scenario': name, 'method': method}
+    result.update(latency_summary([latency for latency, *_ in results],
+                                  [status for _, status, *_ in results],
+                                  elapsed))
+    queries = [count for _, _, count, _ in results if count is not None]
+    result['queries_per_request'] = (
+        round(sum(queries) / len(queries), 2) if queries else None
+    )
+    return result, results
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    dataset = Dataset(args, rng)
+    seeded = {}
+    if not args.no_seed:
+        seeded = seed(dataset, args.batch_size)
+    dataset.load()
+    dataset.scratch_polls = scratch_polls(args.concurrency)
+
+    if args.url:
+        transport = HttpTransport(args.url, args.admin)
+    else:
+        from django.contrib.auth import get_user_model
+        admin = get_user_model().objects.create_superuser(
+            username='bench', email='bench@example.com', password='bench'
+        )
+        transport = ClientTransport(admin)
+
+    results = []
+    for scenario in scenarios(dataset):
+        name, _, _, admin = scenario
+        if args.only and name not in args.only:
+            continue
+        if admin and args.url and not args.admin:
+            continue
+        count = args.requests
+        if name == 'admin_poll_delete':
+            # удаляются опросы, созданные в admin_poll_create
+            count = min(count, len(dataset.created_polls))
+            if not count:
+                continue
+        result, responses = run_scenario(transport, scenario, args, count)
+        if name == 'admin_poll_create':
+            dataset.created_polls = [
+                json.loads(content)['poll_id']
+                for _, status, _, content in responses if status == 201
+            ]
+        results.append(result)
+        print(json.dumps(result), file=sys.stderr)
+    return {
+        'meta': {
+            'transport': 'http' if args.url else 'client',
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'polls': args.polls,
+            'questions': args.questions,
+            'choices': args.choices,
+            'users': args.users,
+            'polls_per_user': args.polls_per_user,
+            'seeded': seeded,
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """
+    Регрессии относительно прошлого отчёта: рост p95 больше threshold
+    или рост числа запросов к базе больше QUERIES_TOLERANCE
+    """
+    previous = {result['scenario']: result for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        before = previous.get(result['scenario'])
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            regressions.append(
+                f"{result['scenario']}: p95 {before['p95_ms']} -> "
+                f"{result['p95_ms']} мс"
+            )
+        if (result['queries_per_request'] is not None and
+                before['queries_per_request'] is not None and
+                result['queries_per_request'] >
+                before['queries_per_request'] + QUERIES_TOLERANCE):
+            regressions.append(
+                f"{result['scenario']}: запросов к базе "
+                f"{before['queries_per_request']} -> "
+                f"{result['queries_per_request']}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', help='Адрес запущенного сервера')
+    parser.add_argument('--admin', help='логин:пароль администратора '
+                                        'для --url')
+    parser.add_argument('--no-seed', action='store_true',
+                        help='Не заполнять базу (только с --url)')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Запросов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--only', nargs='*', help='Только эти сценарии')
+    parser.add_argument('--polls', type=int, default=100)
+    parser.add_argument('--questions', type=int, default=10,
+                        help='Вопросов в опросе')
+    parser.add_argument('--choices', type=int, default=4,
+                        help='Вариантов в вопросе с выбором')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--polls-per-user', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Зерно генератора данных')
+    parser.add_argument('--output', help='Файл для отчёта JSON')
+    parser.add_argument('--compare', help='Отчёт прошлого запуска')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Допустимый рост p95, доля')
+    args = parser.parse_args()
+    if args.no_seed and not args.url:
+        parser.error('--no-seed используется только с --url')
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.url:
+            setup()
+        else:
+            setup(os.path.join(directory, 'bench.sqlite3'),
+                  ALLOWED_HOSTS=['testserver'])
+        report = run(args)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        for regression in regressions:
+            print(regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
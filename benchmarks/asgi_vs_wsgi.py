@@ -0,0 +1,179 @@
+"""
+Сравнение асинхронного пути (ASGI) с синхронным (WSGI) на приёме ответов.
+
+Приложение вызывается в том же процессе, без HTTP-сервера: WSGI-запросы
+выполняются пулом потоков размером --wsgi-threads, как у воркера
+с потоками, ASGI-запросы - задачами asyncio, до --concurrency
+одновременно. Опция --db-latency добавляет задержку к каждому запросу
+к базе, чтобы SQLite вёл себя как сетевая база.
+
+    python benchmarks/asgi_vs_wsgi.py --requests 2000 --db-latency 2
+
+С --buffer ответы пишутся через отложенную запись пачками
+(POLLS_ANSWER_BUFFER), в результат добавляются её метрики.
+
+Результат печатается в JSON.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import add_db_latency, latency_summary, setup
+
+
+def summary(mode, latencies, statuses, elapsed):
+    return dict(mode=mode, **latency_summary(latencies, statuses, elapsed))
+
+
+def seed():
+    from django.core.management import call_command
+    from polls.models import Poll, Question
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    poll = Poll.objects.create(title='bench', description='bench',
+                               start_date='2021-01-01',
+                               end_date='2999-01-01')
+    question = Question.objects.create(poll=poll, question_text='name',
+                                       question_type='TEXT')
+    return poll.id, question.id
+
+
+def answer_body(user_id, question_id):
+    return json.dumps({'user_id': user_id, 'question': question_id,
+                       'answer_text': 'bench'}).encode()
+
+
+def run_wsgi(args, poll_id, question_id):
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    path = f'/api/v1/polls/{poll_id}/answer/'
+
+    def request(user_id):
+        body = answer_body(user_id, question_id)
+        environ = {
+            'REQUEST_METHOD': 'POST', 'PATH_INFO': path,
+            'SCRIPT_NAME': '', 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'localhost',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+            'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status = []
+        started = time.perf_counter()
+        response = application(environ,
+                               lambda code, headers: status.append(code))
+        b''.join(response)
+        response.close()
+        return time.perf_counter() - started, int(status[0].split()[0])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.wsgi_threads) as pool:
+        results = list(pool.map(request, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return summary('wsgi', [latency for latency, _ in results],
+                   [status for _, status in results], elapsed)
+
+
+def run_asgi(args, poll_id, question_id):
+    from django.core.asgi import get_asgi_application
+    application = get_asgi_application()
+    path = f'/api/v1/polls/{poll_id}/answer/'
+
+    async def request(user_id, semaphore):
+        body = answer_body(user_id, question_id)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'},
+            'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'',
+            'root_path': '', 'client': ('127.0.0.1', 1000 + user_id),
+            'server': ('localhost', 80),
+            'headers': [(b'host', b'localhost'),
+                        (b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode())],
+        }
+        status = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body,
+                    'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        async with semaphore:
+            started = time.perf_counter()
+            await application(scope, receive, send)
+            return time.perf_counter() - started, status[0]
+
+    async def main():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        return await asyncio.gather(*(request(user_id, semaphore)
+                                      for user_id in range(args.requests)))
+
+    started = time.perf_counter()
+    results = asyncio.run(main())
+    elapsed = time.perf_counter() - started
+    return summary('asgi', [latency for latency, _ in results],
+                   [status for _, status in results], elapsed)
+
+
+def run_mode(args):
+    with tempfile.TemporaryDirectory() as directory:
+        setup(os.path.join(directory, 'bench.sqlite3'))
+        add_db_latency(args.db_latency)
+        poll_id, question_id = seed()
+        run = run_asgi if args.mode == 'asgi' else run_wsgi
+        result = run(args, poll_id, question_id)
+        if args.buffer:
+            from polls.buffer import get_answer_buffer
+            from polls.models import Answer
+            buffer = get_answer_buffer()
+            buffer.stop()
+            result['buffer'] = buffer.metrics()
+            result['written'] = Answer.objects.count()
+        print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mode', choices=('wsgi', 'asgi'))
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help='Одновременных запросов для ASGI')
+    parser.add_argument('--wsgi-threads', type=int, default=8,
+                        help='Потоков воркера для WSGI')
+    parser.add_argument('--db-latency', type=float, default=0,
+                        help='Задержка каждого запроса к базе, мс')
+    parser.add_argument('--buffer', action='store_true',
+                        help='Отложенная запись ответов пачками')
+    args = parser.parse_args()
+    if args.buffer:
+        os.environ['POLLS_ANSWER_BUFFER'] = '1'
+    if args.mode:
+        run_mode(args)
+        return
+    results = []
+    for mode in ('wsgi', 'asgi'):
+        env = dict(os.environ,
+                   POLLS_ASYNC_VIEWS='1' if mode == 'asgi' else '0')
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode] + sys.argv[1:],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Общие части бенчмарков: настройка Django на отдельной базе,
+задержка и подсчёт запросов к базе, перцентили задержек.
+"""
+import os
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup(database=None, **overrides):
+    """
+    Настраивает Django. database - путь к файлу SQLite для замера,
+    overrides - настройки, которые подменяются до django.setup()
+    """
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fabr.settings')
+    if database is not None:
+        os.environ['DJANGO_DB_ENGINE'] = 'sqlite3'
+        os.environ['DJANGO_DB_NAME'] = database
+    from django.conf import settings
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+
+    import django
+    django.setup()
+
+
+def add_db_latency(milliseconds):
+    """
+    Задержка перед каждым запросом к базе, чтобы SQLite вела себя
+    как сетевая база
+    """
+    from django.db.backends.signals import connection_created
+
+    def add_latency(execute, sql, params, many, context):
+        time.sleep(milliseconds / 1000)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(add_latency)
+
+    if milliseconds:
+        connection_created.connect(install, weak=False)
+
+
+class QueryCounter:
+    """
+    Число запросов к базе в текущем потоке
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        from django.db.backends.signals import connection_created
+        connection_created.connect(self.install, weak=False)
+
+    def install(self, sender, connection, **kwargs):
+        # при переподключении обёртка уже стоит
+        if self.count not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self.count)
+
+    def count(self, execute, sql, params, many, context):
+        self.local.queries = self.value + 1
+        return execute(sql, params, many, context)
+
+    @property
+    def value(self):
+        return getattr(self.local, 'queries', 0)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def latency_summary(latencies, statuses, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if status >= 400),
+        'throughput': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
@@ -0,0 +1,147 @@
+"""
+Параллельные чтения и записи SQLite до и после настройки профиля базы.
+
+"before" - соединение на каждую операцию и журнал отката без прагм,
+как было раньше; "after" - профиль по умолчанию из fabr/settings.py:
+долгоживущие соединения, WAL, synchronous=NORMAL, busy_timeout и mmap.
+Читатели запрашивают итоги опроса и ответы пользователя, писатели
+сохраняют ответы по одному, каждый в своей транзакции.
+
+    python benchmarks/db_profile.py --seconds 10 --readers 8 --writers 4
+
+Результат печатается в JSON.
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from common import setup
+
+PROFILES = ('before', 'after')
+
+
+def setup_profile(profile, database):
+    os.environ['DJANGO_DB_CONN_MAX_AGE'] = (
+        '0' if profile == 'before' else '60'
+    )
+    if profile == 'before':
+        setup(database, POLLS_SQLITE_PRAGMAS={})
+    else:
+        setup(database)
+
+
+def seed(users):
+    from django.core.management import call_command
+    from polls.models import Answer, Poll, Question
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    poll = Poll.objects.create(title='bench', description='bench',
+                               start_date='2021-01-01',
+                               end_date='2999-01-01')
+    question = Question.objects.create(poll=poll, question_text='name',
+                                       question_type='TEXT')
+    Answer.objects.bulk_create(
+        Answer(user_id=user_id, poll=poll, question=question,
+               answer_text='bench')
+        for user_id in range(users)
+    )
+    return poll.id, question.id
+
+
+def worker(operation, deadline, per_request, counts, lock):
+    from django.db import OperationalError, close_old_connections
+    done = errors = 0
+    number = 0
+    while time.perf_counter() < deadline:
+        number += 1
+        try:
+            operation(number)
+            done += 1
+        except OperationalError:
+            # database is locked
+            errors += 1
+        finally:
+            if per_request:
+                close_old_connections()
+    with lock:
+        counts['ops'] += done
+        counts['errors'] += errors
+
+
+def run_profile(args):
+    with tempfile.TemporaryDirectory() as directory:
+        setup_profile(args.profile,
+                      os.path.join(directory, 'bench.sqlite3'))
+        poll_id, question_id = seed(args.users)
+
+        from polls.models import Answer
+        from polls.results import poll_results
+        from polls.views import iter_user_polls
+
+        def read(number):
+            poll_results(poll_id)
+            list(iter_user_polls(number % args.users))
+
+        user_ids = itertools.count(args.users)
+
+        def write(number):
+            Answer.objects.create(user_id=next(user_ids),
+                                  poll_id=poll_id, question_id=question_id,
+                                  answer_text='bench')
+
+        reads = {'ops': 0, 'errors': 0}
+        writes = {'ops': 0, 'errors': 0}
+        lock = threading.Lock()
+        per_request = args.profile == 'before'
+        deadline = time.perf_counter() + args.seconds
+        threads = (
+            [threading.Thread(target=worker,
+                              args=(read, deadline, per_request, reads, lock))
+             for _ in range(args.readers)] +
+            [threading.Thread(target=worker,
+                              args=(write, deadline, per_request, writes,
+                                    lock))
+             for _ in range(args.writers)]
+        )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(json.dumps({
+            'profile': args.profile,
+            'reads_per_second': round(reads['ops'] / args.seconds, 1),
+            'writes_per_second': round(writes['ops'] / args.seconds, 1),
+            'read_errors': reads['errors'],
+            'write_errors': writes['errors'],
+        }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--profile', choices=PROFILES)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--users', type=int, default=1000,
+                        help='Пользователей с ответами перед замером')
+    args = parser.parse_args()
+    if args.profile:
+        run_profile(args)
+        return
+    results = []
+    for profile in PROFILES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--profile', profile] + sys.argv[1:],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
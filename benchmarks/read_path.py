@@ -0,0 +1,118 @@
+"""
+Сборка ответов списка опросов и детального опроса: сериализаторы DRF
+с JSONRenderer против строк .values() с FastJSONRenderer (polls/payloads.py).
+
+Кэш не участвует: каждый повтор собирает ответ из базы и рендерит его
+в JSON, как при промахе снимка или на странице списка. Перед замером
+выводы сверяются байт в байт.
+
+    python benchmarks/read_path.py --polls 500 --questions 20 --choices 5
+
+Результат печатается в JSON.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from common import setup
+
+
+def seed(args):
+    from django.core.management import call_command
+    from polls.models import Poll, Question, QuestionChoice
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    Poll.objects.bulk_create(
+        Poll(title=f'Опрос {number}', description='Описание опроса',
+             start_date='2021-01-01', end_date='2999-01-01')
+        for number in range(args.polls)
+    )
+    poll = Poll.objects.order_by('id').first()
+    Question.objects.bulk_create(
+        Question(poll=poll, question_text=f'Вопрос {number}',
+                 question_type='MULTICHOICE')
+        for number in range(args.questions)
+    )
+    QuestionChoice.objects.bulk_create(
+        QuestionChoice(question=question, choice_text=f'Вариант {number}')
+        for question in Question.objects.filter(poll=poll)
+        for number in range(args.choices)
+    )
+    return poll.id
+
+
+def old_list():
+    from polls.models import Poll
+    from polls.serializers import PollSerializer
+    from rest_framework.renderers import JSONRenderer
+    data = PollSerializer(Poll.objects.all(), many=True).data
+    return JSONRenderer().render(data, 'application/json')
+
+
+def new_list():
+    from polls.models import Poll
+    from polls.payloads import POLL_FIELDS, poll_list
+    from polls.renderers import FastJSONRenderer
+    data = poll_list(Poll.objects.values(*POLL_FIELDS))
+    return FastJSONRenderer().render(data, 'application/json')
+
+
+def old_detail(poll_id):
+    from polls.models import Poll
+    from polls.serializers import PollDetailSerializer
+    from rest_framework.renderers import JSONRenderer
+    poll = Poll.objects.prefetch_related(
+        'poll_questions__question_choice'
+    ).get(id=poll_id)
+    return JSONRenderer().render(PollDetailSerializer(poll).data,
+                                 'application/json')
+
+
+def new_detail(poll_id):
+    from polls.payloads import poll_detail
+    from polls.renderers import FastJSONRenderer
+    return FastJSONRenderer().render(poll_detail(poll_id),
+                                     'application/json')
+
+
+def measure(func, repeat):
+    func()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = time.perf_counter() - started
+    return {'ms': round(elapsed / repeat * 1000, 3)}
+
+
+def compare(name, old, new, repeat):
+    if old() != new():
+        raise SystemExit(f'{name}: ответы различаются')
+    before = measure(old, repeat)
+    after = measure(new, repeat)
+    return {'scenario': name, 'serializer': before, 'values': after,
+            'speedup': round(before['ms'] / after['ms'], 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--polls', type=int, default=500)
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--choices', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup(os.path.join(directory, 'bench.sqlite3'),
+              POLLS_SERVER_TIMING=False)
+        poll_id = seed(args)
+        results = [
+            compare('poll_list', old_list, new_list, args.repeat),
+            compare('poll_detail', lambda: old_detail(poll_id),
+                    lambda: new_detail(poll_id), args.repeat),
+        ]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.metrics.MetricsMiddleware',
+    'polls.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,17 +74,237 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'fabr.wsgi.application'
 
+ASGI_APPLICATION = 'fabr.asgi.application'
+
+# Асинхронные представления для горячих эндпоинтов, включаются в fabr/asgi.py.
+# Число потоков ограничивает одновременную работу с базой
+POLLS_ASYNC_VIEWS = os.environ.get('POLLS_ASYNC_VIEWS') == '1'
+POLLS_ASYNC_DB_THREADS = int(os.environ.get('POLLS_ASYNC_DB_THREADS', 16))
+
+# Отложенная запись ответов: ответы копятся в очереди процесса
+# и пишутся пачками раз в POLLS_ANSWER_FLUSH_INTERVAL мс или по
+# POLLS_ANSWER_BATCH_SIZE штук. При полной очереди запрос ждёт до
+# POLLS_ANSWER_BUFFER_TIMEOUT секунд и получает 503
+POLLS_ANSWER_BUFFER = os.environ.get('POLLS_ANSWER_BUFFER') == '1'
+POLLS_ANSWER_BUFFER_SIZE = int(os.environ.get('POLLS_ANSWER_BUFFER_SIZE',
+                                              10000))
+POLLS_ANSWER_BATCH_SIZE = int(os.environ.get('POLLS_ANSWER_BATCH_SIZE', 500))
+POLLS_ANSWER_FLUSH_INTERVAL = int(os.environ.get(
+    'POLLS_ANSWER_FLUSH_INTERVAL', 50
+))
+POLLS_ANSWER_BUFFER_TIMEOUT = float(os.environ.get(
+    'POLLS_ANSWER_BUFFER_TIMEOUT', 1
+))
+# Неудачная запись пачки повторяется с удвоением паузы начиная
+# с POLLS_ANSWER_RETRY_DELAY мс; после POLLS_ANSWER_FLUSH_RETRIES повторов
+# подряд пачка отбрасывается (метрика polls_answer_buffer_dropped_total)
+POLLS_ANSWER_FLUSH_RETRIES = int(os.environ.get('POLLS_ANSWER_FLUSH_RETRIES',
+                                                5))
+POLLS_ANSWER_RETRY_DELAY = int(os.environ.get('POLLS_ANSWER_RETRY_DELAY', 100))
+
+# Выборы пользователя в вопросе MULTICHOICE хранятся одной строкой
+# с упакованными id вариантов вместо строки на каждый выбор.
+# Старые строки сворачивает команда compact_multichoice
+POLLS_COMPACT_MULTICHOICE = os.environ.get('POLLS_COMPACT_MULTICHOICE') == '1'
+
+# Ограничение приёма ответов. Корзины токенов на IP клиента и на user_id
+# хранятся в кэше POLLS_THROTTLE_CACHE: токены пополняются со скоростью
+# RATE в секунду до BURST, пустая корзина - 429. Больше
+# POLLS_ANSWER_CONCURRENCY одновременных запросов в процессе - сразу 503.
+# 0 отключает ограничение
+POLLS_THROTTLE_CACHE = 'throttle'
+POLLS_ANSWER_THROTTLE_RATE_IP = float(os.environ.get(
+    'POLLS_ANSWER_THROTTLE_RATE_IP', 0
+))
+POLLS_ANSWER_THROTTLE_BURST_IP = int(os.environ.get(
+    'POLLS_ANSWER_THROTTLE_BURST_IP', 20
+))
+POLLS_ANSWER_THROTTLE_RATE_USER = float(os.environ.get(
+    'POLLS_ANSWER_THROTTLE_RATE_USER', 0
+))
+POLLS_ANSWER_THROTTLE_BURST_USER = int(os.environ.get(
+    'POLLS_ANSWER_THROTTLE_BURST_USER', 10
+))
+POLLS_ANSWER_CONCURRENCY = int(os.environ.get('POLLS_ANSWER_CONCURRENCY', 0))
+
+# IP клиента для ограничений: при DJANGO_NUM_PROXIES=N берётся N-й адрес
+# с конца X-Forwarded-For (его дописал доверенный прокси), при 0 -
+# REMOTE_ADDR. Без этого ключом был бы заголовок, который задаёт клиент
+REST_FRAMEWORK = {
+    'NUM_PROXIES': int(os.environ.get('DJANGO_NUM_PROXIES', 0)),
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# Профиль базы задаётся окружением: DJANGO_DB_ENGINE=postgresql
+# и параметры подключения. CONN_MAX_AGE держит соединение между запросами
+# (None - без ограничения, 0 - как раньше, для внешнего пула pgbouncer)
+
+DB_ENGINE = os.environ.get('DJANGO_DB_ENGINE', 'sqlite3')
+DB_CONN_MAX_AGE = os.environ.get('DJANGO_DB_CONN_MAX_AGE', '60')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DJANGO_DB_NAME', 'fabr'),
+            'USER': os.environ.get('DJANGO_DB_USER', 'fabr'),
+            'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', ''),
+            'HOST': os.environ.get('DJANGO_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DJANGO_DB_PORT', '5432'),
+            'CONN_MAX_AGE': (None if DB_CONN_MAX_AGE == 'none'
+                             else int(DB_CONN_MAX_AGE)),
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get(
+                    'DJANGO_DB_CONNECT_TIMEOUT', 5
+                )),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DJANGO_DB_NAME',
+                                   os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': (None if DB_CONN_MAX_AGE == 'none'
+                             else int(DB_CONN_MAX_AGE)),
+            'OPTIONS': {
+                # ожидание блокировки записи, секунды
+                'timeout': 5,
+            },
+        }
     }
+
+# Архив ответов закрытых опросов (polls/archive.py) - отдельная база
+# с теми же параметрами подключения, в неё попадает только ArchivedAnswer
+DATABASES['archive'] = dict(
+    DATABASES['default'],
+    NAME=os.environ.get('DJANGO_ARCHIVE_DB_NAME', (
+        'fabr_archive' if DB_ENGINE == 'postgresql'
+        else os.path.join(BASE_DIR, 'archive.sqlite3')
+    )),
+)
+DATABASE_ROUTERS = ['polls.routers.ArchiveRouter']
+
+# Проверка долгоживущего соединения в начале запроса: соединение,
+# разорванное сервером базы, открывается заново до первого запроса
+POLLS_DB_HEALTH_CHECKS = os.environ.get('DJANGO_DB_HEALTH_CHECKS', '1') == '1'
+
+# Настройки SQLite для каждого нового соединения: WAL не блокирует
+# читателей на время записи, synchronous=NORMAL в WAL безопасен
+# и не делает fsync на каждый коммит
+POLLS_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# При нескольких процессах нужен общий бэкенд (файловый, memcached),
+# иначе сброс снимков опросов не дойдёт до остальных воркеров
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'DJANGO_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'fabr'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('DJANGO_CACHE_MAX_ENTRIES',
+                                              10000)),
+            'CULL_FREQUENCY': int(os.environ.get('DJANGO_CACHE_CULL_FREQUENCY',
+                                                 3)),
+        },
+    },
+    # корзины ограничения приёма ответов, отдельно от снимков опросов.
+    # Для нескольких процессов на одном сервере - FileBasedCache
+    'throttle': {
+        'BACKEND': os.environ.get(
+            'DJANGO_THROTTLE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('DJANGO_THROTTLE_CACHE_LOCATION',
+                                   'fabr-throttle'),
+    },
+}
+
+# Время жизни скомпилированных схем, готовых снимков опросов и версий
+# для ETag, секунды.
+# LocMemCache у каждого процесса свой, и сброс после изменения опроса
+# доходит только до процесса, который его изменил: остальные отдают
+# старые данные до конца срока. Поэтому с ним срок - минута, а для
+# нескольких процессов задайте общий кэш в DJANGO_CACHE_BACKEND
+POLLS_CACHE_TIMEOUT = 60 if CACHES['default']['BACKEND'].endswith(
+    '.LocMemCache'
+) else 60 * 60
+POLLS_SCHEMA_TIMEOUT = int(os.environ.get('POLLS_SCHEMA_TIMEOUT',
+                                          POLLS_CACHE_TIMEOUT))
+POLLS_SNAPSHOT_TIMEOUT = int(os.environ.get('POLLS_SNAPSHOT_TIMEOUT',
+                                            POLLS_CACHE_TIMEOUT))
+POLLS_VERSION_TIMEOUT = int(os.environ.get('POLLS_VERSION_TIMEOUT',
+                                           POLLS_CACHE_TIMEOUT))
+
+# Метрики запросов: заголовок Server-Timing (выключен: отдаёт клиентам
+# число и время запросов к базе), число самых медленных запросов к базе
+# в логе. Превышение query_budget представления пишет предупреждение в лог
+# polls.instrumentation, а в строгом режиме роняет запрос; тесты
+# запускаются в строгом режиме (fabr.test_runner)
+POLLS_SERVER_TIMING = os.environ.get('POLLS_SERVER_TIMING') == '1'
+POLLS_SLOW_QUERIES = 3
+POLLS_QUERY_BUDGET_STRICT = os.environ.get('POLLS_QUERY_BUDGET_STRICT') == '1'
+
+TEST_RUNNER = 'fabr.test_runner.StrictQueryBudgetRunner'
+
+# Метрики для сборщика на /metrics. При нескольких процессах-воркерах
+# нужен общий каталог POLLS_METRICS_DIR, который очищается при запуске
+# сервиса; без него каждый процесс отдаёт только свои метрики
+POLLS_METRICS_DIR = os.environ.get('POLLS_METRICS_DIR')
+POLLS_METRICS_FLUSH_INTERVAL = 1
+POLLS_METRICS_TOKEN = os.environ.get('POLLS_METRICS_TOKEN')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'polls': {
+            'handlers': ['console'],
+            # DEBUG - метрики каждого запроса
+            'level': os.environ.get('POLLS_LOG_LEVEL', 'INFO'),
+        },
+    },
 }
 
+# Размер страницы курсорной пагинации по умолчанию и наибольший
+POLLS_PAGE_SIZE = 50
+POLLS_MAX_PAGE_SIZE = 500
+
+# Наибольшее число ответов в одном запросе на приём ответов
+POLLS_MAX_ANSWERS_PER_REQUEST = 500
+
+# До скольких строк админка считает ответы точно, дальше - оценка
+POLLS_ADMIN_COUNT_LIMIT = 10000
+# Вопросов опроса на одной странице админки
+POLLS_ADMIN_QUESTIONS_PER_PAGE = 20
+
+# Ответы опроса переносятся в архив через столько дней после окончания,
+# копируются и удаляются порциями по POLLS_ARCHIVE_CHUNK_SIZE строк
+POLLS_ARCHIVE_GRACE_DAYS = 30
+POLLS_ARCHIVE_CHUNK_SIZE = 2000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -103,6 +325,9 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.0/topics/i18n/
 
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class StrictQueryBudgetRunner(DiscoverRunner):
+    """
+    Тесты идут в строгом режиме: превышение query_budget представления
+    роняет запрос исключением QueryBudgetExceeded
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.query_budget_strict = settings.POLLS_QUERY_BUDGET_STRICT
+        settings.POLLS_QUERY_BUDGET_STRICT = True
+
+    def teardown_test_environment(self, **kwargs):
+        settings.POLLS_QUERY_BUDGET_STRICT = self.query_budget_strict
+        super().teardown_test_environment(**kwargs)
@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.urls import include, path
+from polls.metrics import metrics_view
 
 urlpatterns = [
     path('api/v1/', include('polls.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -1,19 +1,137 @@
 import nested_admin
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Max, Prefetch
+from django.utils.functional import cached_property
 
 from .models import Answer, Poll, Question, QuestionChoice
+from .results import discard_answers, record_answers
+from .versions import bump_user_versions
+
+
+ADMIN_QUESTIONS_PER_PAGE = getattr(settings,
+                                   'POLLS_ADMIN_QUESTIONS_PER_PAGE', 20)
+QUESTIONS_PAGE_PARAM = 'questions_page'
+
+
+def questions_page(request):
+    page = request.GET.get(QUESTIONS_PAGE_PARAM, '')
+    return max(int(page), 1) if page.isdigit() else 1
+
+
+class LoadedObjectField(forms.ModelChoiceField):
+    """
+    Скрытое поле pk формы набора: объект берётся из уже загруженных
+    набором, без запроса на каждую форму
+    """
+
+    def __init__(self, formset, *args, **kwargs):
+        self.formset = formset
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            pk = self.formset._get_to_python(self.formset._pk_field)(value)
+        except ValidationError:
+            return super().to_python(value)
+        obj = self.formset._existing_object(pk)
+        return obj if obj is not None else super().to_python(value)
+
+
+class ChangedFormsMixin:
+    """
+    Сохраняет только изменённые и удалённые формы. nested_admin
+    загружает из базы объект каждой формы, даже неизменённой; без
+    сортировки формы не переносятся между родителями, и это не нужно
+    """
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        name = self._pk_field.name
+        field = form.fields[name]
+        if isinstance(field, forms.ModelChoiceField):
+            form.fields[name] = LoadedObjectField(
+                self, field.queryset, initial=field.initial,
+                required=False, widget=field.widget
+            )
+
+    def save_existing_objects(self, initial_forms=None, commit=True):
+        initial_forms = [form for form in initial_forms or []
+                         if form.has_changed() or
+                         self._should_delete_form(form)]
+        return super().save_existing_objects(initial_forms, commit)
+
+
+class QuestionChoiceFormSet(ChangedFormsMixin,
+                            nested_admin.formsets.NestedInlineFormSet):
+    """
+    Варианты ответа из prefetch_related вопроса, без запроса
+    на каждый вопрос
+    """
+
+    def get_queryset(self):
+        cache = getattr(self.instance, '_prefetched_objects_cache', {})
+        if 'question_choice' in cache:
+            return cache['question_choice']
+        return super().get_queryset()
+
+
+class QuestionPageFormSet(ChangedFormsMixin,
+                          nested_admin.formsets.NestedInlineFormSet):
+    """
+    Одна страница вопросов опроса. При сохранении берутся вопросы,
+    чьи формы пришли в запросе
+    """
+    page = 1
+    per_page = ADMIN_QUESTIONS_PER_PAGE
+
+    def get_queryset(self):
+        if not hasattr(self, '_page_queryset'):
+            queryset = self.queryset.order_by('id')
+            if self.is_bound:
+                pk_values = [
+                    self.data.get(f'{self.add_prefix(i)}-id', '')
+                    for i in range(self.initial_form_count())
+                ]
+                queryset = queryset.filter(pk__in=[
+                    pk for pk in pk_values if pk.isdigit()
+                ])
+            else:
+                start = (self.page - 1) * self.per_page
+                queryset = queryset[start:start + self.per_page]
+            self._page_queryset = queryset
+        return self._page_queryset
 
 
 class QuestionChoiceInLine(nested_admin.NestedStackedInline):
     model = QuestionChoice
+    formset = QuestionChoiceFormSet
     extra = 0
 
 
 class QuestionInline(nested_admin.NestedStackedInline):
     model = Question
+    formset = QuestionPageFormSet
     extra = 0
     inlines = [QuestionChoiceInLine]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('question_choice',
+                     queryset=QuestionChoice.objects.order_by('id'))
+        )
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.page = questions_page(request)
+        return formset
+
 
 class PollAdmin(nested_admin.NestedModelAdmin):
     list_display = ('id', 'title', 'description', 'start_date', 'end_date',)
@@ -21,6 +139,30 @@ class PollAdmin(nested_admin.NestedModelAdmin):
     list_filter = ('id', 'title', 'description', 'start_date', 'end_date')
     inlines = [QuestionInline]
 
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        # вопросы выводятся страницами, остальные загружаются по ссылкам
+        extra_context = extra_context or {}
+        if object_id.isdigit():
+            paginator = Paginator(
+                Question.objects.filter(poll_id=object_id).order_by('id'),
+                ADMIN_QUESTIONS_PER_PAGE
+            )
+            extra_context['questions_pages'] = paginator.page_range
+            extra_context['questions_page'] = questions_page(request)
+            extra_context['questions_page_param'] = QUESTIONS_PAGE_PARAM
+        return super().change_view(request, object_id, form_url,
+                                   extra_context)
+
+    def response_change(self, request, obj):
+        response = super().response_change(request, obj)
+        page = request.GET.get(QUESTIONS_PAGE_PARAM)
+        if '_continue' in request.POST and page and response.has_header(
+                'Location'):
+            separator = '&' if '?' in response['Location'] else '?'
+            response['Location'] += (f'{separator}{QUESTIONS_PAGE_PARAM}='
+                                     f'{page}')
+        return response
+
     def get_readonly_fields(self, request, obj=None):
         readonly_fields = super().get_readonly_fields(request, obj=obj)
         if obj:  # если редактируем, то начало опроса нельзя изменить
@@ -28,10 +170,119 @@ class PollAdmin(nested_admin.NestedModelAdmin):
         return readonly_fields
 
 
+ADMIN_COUNT_LIMIT = getattr(settings, 'POLLS_ADMIN_COUNT_LIMIT', 10000)
+
+
+def estimate_rows(model):
+    """
+    Примерное число строк таблицы без COUNT(*): статистика PostgreSQL
+    или наибольший id
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class '
+                           'WHERE oid = %s::regclass',
+                           [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 или 0, пока таблицу не анализировали
+        if row and row[0] > 0:
+            return int(row[0])
+    return model.objects.aggregate(Max('id'))['id__max'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Точно считает не больше ADMIN_COUNT_LIMIT строк. Для всей таблицы
+    сверх этого берётся оценка, для отфильтрованного списка - предел
+    """
+
+    @cached_property
+    def count(self):
+        count = self.object_list[:ADMIN_COUNT_LIMIT + 1].count()
+        if count <= ADMIN_COUNT_LIMIT:
+            return count
+        if self.object_list.query.where:
+            return ADMIN_COUNT_LIMIT
+        return max(estimate_rows(self.object_list.model), count)
+
+
+class PollQuestionFilter(admin.RelatedFieldListFilter):
+    """
+    Вопросы только выбранного опроса: все вопросы базы в фильтр
+    не помещаются
+    """
+
+    def field_choices(self, field, request, model_admin):
+        poll_id = request.GET.get('poll__id__exact', '')
+        if not poll_id.isdigit():
+            return []
+        return field.get_choices(include_blank=False,
+                                 limit_choices_to={'poll_id': poll_id})
+
+
 class AnswerAdmin(admin.ModelAdmin):
-    list_display = ('user_id', 'poll', 'question', 'choice', 'answer_text')
-    search_fields = ('user_id', 'poll', 'question', 'choice', 'answer_text')
-    list_filter = ('user_id', 'poll', 'question', 'choice', 'answer_text')
+    """
+    Список ответов для больших таблиц: связанные объекты одним
+    запросом, фильтры и поиск только по индексированным полям,
+    число строк без полного COUNT(*)
+    """
+    list_display = ('user_id', 'poll', 'question', 'answer_choice',
+                    'answer_text')
+    list_select_related = ('poll', 'question', 'choice')
+    list_filter = ('poll', ('question', PollQuestionFilter))
+    search_fields = ('=user_id',)
+    autocomplete_fields = ('poll',)
+    raw_id_fields = ('question', 'choice')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @admin.display(description='Выбранный ответ')
+    def answer_choice(self, obj):
+        # у компактной строки MULTICHOICE только id выборов
+        return obj.choice or obj.selected_choices or None
+
+    def get_search_results(self, request, queryset, search_term):
+        # поиск только по ID пользователя, для него есть индекс
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if not search_term.isdigit():
+            return queryset.none(), False
+        return queryset.filter(user_id=int(search_term)), False
+
+    def save_model(self, request, obj, form, change):
+        # новый ответ учитывает сигнал сохранения, а при правке голос
+        # переносим сами: старая строка уходит из итогов, новая приходит
+        if not change:
+            super().save_model(request, obj, form, change)
+            return
+        fields = ('user_id', 'poll_id', 'question_id', 'choice_id',
+                  'choice_ids')
+        with transaction.atomic():
+            old = Answer.objects.select_for_update().only(*fields).get(
+                pk=obj.pk
+            )
+            super().save_model(request, obj, form, change)
+            if any(getattr(old, field) != getattr(obj, field)
+                   for field in fields):
+                discard_answers([old])
+                record_answers([obj])
+        bump_user_versions([old.user_id])
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            discard_answers([obj])
+        bump_user_versions([obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            answers = list(queryset.only('user_id', 'poll_id',
+                                         'question_id', 'choice_id',
+                                         'choice_ids'))
+            super().delete_queryset(request, queryset)
+            discard_answers(answers)
+        bump_user_versions(answer.user_id for answer in answers)
 
 
 admin.site.register(Poll, PollAdmin)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PollsConfig(AppConfig):
     name = 'polls'
+
+    def ready(self):
+        from . import checks, db, instrumentation, signals  # noqa: F401
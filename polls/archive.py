@@ -0,0 +1,152 @@
+"""
+Перенос ответов закрытых опросов в архивную базу.
+
+Опрос переносится, когда после его окончания прошло
+POLLS_ARCHIVE_GRACE_DAYS дней. Ответы копируются порциями, опрос
+помечается archived_at и перестаёт принимать ответы, затем каждая
+порция копируется заново с заменой (строка могла измениться после
+первого копирования), сверяется с архивом и только после этого
+удаляется из основной таблицы. Итоги и участие пользователей остаются
+в основной базе. Перенос можно прервать и запустить заново: опрос
+с оставшимися ответами переносится повторно
+"""
+import datetime as dt
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Answer, ArchivedAnswer, Poll
+from .routers import ARCHIVE_DATABASE
+from .signals import invalidate_poll
+
+ARCHIVE_GRACE_DAYS = getattr(settings, 'POLLS_ARCHIVE_GRACE_DAYS', 30)
+ARCHIVE_CHUNK_SIZE = getattr(settings, 'POLLS_ARCHIVE_CHUNK_SIZE', 2000)
+# удаление идёт по списку id, SQLite ограничивает число параметров
+DELETE_BATCH_SIZE = 500
+
+# поле архива: поле ответа в основной базе
+ARCHIVE_FIELDS = {
+    'id': 'id',
+    'user_id': 'user_id',
+    'poll_id': 'poll_id',
+    'question_id': 'question_id',
+    'question_type': 'question__question_type',
+    'question_text': 'question__question_text',
+    'choice_id': 'choice_id',
+    'choice_text': 'choice__choice_text',
+    'answer_text': 'answer_text',
+    'multichoice': 'multichoice',
+    'choice_ids': 'choice_ids',
+}
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def polls_to_archive(grace_days=ARCHIVE_GRACE_DAYS, today=None):
+    """
+    id опросов, закончившихся больше grace_days дней назад, которые ещё
+    не перенесены или у которых остались ответы в основной таблице
+    """
+    cutoff = (today or timezone.localdate()) - dt.timedelta(days=grace_days)
+    return Poll.objects.filter(end_date__lt=cutoff).filter(
+        Exists(Answer.objects.filter(poll_id=OuterRef('id'))) |
+        Q(archived_at__isnull=True)
+    ).order_by('id').values_list('id', flat=True)
+
+
+def iter_answer_ids(poll_id, chunk_size):
+    """
+    id ответов опроса порциями по возрастанию
+    """
+    answers = Answer.objects.filter(poll_id=poll_id).order_by('id')
+    last_id = 0
+    while True:
+        ids = list(answers.filter(id__gt=last_id)
+                   .values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def chunk_answers(poll_id, ids):
+    return Answer.objects.filter(poll_id=poll_id,
+                                 id__gte=ids[0], id__lte=ids[-1])
+
+
+def copy_answers(answers, replace=False):
+    """
+    Копирует ответы в архив. Уже скопированные пропускаются, а с replace
+    заменяются текущими строками
+    """
+    rows = [ArchivedAnswer(**dict(zip(ARCHIVE_FIELDS, row)))
+            for row in answers.values_list(*ARCHIVE_FIELDS.values())]
+    with transaction.atomic(using=ARCHIVE_DATABASE):
+        if replace:
+            ids = [row.id for row in rows]
+            for start in range(0, len(ids), DELETE_BATCH_SIZE):
+                ArchivedAnswer.objects.filter(
+                    id__in=ids[start:start + DELETE_BATCH_SIZE]
+                ).delete()
+        ArchivedAnswer.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+def missing_ids(poll_id, ids):
+    # сверка по диапазону id, без длинного IN
+    return set(ids) - set(
+        ArchivedAnswer.objects.filter(poll_id=poll_id, id__gte=ids[0],
+                                      id__lte=ids[-1])
+        .values_list('id', flat=True)
+    )
+
+
+def archive_poll(poll_id, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """
+    Переносит ответы опроса в архив. Возвращает число удалённых
+    из основной таблицы ответов и число ответов опроса в архиве
+    """
+    for ids in iter_answer_ids(poll_id, chunk_size):
+        copy_answers(chunk_answers(poll_id, ids))
+
+    # с этого момента чтение идёт из архива, а новые ответы отклоняются
+    if Poll.objects.filter(id=poll_id, archived_at__isnull=True).update(
+            archived_at=timezone.now()):
+        invalidate_poll(poll_id)
+
+    deleted = 0
+    for ids in iter_answer_ids(poll_id, chunk_size):
+        with transaction.atomic():
+            # до пометки опроса могли прийти новые ответы, а выборы
+            # MULTICHOICE - дописаться в уже скопированную компактную
+            # строку: порция копируется заново с заменой и удаляется
+            # в одной транзакции, строки заблокированы до удаления
+            copy_answers(
+                chunk_answers(poll_id, ids).select_for_update(of=('self',)),
+                replace=True
+            )
+            missing = missing_ids(poll_id, ids)
+            if missing:
+                raise ArchiveError(
+                    f'Опрос {poll_id}: {len(missing)} ответов нет в архиве'
+                )
+            for start in range(0, len(ids), DELETE_BATCH_SIZE):
+                Answer.objects.filter(
+                    id__in=ids[start:start + DELETE_BATCH_SIZE]
+                ).delete()
+        deleted += len(ids)
+    return {'deleted': deleted,
+            'archived': ArchivedAnswer.objects.filter(poll_id=poll_id)
+            .count()}
+
+
+def archive_polls(grace_days=ARCHIVE_GRACE_DAYS,
+                  chunk_size=ARCHIVE_CHUNK_SIZE, today=None):
+    """
+    Переносит все закрытые опросы, возвращает итоги по id опроса
+    """
+    return {poll_id: archive_poll(poll_id, chunk_size)
+            for poll_id in list(polls_to_archive(grace_days, today))}
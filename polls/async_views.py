@@ -0,0 +1,49 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .views import CreateAnswerView, PollRetrieveView, PollView
+
+# пул потоков для работы с базой: ограничивает число одновременных
+# запросов к базе, а ожидающие запросы не занимают потоков
+executor = ThreadPoolExecutor(max_workers=settings.POLLS_ASYNC_DB_THREADS,
+                              thread_name_prefix='polls-db')
+
+
+def run_view(view, request, *args, **kwargs):
+    try:
+        response = view(request, *args, **kwargs)
+        # ответ DRF рендерится здесь же, а не в общем потоке ASGI
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        return response
+    finally:
+        # соединения потоков пула закрываются по тем же правилам,
+        # что и соединения обычного запроса (CONN_MAX_AGE)
+        close_old_connections()
+
+
+def offload(view):
+    """
+    Асинхронное представление поверх синхронного: представление целиком
+    выполняется в пуле потоков для базы, цикл событий остаётся свободным
+    """
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # контекст запроса (метрики) переходит в поток пула
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            executor,
+            partial(context.run, run_view, view, request, *args, **kwargs)
+        )
+    return async_view
+
+
+poll_view = offload(PollView.as_view())
+poll_detail_view = offload(PollRetrieveView.as_view())
+create_answer_view = offload(CreateAnswerView.as_view())
@@ -0,0 +1,291 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import metrics
+from .models import Answer
+from .multichoice import insert_answers
+from .serializers import answer_key, existing_answer_keys
+from .versions import bump_user_versions
+
+logger = logging.getLogger(__name__)
+
+# наибольшая пауза между повторами записи пачки, секунды
+MAX_RETRY_DELAY = 5
+
+
+class BufferFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Сервис перегружен, повторите запрос позже'
+    default_code = 'buffer_full'
+
+
+def save_answers(answers):
+    """
+    Пишет пачку проверенных ответов (словари полей Answer) одной
+    транзакцией. Повторы внутри пачки и уже записанные ответы
+    отбрасываются. Возвращает число записанных ответов
+    """
+    existing = existing_answer_keys(answers)
+    new_answers = []
+    for attrs in answers:
+        key = answer_key(attrs)
+        if key not in existing:
+            existing.add(key)
+            new_answers.append(Answer(**attrs))
+    try:
+        with transaction.atomic():
+            # bulk_create не отправляет post_save, итоги записываются там же
+            insert_answers(new_answers)
+    except IntegrityError:
+        # ответ успел записаться мимо буфера: пишем по одному
+        new_answers = save_one_by_one(new_answers)
+    bump_user_versions(answer.user_id for answer in new_answers)
+    return len(new_answers)
+
+
+def save_one_by_one(answers):
+    saved = []
+    with transaction.atomic():
+        for answer in answers:
+            try:
+                with transaction.atomic():
+                    insert_answers([answer])
+            except IntegrityError:
+                continue
+            saved.append(answer)
+    return saved
+
+
+class AnswerBuffer:
+    """
+    Очередь проверенных ответов с записью пачками в фоновом потоке.
+
+    Пачка пишется, как только набралось batch_size ответов или прошло
+    interval секунд с прошлой записи. Очередь ограничена max_size
+    ответами: при переполнении put ждёт не дольше timeout секунд
+    и бросает BufferFull.
+
+    Пачка, которую не удалось записать, возвращается в голову очереди
+    и пишется снова с удвоением паузы начиная с retry_delay секунд.
+    Повтор безопасен: уже записанные ответы save_answers пропускает.
+    После retries неудач подряд пачка отбрасывается
+    """
+
+    def __init__(self, max_size, batch_size, interval, timeout,
+                 retries=5, retry_delay=0.1):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # неудачные попытки записи пачки в голове очереди подряд
+        self.failures = 0
+        self.pending = []
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        self.ready = threading.Condition(self.lock)
+        # запись пачек не пересекается между потоком и flush()
+        self.writing = threading.Lock()
+        self.thread = None
+        self.stopping = False
+        self.stats = Counter()
+
+    def put(self, answers):
+        """
+        Ставит ответы в очередь целиком или не ставит ни одного
+        """
+        answers = list(answers)
+        deadline = time.monotonic() + self.timeout
+        with self.lock:
+            while len(self.pending) + len(answers) > self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.not_full.wait(remaining):
+                    self.stats['rejected_full'] += len(answers)
+                    raise BufferFull
+            self.pending.extend(answers)
+            self.stats['queued'] += len(answers)
+            if len(self.pending) >= self.batch_size:
+                self.ready.notify()
+
+    def start(self):
+        """
+        Запускает фоновую запись. Без неё очередь пишется только flush()
+        """
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run,
+                                           name='polls-answer-buffer',
+                                           daemon=True)
+            self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Останавливает фоновый поток и дописывает остаток очереди
+        """
+        with self.lock:
+            self.stopping = True
+            self.ready.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def run(self):
+        while True:
+            with self.lock:
+                self.ready.wait_for(
+                    lambda: (len(self.pending) >= self.batch_size or
+                             self.stopping),
+                    self.interval
+                )
+                if self.stopping:
+                    return
+            try:
+                self.write_batch()
+            except Exception:
+                logger.exception('Не удалось записать пачку ответов')
+                with self.lock:
+                    self.ready.wait_for(lambda: self.stopping,
+                                        self.backoff())
+            finally:
+                # поток живёт дольше запроса, соединение закрываем сами
+                close_old_connections()
+
+    def take(self):
+        with self.lock:
+            batch = self.pending[:self.batch_size]
+            del self.pending[:self.batch_size]
+            self.not_full.notify_all()
+        return batch
+
+    def requeue(self, batch):
+        # пачка возвращается в голову очереди сверх max_size: её ответы
+        # уже приняты, новые put подождут
+        with self.lock:
+            self.pending[:0] = batch
+
+    def backoff(self):
+        if not self.failures:
+            return 0
+        return min(self.retry_delay * 2 ** (self.failures - 1),
+                   MAX_RETRY_DELAY)
+
+    def write_batch(self):
+        """
+        Записывает пачку из головы очереди, возвращает её размер.
+        Ошибка записи пробрасывается, а пачка остаётся в очереди,
+        пока не исчерпаны повторы
+        """
+        with self.writing:
+            batch = self.take()
+            if not batch:
+                return 0
+            try:
+                self.write(batch)
+            except Exception:
+                self.failures += 1
+                metrics.answer_buffer_flush_failures.inc()
+                if self.failures > self.retries:
+                    self.failures = 0
+                    self.stats['dropped'] += len(batch)
+                    metrics.answer_buffer_dropped.inc(len(batch))
+                    logger.error('Пачка из %s ответов отброшена после %s '
+                                 'повторов записи', len(batch), self.retries)
+                else:
+                    self.requeue(batch)
+                raise
+            self.failures = 0
+        return len(batch)
+
+    def flush(self):
+        """
+        Синхронно записывает всё, что есть в очереди, с теми же
+        повторами, что и фоновая запись
+        """
+        while True:
+            try:
+                if not self.write_batch():
+                    return
+            except Exception:
+                logger.exception('Не удалось записать пачку ответов')
+                time.sleep(self.backoff())
+
+    def write(self, batch):
+        started = time.perf_counter()
+        try:
+            written = save_answers(batch)
+        except Exception:
+            self.stats['failed'] += len(batch)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats['flushes'] += 1
+            self.stats['flush_seconds'] += elapsed
+            self.stats['flushed'] += len(batch)
+            self.stats['max_batch_size'] = max(self.stats['max_batch_size'],
+                                               len(batch))
+            self.stats['max_flush_seconds'] = max(
+                self.stats['max_flush_seconds'], elapsed
+            )
+        self.stats['written'] += written
+        self.stats['duplicates'] += len(batch) - written
+        metrics.answer_buffer_flush_duration.observe(elapsed)
+        metrics.answer_buffer_batch_size.observe(len(batch))
+        if len(batch) > written:
+            metrics.answers_rejected.inc(len(batch) - written,
+                                         reason='duplicate')
+
+    def metrics(self):
+        """
+        Размер очереди, средние и максимальные размер пачки
+        и время записи
+        """
+        flushes = self.stats['flushes'] or 1
+        with self.lock:
+            queue_size = len(self.pending)
+        return {'queue_size': queue_size,
+                'queued': self.stats['queued'],
+                'written': self.stats['written'],
+                'duplicates': self.stats['duplicates'],
+                'failed': self.stats['failed'],
+                'dropped': self.stats['dropped'],
+                'rejected_full': self.stats['rejected_full'],
+                'flushes': self.stats['flushes'],
+                'avg_batch_size': round(self.stats['flushed'] / flushes, 1),
+                'max_batch_size': self.stats['max_batch_size'],
+                'avg_flush_ms': round(
+                    self.stats['flush_seconds'] * 1000 / flushes, 2
+                ),
+                'max_flush_ms': round(
+                    self.stats['max_flush_seconds'] * 1000, 2
+                )}
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_answer_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = AnswerBuffer(
+                max_size=settings.POLLS_ANSWER_BUFFER_SIZE,
+                batch_size=settings.POLLS_ANSWER_BATCH_SIZE,
+                interval=settings.POLLS_ANSWER_FLUSH_INTERVAL / 1000,
+                timeout=settings.POLLS_ANSWER_BUFFER_TIMEOUT,
+                retries=settings.POLLS_ANSWER_FLUSH_RETRIES,
+                retry_delay=settings.POLLS_ANSWER_RETRY_DELAY / 1000,
+            )
+            _buffer.start()
+        return _buffer
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Схемы, снимки и версии опросов сбрасываются в кэше default: с кэшем
+    в памяти процесса сброс не доходит до остальных процессов
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if not backend.endswith('.LocMemCache'):
+        return []
+    return [Warning(
+        'Кэш default хранится в памяти процесса: после изменения опроса '
+        'другие процессы отдают старые схемы, снимки и ответы 304 '
+        'по старым ETag до POLLS_SCHEMA_TIMEOUT, POLLS_SNAPSHOT_TIMEOUT '
+        'и POLLS_VERSION_TIMEOUT секунд',
+        hint='Задайте общий кэш в DJANGO_CACHE_BACKEND, например '
+             'django.core.cache.backends.memcached.PyMemcacheCache, '
+             'если запущено больше одного процесса',
+        id='polls.W001',
+    )]
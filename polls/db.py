@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    # прагмы идут в соединение SQLite мимо обёрток Django: настройка
+    # соединения не считается запросами представления
+    cursor = connection.connection.cursor()
+    try:
+        for name, value in settings.POLLS_SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    """
+    Закрывает оборванные долгоживущие соединения до начала запроса,
+    чтобы первый запрос к базе не упал на мёртвом соединении
+    """
+    if not settings.POLLS_DB_HEALTH_CHECKS:
+        return
+    for conn in connections.all():
+        if (conn.connection is not None and
+                conn.settings_dict['CONN_MAX_AGE'] != 0 and
+                not conn.in_atomic_block and not conn.is_usable()):
+            conn.close()
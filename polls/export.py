@@ -0,0 +1,68 @@
+import csv
+import json
+from functools import partial
+
+from .models import Answer, ArchivedAnswer
+from .multichoice import choice_texts, expand_rows
+
+EXPORT_FIELDS = ('answer_id', 'user_id', 'question_id', 'question_type',
+                 'question_text', 'choice_id', 'choice_text', 'answer_text')
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_CONTENT_TYPES = {'csv': 'text/csv',
+                        'ndjson': 'application/x-ndjson'}
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_answer_rows(poll_id, chunk_size=EXPORT_CHUNK_SIZE, archived=False):
+    """
+    Ответы опроса кортежами с текстами вопроса и выбора из одного
+    запроса, читаются с сервера порциями по chunk_size. Ответы
+    перенесённого опроса читаются из архива
+    """
+    if archived:
+        rows = ArchivedAnswer.objects.filter(
+            poll_id=poll_id
+        ).order_by('id').values_list(
+            'id', 'user_id', 'question_id', 'question_type',
+            'question_text', 'choice_id', 'choice_text', 'answer_text',
+            'choice_ids'
+        )
+    else:
+        rows = Answer.objects.filter(
+            poll_id=poll_id
+        ).order_by('id').values_list(
+            'id', 'user_id', 'question_id', 'question__question_type',
+            'question__question_text', 'choice_id', 'choice__choice_text',
+            'answer_text', 'choice_ids'
+        )
+    # компактная строка MULTICHOICE выгружается строкой на каждый выбор
+    return expand_rows(rows.iterator(chunk_size=chunk_size),
+                       partial(choice_texts, question__poll_id=poll_id),
+                       choice_index=5, text_index=6)
+
+
+class Echo:
+    # csv.writer пишет строку в буфер, а буфер сразу её возвращает
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row)),
+                         ensure_ascii=False) + '\n'
+
+
+def iter_export(poll_id, export_format, chunk_size=EXPORT_CHUNK_SIZE,
+                archived=False):
+    rows = iter_answer_rows(poll_id, chunk_size, archived)
+    if export_format == 'ndjson':
+        return iter_ndjson(rows)
+    return iter_csv(rows)
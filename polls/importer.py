@@ -0,0 +1,403 @@
+import csv
+import datetime as dt
+import json
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from .models import Answer, Poll, Question, QuestionChoice
+from .results import record_answers
+from .schema import PollSchema, compile_schema
+from .signals import invalidate, invalidate_active, invalidate_poll
+from .versions import CATALOG, bump_version
+
+IMPORT_FORMATS = ('json', 'ndjson', 'csv')
+IMPORT_BATCH_SIZE = 2000
+IMPORT_MAX_ERRORS = 100
+# размер куска при чтении JSON-массива
+JSON_CHUNK_SIZE = 64 * 1024
+IMPORT_MODELS = ('polls.poll', 'polls.question', 'polls.questionchoice',
+                 'polls.answer')
+# колонки выгрузки export_answers
+CSV_COLUMNS = {'answer_id': 'id',
+               'question_id': 'question',
+               'choice_id': 'choice'}
+QUESTION_TYPES = {question_type for question_type, _ in Question.QUESTION_TYPE}
+
+
+def iter_json_array(file, chunk_size=JSON_CHUNK_SIZE):
+    """
+    Элементы JSON-массива по одному: файл читается кусками, в памяти
+    только текущий элемент и недочитанный остаток куска
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+
+    def next_char():
+        # первый непробельный символ, при необходимости дочитывает файл
+        nonlocal buffer, eof
+        while True:
+            buffer = buffer.lstrip()
+            if buffer or eof:
+                return buffer[:1]
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+
+    if next_char() != '[':
+        raise ValueError('Ожидался JSON-массив записей')
+    buffer = buffer[1:]
+    if next_char() == ']':
+        return
+    while True:
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            item, end = None, None
+        # элемент мог обрезаться на границе куска
+        if end is None or (end == len(buffer) and not eof):
+            if eof:
+                raise ValueError('Неверный JSON-массив записей')
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        yield item
+        separator = next_char()
+        buffer = buffer[1:]
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError('Неверный JSON-массив записей')
+        next_char()
+
+
+def read_records(file, input_format, poll_id=None):
+    """
+    Записи в формате сериализации Django: {"model", "pk", "fields"}.
+    JSON-массив разбирается по одной записи, NDJSON и CSV читаются
+    построчно. CSV содержит только ответы
+    с колонками id, user_id, poll, question, choice, answer_text
+    или колонками выгрузки export_answers; опрос для строк без
+    колонки poll задаётся через poll_id
+    """
+    if input_format == 'json':
+        yield from iter_json_array(file)
+    elif input_format == 'ndjson':
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        for row in csv.DictReader(file):
+            fields = {CSV_COLUMNS.get(column, column): value
+                      for column, value in row.items()}
+            fields.setdefault('poll', poll_id)
+            yield {'model': 'polls.answer',
+                   'pk': fields.pop('id', None),
+                   'fields': fields}
+
+
+def _int(value):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f'Ожидалось число, получено {value!r}')
+
+
+def _date(value):
+    if isinstance(value, dt.date):
+        return value
+    try:
+        return dt.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f'Неверная дата {value!r}')
+
+
+class ExistingIds:
+    """
+    Множество pk строк модели. Id подгружаются диапазонами по span:
+    для pk, идущих подряд, - один запрос на диапазон вместо запроса
+    на запись. Новые pk импорта добавляются через add
+    """
+
+    def __init__(self, model, span=IMPORT_BATCH_SIZE):
+        self.model = model
+        self.span = span
+        self.ids = set()
+        self.loaded = set()
+
+    def __contains__(self, pk):
+        start = pk - pk % self.span
+        if start not in self.loaded:
+            self.ids.update(self.model.objects.filter(
+                id__gte=start, id__lt=start + self.span
+            ).values_list('id', flat=True))
+            self.loaded.add(start)
+        return pk in self.ids
+
+    def add(self, pk):
+        self.ids.add(pk)
+
+
+class PollImporter:
+    """
+    Загрузка опросов, вопросов, вариантов и ответов пачками.
+
+    Ссылки опрос -> вопрос -> вариант разрешаются в памяти по схемам
+    опросов, ответы проверяются теми же правилами, что и в
+    AnswerSerializer. Каждая пачка пишется через bulk_create
+    в отдельной транзакции
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.schemas = {}
+        self.question_polls = {}
+        self.question_ids = ExistingIds(Question, batch_size)
+        self.choice_ids = ExistingIds(QuestionChoice, batch_size)
+        self.stats = Counter()
+        self.errors = []
+        self.pending = 0
+        self.polls = []
+        self.questions = []
+        self.choices = []
+        self.answers = []
+        # номера записей ответов для сообщений об отклонении
+        self.answer_numbers = []
+        self.answer_keys = set()
+        self.number = None
+
+    def run(self, records, start=0, progress=None):
+        """
+        Импортирует записи, пропуская первые start уже загруженных.
+        После каждой закоммиченной пачки вызывает progress(число записей)
+        """
+        number = 0
+        for number, record in enumerate(records, 1):
+            if number <= start:
+                continue
+            self.number = number
+            try:
+                self.add(record)
+            except ValidationError as exc:
+                self.reject(number, '; '.join(exc.messages))
+            if self.pending >= self.batch_size:
+                self.flush()
+                if progress:
+                    progress(number)
+        self.flush()
+        self.reset_sequences()
+        if progress:
+            progress(max(number, start))
+        return self.stats
+
+    def reset_sequences(self):
+        # записи вставлялись с явными pk, счётчики pk нужно подвинуть
+        sql = connection.ops.sequence_reset_sql(
+            no_style(), [Poll, Question, QuestionChoice, Answer]
+        )
+        if sql:
+            with connection.cursor() as cursor:
+                for statement in sql:
+                    cursor.execute(statement)
+
+    def reject(self, number, message):
+        self.stats['rejected'] += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append((number, message))
+
+    def add(self, record):
+        model = record.get('model')
+        if model not in IMPORT_MODELS:
+            self.stats['skipped'] += 1
+            return
+        pk = _int(record.get('pk'))
+        fields = record.get('fields') or {}
+        if model == 'polls.poll':
+            self.add_poll(pk, fields)
+        elif model == 'polls.question':
+            self.add_question(pk, fields)
+        elif model == 'polls.questionchoice':
+            self.add_choice(pk, fields)
+        else:
+            self.add_answer(pk, fields)
+        self.pending += 1
+
+    def schema(self, poll_id):
+        if poll_id not in self.schemas:
+            schema = compile_schema(poll_id)
+            if schema is not None:
+                for question_id in schema.question_types:
+                    self.question_polls[question_id] = poll_id
+            self.schemas[poll_id] = schema
+        return self.schemas[poll_id]
+
+    def question_schema(self, question_id):
+        if question_id not in self.question_polls:
+            poll_id = Question.objects.filter(
+                id=question_id
+            ).values_list('poll_id', flat=True).first()
+            if poll_id is None:
+                return None
+            self.schema(poll_id)
+        return self.schema(self.question_polls[question_id])
+
+    def add_poll(self, pk, fields):
+        if pk is None:
+            raise ValidationError('Для опроса нужен pk')
+        if self.schema(pk) is not None:
+            raise ValidationError(f'Опрос {pk} уже существует')
+        start_date = _date(fields.get('start_date'))
+        end_date = _date(fields.get('end_date'))
+        if end_date < start_date:
+            raise ValidationError('Дата окончания не может '
+                                  'быть раньше даты начала!')
+        self.polls.append(Poll(id=pk,
+                               title=fields.get('title', ''),
+                               description=fields.get('description', ''),
+                               start_date=start_date,
+                               end_date=end_date))
+        self.schemas[pk] = PollSchema(pk, {}, {})
+
+    def add_question(self, pk, fields):
+        poll_id = _int(fields.get('poll'))
+        question_type = fields.get('question_type', 'TEXT')
+        if pk is None:
+            raise ValidationError('Для вопроса нужен pk')
+        if pk in self.question_polls or pk in self.question_ids:
+            raise ValidationError(f'Вопрос {pk} уже существует')
+        schema = self.schema(poll_id)
+        if schema is None:
+            raise ValidationError(f'Опрос {poll_id} не найден')
+        if question_type not in QUESTION_TYPES:
+            raise ValidationError(f'Неизвестный тип вопроса {question_type}')
+        self.questions.append(Question(id=pk,
+                                       poll_id=poll_id,
+                                       question_text=fields.get(
+                                           'question_text', ''),
+                                       question_type=question_type))
+        schema.question_types[pk] = question_type
+        self.question_polls[pk] = poll_id
+        self.question_ids.add(pk)
+
+    def add_choice(self, pk, fields):
+        question_id = _int(fields.get('question'))
+        if pk is None:
+            raise ValidationError('Для варианта ответа нужен pk')
+        if pk in self.choice_ids:
+            raise ValidationError(f'Вариант ответа {pk} уже существует')
+        schema = self.question_schema(question_id)
+        if schema is None:
+            raise ValidationError(f'Вопрос {question_id} не найден')
+        if schema.question_type(question_id) in ['TEXT']:
+            raise ValidationError('Нельзя создать вариант ответа '
+                                  'для вопроса с типом ответа "TEXT"')
+        self.choices.append(QuestionChoice(id=pk,
+                                           question_id=question_id,
+                                           choice_text=fields.get(
+                                               'choice_text', '')))
+        schema.question_choices[question_id] = (
+            schema.choices(question_id) | {pk}
+        )
+        self.choice_ids.add(pk)
+
+    def add_answer(self, pk, fields):
+        user_id = _int(fields.get('user_id'))
+        poll_id = _int(fields.get('poll'))
+        question_id = _int(fields.get('question'))
+        choice_id = _int(fields.get('choice'))
+        answer_text = fields.get('answer_text') or ''
+        if user_id is None or user_id < 0:
+            raise ValidationError('Нужен ID пользователя')
+        schema = self.schema(poll_id)
+        if schema is None:
+            raise ValidationError(f'Опрос {poll_id} не найден')
+        schema.validate_answer(question_id, choice_id, answer_text)
+        key = self.answer_key(schema, user_id, question_id, choice_id)
+        if key in self.answer_keys:
+            raise ValidationError('Вы уже отвечали на этот вопрос')
+        self.answer_keys.add(key)
+        self.answers.append(Answer(id=pk,
+                                   user_id=user_id,
+                                   poll_id=poll_id,
+                                   question_id=question_id,
+                                   choice_id=choice_id,
+                                   answer_text=answer_text,
+                                   multichoice=schema.question_type(
+                                       question_id) == 'MULTICHOICE'))
+        self.answer_numbers.append(self.number)
+
+    def answer_key(self, schema, user_id, question_id, choice_id):
+        if schema.question_type(question_id) in ['MULTICHOICE']:
+            return (user_id, question_id, choice_id)
+        return (user_id, question_id)
+
+    def new_answers(self):
+        # ответы, которые уже есть в базе, отклоняются одним запросом
+        existing_pks = set(Answer.objects.filter(
+            id__in={answer.id for answer in self.answers if answer.id}
+        ).values_list('id', flat=True))
+        existing = set()
+        for answer in Answer.objects.filter(
+                user_id__in={answer.user_id for answer in self.answers},
+                question_id__in={answer.question_id
+                                 for answer in self.answers}
+        ).only('user_id', 'poll_id', 'question_id', 'choice_id',
+               'choice_ids'):
+            # компактная строка MULTICHOICE - ключ на каждый выбор
+            for choice_id in answer.selected_choice_ids or [None]:
+                existing.add(self.answer_key(self.schema(answer.poll_id),
+                                             answer.user_id,
+                                             answer.question_id, choice_id))
+        answers = []
+        for number, answer in zip(self.answer_numbers, self.answers):
+            key = self.answer_key(self.schema(answer.poll_id),
+                                  answer.user_id, answer.question_id,
+                                  answer.choice_id)
+            if key in existing:
+                self.reject(number, 'Вы уже отвечали на этот вопрос')
+            elif answer.id in existing_pks:
+                self.reject(number, f'Ответ {answer.id} уже существует')
+            else:
+                answers.append(answer)
+        return answers
+
+    def flush(self):
+        if not self.pending:
+            return
+        poll_ids = ({poll.id for poll in self.polls} |
+                    {question.poll_id for question in self.questions} |
+                    {self.question_polls[choice.question_id]
+                     for choice in self.choices})
+        with transaction.atomic():
+            Poll.objects.bulk_create(self.polls)
+            Question.objects.bulk_create(self.questions)
+            QuestionChoice.objects.bulk_create(self.choices)
+            answers = self.new_answers() if self.answers else []
+            Answer.objects.bulk_create(answers)
+            record_answers(answers)
+            # bulk_create не отправляет сигналы, кэши сбрасываем сами
+            for poll_id in poll_ids:
+                invalidate_poll(poll_id)
+            if self.polls:
+                invalidate_active()
+            # одна версия каталога вместо версий каждого пользователя
+            if answers:
+                invalidate(bump_version, CATALOG)
+        self.stats['polls'] += len(self.polls)
+        self.stats['questions'] += len(self.questions)
+        self.stats['choices'] += len(self.choices)
+        self.stats['answers'] += len(answers)
+        self.pending = 0
+        self.polls = []
+        self.questions = []
+        self.choices = []
+        self.answers = []
+        self.answer_numbers = []
+        self.answer_keys = set()
@@ -0,0 +1,221 @@
+import contextvars
+import heapq
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERIES = getattr(settings, 'POLLS_SLOW_QUERIES', 3)
+
+# метрики текущего запроса; контекст передаётся и в потоки пула
+# асинхронных представлений
+current_metrics = contextvars.ContextVar('polls_request_metrics',
+                                         default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestMetrics:
+    """
+    Запросы к базе, их суммарное время, время сериализаторов
+    и самые медленные запросы одного HTTP-запроса
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0
+        self.slowest = []
+        self.timings = {}
+        self.depth = 0
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        item = (duration, self.queries, sql)
+        if len(self.slowest) < SLOW_QUERIES:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def add_timing(self, name, duration):
+        self.timings[name] = self.timings.get(name, 0) + duration
+
+    def slowest_queries(self):
+        return [{'sql': sql, 'ms': round(duration * 1000, 2)}
+                for duration, _, sql in sorted(self.slowest, reverse=True)]
+
+    def server_timing(self, total):
+        items = [f'db;dur={self.db_time * 1000:.2f};'
+                 f'desc="{self.queries} queries"']
+        items += [f'{name};dur={duration * 1000:.2f}'
+                  for name, duration in self.timings.items()]
+        items.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(items)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - started)
+
+
+def install(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    install(connection)
+
+
+def instrument_open_connections():
+    for connection in connections.all():
+        install(connection)
+
+
+@contextmanager
+def timed(name):
+    """
+    Добавляет время блока к метрике name текущего запроса.
+    Вложенные блоки не учитываются повторно
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    metrics.depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.depth -= 1
+        if not metrics.depth:
+            metrics.add_timing(name, time.perf_counter() - started)
+
+
+class TimedSerializerMixin:
+    """
+    Время проверки и сериализации попадает в метрику serializer
+    """
+
+    def is_valid(self, *args, **kwargs):
+        with timed('serializer'):
+            return super().is_valid(*args, **kwargs)
+
+    @property
+    def data(self):
+        with timed('serializer'):
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class TimedModelSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
+    """
+    Для many=True в Meta нужен list_serializer_class = TimedListSerializer
+    """
+
+
+def get_query_budget(view_func):
+    """
+    Бюджет запросов к базе представления: атрибут query_budget класса
+    """
+    view_class = getattr(view_func, 'cls', None)
+    return getattr(view_class, 'query_budget', None)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Метрики запроса в заголовке Server-Timing и в логе polls.instrumentation.
+
+    Если у представления задан query_budget и запросов к базе больше,
+    в лог пишется предупреждение, а при POLLS_QUERY_BUDGET_STRICT
+    (в тестах) бросается QueryBudgetExceeded.
+
+    Под ASGI работает асинхронно: синхронное промежуточное ПО заставило
+    бы Django выполнять все запросы в одном потоке
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        instrument_open_connections()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        total = time.perf_counter() - metrics.started
+        if settings.POLLS_SERVER_TIMING:
+            response['Server-Timing'] = metrics.server_timing(total)
+        self.report(request, response, metrics, total)
+        return response
+
+    def report(self, request, response, metrics, total):
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+        }
+        record.update({f'{name}_ms': round(duration * 1000, 2)
+                       for name, duration in metrics.timings.items()})
+        budget = get_query_budget(match.func) if match else None
+        if budget is not None and metrics.queries > budget:
+            record['query_budget'] = budget
+            record['slowest'] = metrics.slowest_queries()
+            logger.warning(json.dumps(record, ensure_ascii=False))
+            if settings.POLLS_QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(
+                    f'{record["view"]}: {metrics.queries} запросов '
+                    f'к базе при бюджете {budget}'
+                )
+        elif logger.isEnabledFor(logging.DEBUG):
+            record['slowest'] = metrics.slowest_queries()
+            logger.debug(json.dumps(record, ensure_ascii=False))
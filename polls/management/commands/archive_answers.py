@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.archive import (ARCHIVE_CHUNK_SIZE, ARCHIVE_GRACE_DAYS,
+                           ArchiveError, archive_poll, polls_to_archive)
+
+
+class Command(BaseCommand):
+    help = 'Переносит ответы закрытых опросов в архивную базу'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-days', type=int,
+                            default=ARCHIVE_GRACE_DAYS,
+                            help='Сколько дней после окончания опроса '
+                                 'ответы остаются в основной таблице')
+        parser.add_argument('--chunk-size', type=int,
+                            default=ARCHIVE_CHUNK_SIZE)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать опросы для переноса')
+
+    def handle(self, *args, grace_days, chunk_size, dry_run, **options):
+        poll_ids = list(polls_to_archive(grace_days))
+        if dry_run:
+            self.stdout.write('Опросы для переноса: '
+                              + (', '.join(map(str, poll_ids)) or 'нет'))
+            return
+        for poll_id in poll_ids:
+            try:
+                stats = archive_poll(poll_id, chunk_size)
+            except ArchiveError as error:
+                raise CommandError(str(error))
+            self.stdout.write(
+                'Опрос {}: удалено {deleted}, в архиве {archived}'
+                .format(poll_id, **stats)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено опросов: {len(poll_ids)}'
+        ))
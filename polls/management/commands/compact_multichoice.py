@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import Question
+from polls.multichoice import COMPACT_BATCH_SIZE, compact_question
+
+
+class Command(BaseCommand):
+    help = ('Сворачивает ответы MULTICHOICE в одну строку на пользователя '
+            'и вопрос')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=int, dest='poll_id',
+                            help='Свернуть только этот опрос')
+        parser.add_argument('--batch-size', type=int,
+                            default=COMPACT_BATCH_SIZE,
+                            help='Пользователей в одной транзакции')
+
+    def handle(self, *args, poll_id=None, batch_size, **options):
+        questions = Question.objects.filter(question_type='MULTICHOICE')
+        if poll_id is not None:
+            questions = questions.filter(poll_id=poll_id)
+        compacted = 0
+        for question_id in questions.order_by('id').values_list('id',
+                                                                flat=True):
+            compacted += compact_question(question_id, batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Свёрнуто строк: {compacted}'
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, iter_export
+from polls.models import Poll
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка ответов опроса в CSV или NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll_id', type=int)
+        parser.add_argument('--format', choices=EXPORT_FORMATS,
+                            default='csv', dest='export_format')
+        parser.add_argument('--output',
+                            help='Файл для выгрузки, по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int,
+                            default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, poll_id, export_format, output, chunk_size,
+               **options):
+        poll = Poll.objects.filter(id=poll_id).values('archived_at').first()
+        if poll is None:
+            raise CommandError(f'Опрос {poll_id} не найден')
+        chunks = iter_export(poll_id, export_format, chunk_size,
+                             archived=poll['archived_at'] is not None)
+        if output is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(output, 'w', encoding='utf-8', newline='') as file:
+            for chunk in chunks:
+                file.write(chunk)
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.importer import (IMPORT_BATCH_SIZE, IMPORT_FORMATS, PollImporter,
+                            read_records)
+
+
+def default_checkpoint(path):
+    """
+    Файл checkpoint во временном каталоге, а не рядом с входным файлом:
+    каталог с выгрузкой может быть недоступен на запись. Имя зависит
+    от абсолютного пути, повторный запуск с --resume найдёт тот же файл
+    """
+    key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(),
+                        f'import_polls-{key}.checkpoint')
+
+
+class Command(BaseCommand):
+    help = ('Быстрая загрузка опросов, вопросов, вариантов и ответов '
+            'из JSON, NDJSON или CSV; файл читается по одной записи')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            dest='input_format',
+                            help='По умолчанию определяется по расширению')
+        parser.add_argument('--poll', type=int, dest='poll_id',
+                            help='Опрос для строк CSV без колонки poll')
+        parser.add_argument('--batch-size', type=int,
+                            default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--checkpoint',
+                            help='Файл с числом загруженных записей, '
+                                 'по умолчанию во временном каталоге')
+        parser.add_argument('--resume', action='store_true',
+                            help='Продолжить с места из файла checkpoint')
+
+    def handle(self, path, input_format, poll_id, batch_size, checkpoint,
+               resume, **options):
+        input_format = input_format or os.path.splitext(path)[1][1:].lower()
+        if input_format not in IMPORT_FORMATS:
+            raise CommandError('Укажите формат: ' + ', '.join(IMPORT_FORMATS))
+        checkpoint = checkpoint or default_checkpoint(path)
+        start = 0
+        if resume and os.path.exists(checkpoint):
+            with open(checkpoint) as file:
+                start = int(file.read().strip() or 0)
+            self.stdout.write(f'Продолжаем с записи {start + 1}')
+        self.stdout.write(f'Файл checkpoint: {checkpoint}')
+
+        def progress(number):
+            with open(checkpoint, 'w') as file:
+                file.write(str(number))
+            self.stdout.write(f'Обработано записей: {number}')
+
+        importer = PollImporter(batch_size)
+        with open(path, encoding='utf-8', newline='') as file:
+            stats = importer.run(read_records(file, input_format, poll_id),
+                                 start, progress)
+        for number, message in importer.errors:
+            self.stderr.write(f'Запись {number or "?"}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            'Загружено опросов: {polls}, вопросов: {questions}, '
+            'вариантов: {choices}, ответов: {answers}; '
+            'отклонено: {rejected}, пропущено: {skipped}'.format(
+                **{key: stats[key] for key in (
+                    'polls', 'questions', 'choices', 'answers',
+                    'rejected', 'skipped')})
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from polls.results import rebuild_participation
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает участие пользователей в опросах по таблице ответов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=int, dest='poll_id',
+                            help='Пересчитать только этот опрос')
+
+    def handle(self, *args, poll_id=None, **options):
+        stats = rebuild_participation(poll_id)
+        self.stdout.write(self.style.SUCCESS(
+            'Участие пересчитано: добавлено {created}, изменено {updated}, '
+            'удалено {deleted}'.format(**stats)
+        ))
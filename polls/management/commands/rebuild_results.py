@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from polls.results import rebuild_results
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает итоги опросов по таблице ответов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=int, dest='poll_id',
+                            help='Пересчитать только этот опрос')
+
+    def handle(self, *args, poll_id=None, **options):
+        rebuild_results(poll_id)
+        self.stdout.write(self.style.SUCCESS('Итоги пересчитаны'))
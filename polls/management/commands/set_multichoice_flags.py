@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import set_multichoice_flags
+
+
+class Command(BaseCommand):
+    help = ('Проставляет флаг multichoice ответам по типу вопроса '
+            '(для баз, созданных до уникальных ограничений ответов)')
+
+    def handle(self, *args, **options):
+        fixed = set_multichoice_flags()
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено ответов: {fixed}'
+        ))
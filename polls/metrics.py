@@ -0,0 +1,325 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    """
+    Счётчики и гистограммы процесса.
+
+    Запись - обновление словаря под блокировкой. С POLLS_METRICS_DIR
+    каждый процесс не чаще раза в POLLS_METRICS_FLUSH_INTERVAL секунд
+    сохраняет свои значения в отдельный файл, а экспорт складывает
+    файлы всех процессов, поэтому любой воркер отдаёт общие метрики
+    """
+
+    def __init__(self, directory=None, flush_interval=1):
+        self.metrics = {}
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flushed = 0
+        self.pid = None
+        self.path = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def file_path(self):
+        # воркеры могут получить реестр от мастера через fork,
+        # поэтому файл выбирается по текущему pid; pid повторяется
+        # после перезапуска, время старта - нет
+        pid = os.getpid()
+        if self.pid != pid:
+            self.pid = pid
+            self.path = os.path.join(self.directory,
+                                     f'{pid}-{time.time_ns()}.json')
+        return self.path
+
+    def counter(self, name, documentation):
+        self.metrics[name] = ('counter', documentation, None)
+        return Counter(self, name)
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.metrics[name] = ('histogram', documentation, tuple(buckets))
+        return Histogram(self, name, tuple(buckets))
+
+    def inc(self, name, labels, value):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.maybe_flush()
+
+    def observe(self, name, labels, buckets, value):
+        key = (name, labels)
+        index = bisect.bisect_left(buckets, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [
+                    [0] * (len(buckets) + 1), 0, 0
+                ]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value
+                             in self.counters.items()],
+                'histograms': [[name, labels, list(counts), total, count]
+                               for (name, labels), (counts, total, count)
+                               in self.histograms.items()],
+            }
+
+    def maybe_flush(self):
+        if (self.directory and
+                time.monotonic() - self.flushed >= self.flush_interval and
+                self.flush_lock.acquire(blocking=False)):
+            try:
+                self.write()
+            finally:
+                self.flush_lock.release()
+
+    def flush(self):
+        if self.directory:
+            with self.flush_lock:
+                self.write()
+
+    def write(self):
+        self.flushed = time.monotonic()
+        path = self.file_path()
+        temporary = f'{path}.tmp'
+        # сбой записи метрик не должен ронять запрос
+        try:
+            with open(temporary, 'w') as file:
+                json.dump(self.snapshot(), file)
+            os.replace(temporary, path)
+        except OSError:
+            pass
+
+    def collect(self):
+        """
+        Значения всех процессов: свои из памяти, чужие из файлов
+        """
+        snapshots = [self.snapshot()]
+        if self.directory:
+            own_path = self.file_path()
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not name.endswith('.json') or path == own_path:
+                    continue
+                try:
+                    with open(path) as file:
+                        snapshots.append(json.load(file))
+                except (OSError, ValueError):
+                    continue
+        counters = {}
+        histograms = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, counts, total, count in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                if key not in histograms:
+                    histograms[key] = [[0] * len(counts), 0, 0]
+                histogram = histograms[key]
+                for index, bucket_count in enumerate(counts):
+                    histogram[0][index] += bucket_count
+                histogram[1] += total
+                histogram[2] += count
+        return counters, histograms
+
+    def render(self):
+        """
+        Текстовый формат Prometheus
+        """
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, documentation, buckets) in sorted(
+                self.metrics.items()):
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{format_labels(labels)} '
+                                     f'{format_value(value)}')
+                continue
+            for (metric, labels), (counts, total, count) in sorted(
+                    histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (('le', str(bound)),)
+                    lines.append(f'{name}_bucket'
+                                 f'{format_labels(bucket_labels)} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} '
+                             f'{format_value(total)}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter:
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def inc(self, value=1, **labels):
+        self.registry.inc(self.name, tuple(sorted(labels.items())), value)
+
+
+class Histogram:
+
+    def __init__(self, registry, name, buckets):
+        self.registry = registry
+        self.name = name
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        self.registry.observe(self.name, tuple(sorted(labels.items())),
+                              self.buckets, value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    ) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry(getattr(settings, 'POLLS_METRICS_DIR', None),
+                    getattr(settings, 'POLLS_METRICS_FLUSH_INTERVAL', 1))
+
+http_requests = registry.counter(
+    'polls_http_requests_total',
+    'Запросы по маршруту, методу и коду ответа'
+)
+http_request_duration = registry.histogram(
+    'polls_http_request_duration_seconds',
+    'Время ответа по маршруту и методу'
+)
+answers_accepted = registry.counter(
+    'polls_answers_accepted_total',
+    'Принятые ответы'
+)
+answers_rejected = registry.counter(
+    'polls_answers_rejected_total',
+    'Отклонённые ответы по причине'
+)
+answer_buffer_flush_duration = registry.histogram(
+    'polls_answer_buffer_flush_seconds',
+    'Время записи пачки отложенных ответов'
+)
+answer_buffer_batch_size = registry.histogram(
+    'polls_answer_buffer_batch_size',
+    'Размер пачки отложенных ответов',
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500)
+)
+answer_buffer_flush_failures = registry.counter(
+    'polls_answer_buffer_flush_failures_total',
+    'Неудачные попытки записи пачки отложенных ответов'
+)
+answer_buffer_dropped = registry.counter(
+    'polls_answer_buffer_dropped_total',
+    'Отложенные ответы, отброшенные после всех повторов записи'
+)
+
+
+def error_codes(codes):
+    """
+    Коды ошибок DRF ValidationError.get_codes() плоским списком
+    """
+    if isinstance(codes, dict):
+        codes = list(codes.values())
+    if isinstance(codes, list):
+        return [code for item in codes for code in error_codes(item)]
+    return [codes]
+
+
+def record_rejected(exc):
+    for code in error_codes(exc.get_codes()):
+        answers_rejected.inc(reason=code)
+
+
+class MetricsMiddleware:
+    """
+    Число запросов и гистограмма времени ответа по именам маршрутов.
+    Под ASGI работает асинхронно, как QueryInstrumentationMiddleware
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            self.observe(request, status, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            self.observe(request, status, started)
+
+    def observe(self, request, status, started):
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match else 'unmatched'
+        http_requests.inc(route=route, method=request.method,
+                          status=str(status))
+        http_request_duration.observe(time.perf_counter() - started,
+                                      route=route, method=request.method)
+
+
+def metrics_view(request):
+    """
+    Метрики всех процессов для сборщика. С POLLS_METRICS_TOKEN
+    нужен заголовок Authorization: Bearer <токен>
+    """
+    token = getattr(settings, 'POLLS_METRICS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -1,12 +1,67 @@
+import contextvars
+import struct
+from collections import defaultdict
+from contextlib import contextmanager
+
 from django.core.exceptions import ValidationError
 from django.db import models
 
 
-class Poll(models.Model):
+class Deletion:
+    """
+    Идущее удаление: модель, с которой оно началось, и варианты ответа,
+    отложенные обработчиками сигналов до конца удаления ({question_id: [id]})
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.choices = defaultdict(list)
+
+
+# в Django 3.2 сигналы удаления не сообщают, с чего начался каскад
+current_deletion = contextvars.ContextVar('polls_deletion', default=None)
+
+
+@contextmanager
+def deletion(model):
+    token = current_deletion.set(Deletion(model))
+    try:
+        yield
+    finally:
+        current_deletion.reset(token)
+
+
+class DeletionQuerySet(models.QuerySet):
+    def delete(self):
+        with deletion(self.model):
+            return super().delete()
+
+
+class DeletionModel(models.Model):
+    """
+    Модель, удаление которой видно обработчикам сигналов каскада
+    через current_deletion
+    """
+    objects = DeletionQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def delete(self, *args, **kwargs):
+        with deletion(type(self)):
+            return super().delete(*args, **kwargs)
+
+
+class Poll(DeletionModel):
     title = models.CharField(max_length=50, verbose_name='Название')
     description = models.TextField(verbose_name='Описание')
     start_date = models.DateField(verbose_name='Дата начала')
     end_date = models.DateField(verbose_name='Дата окончания')
+    # ответы закрытого опроса перенесены в архивную базу
+    archived_at = models.DateTimeField(null=True,
+                                       blank=True,
+                                       editable=False,
+                                       verbose_name='Перенесён в архив')
 
     class Meta:
         verbose_name = 'Опрос'
@@ -26,7 +81,7 @@ class Poll(models.Model):
                                   'идёт на протяжении одного дня')
 
 
-class Question(models.Model):
+class Question(DeletionModel):
 
     QUESTION_TYPE = (
         ('CHOICE', 'CHOICE'),
@@ -53,7 +108,7 @@ class Question(models.Model):
         return self.question_text
 
 
-class QuestionChoice(models.Model):
+class QuestionChoice(DeletionModel):
     question = models.ForeignKey(Question,
                                  on_delete=models.CASCADE,
                                  related_name='question_choice',
@@ -77,6 +132,19 @@ class QuestionChoice(models.Model):
                                   'для вопроса с типом ответа "TEXT"')
 
 
+def pack_choice_ids(choice_ids):
+    """
+    id выбранных вариантов по возрастанию, по 4 байта на id
+    """
+    choice_ids = sorted(set(choice_ids))
+    return struct.pack(f'>{len(choice_ids)}I', *choice_ids)
+
+
+def unpack_choice_ids(data):
+    data = bytes(data)
+    return list(struct.unpack(f'>{len(data) // 4}I', data))
+
+
 class Answer(models.Model):
     user_id = models.PositiveIntegerField(verbose_name='ID пользователя')
     poll = models.ForeignKey(Poll,
@@ -96,44 +164,200 @@ class Answer(models.Model):
     answer_text = models.CharField(max_length=256,
                                    blank=True,
                                    verbose_name='Текст ответа')
+    # копия типа вопроса для частичных уникальных ограничений
+    multichoice = models.BooleanField(default=False,
+                                      editable=False,
+                                      verbose_name='Несколько вариантов')
+    # компактная запись MULTICHOICE: все выборы пользователя в вопросе
+    # одной строкой, choice при этом пуст (polls/multichoice.py)
+    choice_ids = models.BinaryField(null=True,
+                                    editable=False,
+                                    verbose_name='Выбранные варианты')
 
     class Meta:
         verbose_name = 'Ответ пользователя'
         verbose_name_plural = 'Ответы пользователя'
+        indexes = [
+            models.Index(fields=['user_id', 'poll'],
+                         name='polls_answer_user_poll_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user_id', 'question'],
+                condition=models.Q(multichoice=False),
+                name='polls_answer_single_unique'
+            ),
+            models.UniqueConstraint(
+                fields=['user_id', 'question', 'choice'],
+                condition=models.Q(multichoice=True),
+                name='polls_answer_multichoice_unique'
+            ),
+            models.UniqueConstraint(
+                fields=['user_id', 'question'],
+                condition=models.Q(choice_ids__isnull=False),
+                name='polls_answer_compact_unique'
+            ),
+        ]
 
     def __str__(self):
-        return (f'{self.user_id} - {self.question.question_text}:'
-                f' {self.answer_text or self.choice}')
+        answer = self.answer_text or self.choice or self.selected_choices
+        return f'{self.user_id} - {self.question.question_text}: {answer}'
+
+    @property
+    def selected_choice_ids(self):
+        """
+        id выбранных вариантов в обеих записях MULTICHOICE
+        """
+        if self.choice_ids is not None:
+            return unpack_choice_ids(self.choice_ids)
+        return [self.choice_id] if self.choice_id else []
+
+    @property
+    def selected_choices(self):
+        return ', '.join(map(str, self.selected_choice_ids))
+
+    def save(self, *args, **kwargs):
+        # тип вопроса берём из уже загруженного вопроса, без запроса
+        if Answer.question.is_cached(self):
+            self.multichoice = self.question.question_type == 'MULTICHOICE'
+        super().save(*args, **kwargs)
 
     def clean(self):
-        if self.choice and self.answer_text:
-            raise ValidationError('Ответ состоит либо из предустановленного '
-                                  'выбора, либо из своего текста')
-
-        if self.question not in self.poll.poll_questions.all():
-            raise ValidationError('Вопрос на который вы ответили '
-                                  'не существует в выбранном опросе')
-
-        if (self.question.question_type in ['CHOICE', 'MULTICHOICE'] and
-                not self.choice):
-            raise ValidationError('На этот вопрос необходимо выбрать ответ')
-
-        if self.question.question_type == 'TEXT' and not self.answer_text:
-            raise ValidationError('На этот вопрос необходимо '
-                                  'написать свой ответ текстом')
-
-        if (self.choice not in self.question.question_choice.all() and
-                self.question.question_choice.all()):
-            raise ValidationError('Вы выбрали несуществующий вариант '
-                                  'ответа на данный вопрос')
-
-        if (self.question.question_type in ['MULTICHOICE'] and
-            Answer.objects.filter(user_id=self.user_id,
-                                  question=self.question,
-                                  choice=self.choice).exists()):
+        from .schema import get_schema
+
+        if self.poll_id is None or self.question_id is None:
+            return
+
+        schema = get_schema(self.poll_id)
+        schema.validate_answer(self.question_id,
+                               self.choice_id,
+                               self.answer_text)
+        question_type = schema.question_type(self.question_id)
+        self.multichoice = question_type == 'MULTICHOICE'
+        answers = Answer.objects.exclude(pk=self.pk)
+
+        if (question_type in ['MULTICHOICE'] and
+            answers.filter(user_id=self.user_id,
+                           question_id=self.question_id,
+                           choice_id=self.choice_id).exists()):
             raise ValidationError('Вы уже выбрали этот вариант ответа')
 
-        if (self.question.question_type in ['CHOICE', 'TEXT'] and
-            Answer.objects.filter(user_id=self.user_id,
-                                  question=self.question).exists()):
+        if (question_type in ['CHOICE', 'TEXT'] and
+            answers.filter(user_id=self.user_id,
+                           question_id=self.question_id).exists()):
             raise ValidationError('Вы уже отвечали на этот вопрос')
+
+
+def set_multichoice_flags(apps=None, schema_editor=None):
+    """
+    Проставляет multichoice по типу вопроса у ответов, записанных до
+    появления флага. Подходит для RunPython в миграции перед
+    созданием уникальных ограничений. Возвращает число исправленных строк
+    """
+    model = apps.get_model('polls', 'Answer') if apps else Answer
+    is_multichoice = models.Q(question__question_type='MULTICHOICE')
+    return (
+        model.objects.filter(is_multichoice, multichoice=False)
+        .update(multichoice=True) +
+        model.objects.exclude(is_multichoice).filter(multichoice=True)
+        .update(multichoice=False)
+    )
+
+
+class QuestionResult(models.Model):
+    question = models.OneToOneField(Question,
+                                    on_delete=models.CASCADE,
+                                    primary_key=True,
+                                    related_name='result',
+                                    verbose_name='Вопрос')
+    poll = models.ForeignKey(Poll,
+                             on_delete=models.CASCADE,
+                             related_name='question_results',
+                             verbose_name='Опрос')
+    answer_count = models.PositiveIntegerField(default=0,
+                                               verbose_name='Ответов')
+
+    class Meta:
+        verbose_name = 'Итог по вопросу'
+        verbose_name_plural = 'Итоги по вопросам'
+
+
+class ChoiceResult(models.Model):
+    choice = models.OneToOneField(QuestionChoice,
+                                  on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='result',
+                                  verbose_name='Вариант ответа')
+    question = models.ForeignKey(Question,
+                                 on_delete=models.CASCADE,
+                                 related_name='choice_results',
+                                 verbose_name='Вопрос')
+    answer_count = models.PositiveIntegerField(default=0,
+                                               verbose_name='Ответов')
+
+    class Meta:
+        verbose_name = 'Итог по варианту ответа'
+        verbose_name_plural = 'Итоги по вариантам ответа'
+
+
+class Participation(models.Model):
+    """
+    Участие пользователя в опросе: поддерживается в транзакции записи
+    ответов, пересчитывается командой rebuild_participation
+    """
+    user_id = models.PositiveIntegerField(verbose_name='ID пользователя')
+    poll = models.ForeignKey(Poll,
+                             on_delete=models.CASCADE,
+                             related_name='participations',
+                             verbose_name='Опрос')
+    first_answered_at = models.DateTimeField(verbose_name='Первый ответ')
+    last_answered_at = models.DateTimeField(verbose_name='Последний ответ')
+    answer_count = models.PositiveIntegerField(default=0,
+                                               verbose_name='Ответов')
+
+    class Meta:
+        verbose_name = 'Участие в опросе'
+        verbose_name_plural = 'Участие в опросах'
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'poll'],
+                                    name='polls_participation_unique'),
+        ]
+
+
+class ArchivedAnswer(models.Model):
+    """
+    Ответ закрытого опроса в архивной базе. Связей с основной базой нет,
+    тексты вопроса и выбора сохраняются на момент переноса
+    """
+    # id ответа в основной таблице
+    id = models.IntegerField(primary_key=True, verbose_name='ID ответа')
+    user_id = models.PositiveIntegerField(verbose_name='ID пользователя')
+    poll_id = models.IntegerField(verbose_name='ID опроса')
+    question_id = models.IntegerField(verbose_name='ID вопроса')
+    question_type = models.CharField(max_length=15,
+                                     verbose_name='Тип вопроса')
+    question_text = models.CharField(max_length=256,
+                                     verbose_name='Текст вопроса')
+    choice_id = models.IntegerField(null=True,
+                                    verbose_name='ID выбранного ответа')
+    choice_text = models.CharField(max_length=256,
+                                   null=True,
+                                   verbose_name='Выбранный ответ')
+    # компактная запись MULTICHOICE, тексты берутся из вариантов ответа
+    choice_ids = models.BinaryField(null=True,
+                                    verbose_name='Выбранные варианты')
+    answer_text = models.CharField(max_length=256,
+                                   blank=True,
+                                   verbose_name='Текст ответа')
+    multichoice = models.BooleanField(default=False,
+                                      verbose_name='Несколько вариантов')
+
+    class Meta:
+        verbose_name = 'Архивный ответ'
+        verbose_name_plural = 'Архивные ответы'
+        indexes = [
+            models.Index(fields=['poll_id', 'id'],
+                         name='polls_archive_poll_idx'),
+            models.Index(fields=['user_id', 'poll_id'],
+                         name='polls_archive_user_poll_idx'),
+        ]
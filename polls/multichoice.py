@@ -0,0 +1,235 @@
+"""
+Компактная запись ответов MULTICHOICE.
+
+В обычной записи каждый выбор - отдельная строка Answer. С
+POLLS_COMPACT_MULTICHOICE все выборы пользователя в вопросе хранятся
+одной строкой: choice пуст, а id вариантов упакованы в choice_ids.
+Чтение, итоги и удаление понимают обе записи, поэтому настройку можно
+включить на работающей базе, а старые строки свернуть командой
+compact_multichoice
+"""
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import (Answer, QuestionChoice, pack_choice_ids,
+                     unpack_choice_ids)
+from .results import discard_answers, record_answers
+from .versions import bump_user_versions
+
+COMPACT_BATCH_SIZE = 500
+
+
+def selected_choices(user_ids, question_ids, lock=False):
+    """
+    Уже записанные выборы MULTICHOICE в обеих записях:
+    {(user_id, question_id): множество id} и компактные строки
+    по тем же ключам
+    """
+    answers = Answer.objects.filter(
+        user_id__in=user_ids, question_id__in=question_ids,
+        multichoice=True
+    ).only('id', 'user_id', 'poll_id', 'question_id', 'choice_id',
+           'choice_ids')
+    if lock:
+        answers = answers.select_for_update()
+    selected = defaultdict(set)
+    compact = {}
+    for answer in answers:
+        key = (answer.user_id, answer.question_id)
+        selected[key].update(answer.selected_choice_ids)
+        if answer.choice_ids is not None:
+            compact[key] = answer
+    return selected, compact
+
+
+def merge_choices(groups):
+    """
+    Дописывает выборы groups ({(user_id, question_id): [Answer]})
+    к компактным строкам, недостающие строки создаёт. Повторный
+    выбор - IntegrityError, как у обычной записи
+    """
+    selected, compact = selected_choices(
+        {user_id for user_id, _ in groups},
+        {question_id for _, question_id in groups},
+        lock=True
+    )
+    changed = []
+    created = []
+    for key, answers in groups.items():
+        choice_ids = [answer.choice_id for answer in answers]
+        if selected[key].intersection(choice_ids):
+            raise IntegrityError('Повторный выбор варианта ответа')
+        row = compact.get(key)
+        if row is not None:
+            row.choice_ids = pack_choice_ids(row.selected_choice_ids +
+                                             choice_ids)
+            changed.append(row)
+        else:
+            row = compact[key] = Answer(
+                user_id=answers[0].user_id, poll_id=answers[0].poll_id,
+                question_id=answers[0].question_id, multichoice=True,
+                choice_ids=pack_choice_ids(choice_ids)
+            )
+            created.append(row)
+    Answer.objects.bulk_update(changed, ['choice_ids'])
+    # SQLite не возвращает id из bulk insert, тогда id ответов
+    # остаются пустыми
+    Answer.objects.bulk_create(created)
+    for key, answers in groups.items():
+        for answer in answers:
+            answer.id = compact[key].id
+
+
+def insert_answers(answers):
+    """
+    Записывает новые ответы (объекты Answer) и учитывает их в итогах,
+    в транзакции вызывающего. С POLLS_COMPACT_MULTICHOICE выборы
+    MULTICHOICE сворачиваются в строку пользователя и вопроса, ответам
+    присваивается её id, если база его вернула. Возвращает ответы
+    """
+    if not settings.POLLS_COMPACT_MULTICHOICE:
+        answers = Answer.objects.bulk_create(answers)
+        record_answers(answers)
+        return answers
+    plain = []
+    groups = defaultdict(list)
+    for answer in answers:
+        if answer.multichoice and answer.choice_id:
+            groups[answer.user_id, answer.question_id].append(answer)
+        else:
+            plain.append(answer)
+    Answer.objects.bulk_create(plain)
+    if groups:
+        try:
+            with transaction.atomic():
+                merge_choices(groups)
+        except IntegrityError:
+            # параллельный запрос мог создать ту же строку: теперь она
+            # найдётся и заблокируется, повторяем один раз
+            merge_choices(groups)
+    # итоги считаются по выборам, поэтому годятся исходные ответы
+    record_answers(answers)
+    return answers
+
+
+def strip_choices(question_id, choice_ids):
+    """
+    Убирает удаляемые варианты из компактных строк вопроса, строки
+    без выборов удаляет. Каскад этого не сделает: в строке нет
+    внешнего ключа на вариант
+    """
+    choice_ids = set(choice_ids)
+    changed = []
+    emptied = []
+    removed = []
+    for answer in Answer.objects.filter(
+            question_id=question_id, choice_ids__isnull=False
+    ).only('id', 'user_id', 'poll_id', 'question_id', 'choice_ids'):
+        selected = answer.selected_choice_ids
+        kept = [choice_id for choice_id in selected
+                if choice_id not in choice_ids]
+        if len(kept) == len(selected):
+            continue
+        removed.extend(
+            Answer(user_id=answer.user_id, poll_id=answer.poll_id,
+                   question_id=question_id, choice_id=choice_id)
+            for choice_id in selected if choice_id in choice_ids
+        )
+        if kept:
+            answer.choice_ids = pack_choice_ids(kept)
+            changed.append(answer)
+        else:
+            emptied.append(answer.id)
+    if not removed:
+        return
+    Answer.objects.bulk_update(changed, ['choice_ids'])
+    Answer.objects.filter(id__in=emptied).delete()
+    discard_answers(removed)
+    transaction.on_commit(partial(bump_user_versions,
+                                  [answer.user_id for answer in removed]))
+
+
+def compact_question(question_id, batch_size=COMPACT_BATCH_SIZE):
+    """
+    Сворачивает обычные строки MULTICHOICE вопроса в компактные
+    порциями по batch_size пользователей. Итоги не меняются: число
+    выборов то же. Возвращает число свёрнутых строк
+    """
+    answers = Answer.objects.filter(question_id=question_id,
+                                    multichoice=True,
+                                    choice__isnull=False)
+    compacted = 0
+    last_user_id = -1
+    while True:
+        user_ids = list(answers.filter(user_id__gt=last_user_id)
+                        .order_by('user_id').values_list('user_id',
+                                                         flat=True)
+                        .distinct()[:batch_size])
+        if not user_ids:
+            return compacted
+        last_user_id = user_ids[-1]
+        with transaction.atomic():
+            rows = defaultdict(list)
+            for answer in answers.filter(
+                    user_id__gte=user_ids[0], user_id__lte=last_user_id
+            ).order_by('id').only('id', 'user_id', 'poll_id',
+                                  'question_id', 'choice_id'):
+                rows[answer.user_id].append(answer)
+            _, compact = selected_choices(list(rows), [question_id],
+                                          lock=True)
+            changed = []
+            deleted = []
+            for user_id, expanded in rows.items():
+                choice_ids = [answer.choice_id for answer in expanded]
+                row = compact.get((user_id, question_id))
+                if row is None:
+                    # первая строка пользователя становится компактной
+                    row, expanded = expanded[0], expanded[1:]
+                    row.choice = None
+                else:
+                    choice_ids += row.selected_choice_ids
+                row.choice_ids = pack_choice_ids(choice_ids)
+                changed.append(row)
+                deleted.extend(answer.id for answer in expanded)
+            for start in range(0, len(deleted), COMPACT_BATCH_SIZE):
+                Answer.objects.filter(
+                    id__in=deleted[start:start + COMPACT_BATCH_SIZE]
+                ).delete()
+            Answer.objects.bulk_update(changed, ['choice', 'choice_ids'])
+            transaction.on_commit(partial(bump_user_versions, list(rows)))
+        compacted += sum(map(len, rows.values()))
+
+
+def choice_texts(**filters):
+    """
+    Тексты вариантов ответа {id: текст} для разворачивания компактных строк
+    """
+    return dict(QuestionChoice.objects.filter(**filters)
+                .values_list('id', 'choice_text'))
+
+
+def expand_rows(rows, load_texts, choice_index=None, text_index=-1):
+    """
+    Разворачивает строки выборки, последнее поле которых - choice_ids,
+    по строке на каждый выбор компактной записи: поле choice_index
+    получает id варианта, text_index - его текст. Тексты загружаются
+    load_texts() на первой компактной строке, варианты без текста
+    пропускаются
+    """
+    texts = None
+    for *row, choice_ids in rows:
+        if choice_ids is None:
+            yield tuple(row)
+            continue
+        if texts is None:
+            texts = load_texts()
+        for choice_id in unpack_choice_ids(choice_ids):
+            if choice_id not in texts:
+                continue
+            if choice_index is not None:
+                row[choice_index] = choice_id
+            row[text_index] = texts[choice_id]
+            yield tuple(row)
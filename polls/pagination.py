@@ -0,0 +1,36 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Курсорная пагинация по ключу: страница выбирается условием
+    id < курсора, поэтому глубина листания не влияет на время запроса.
+    Курсор непрозрачный, размер страницы задаётся параметром page_size
+    """
+    ordering = '-id'
+    page_size = getattr(settings, 'POLLS_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'POLLS_MAX_PAGE_SIZE', 500)
+    # без page_size и cursor отдаётся весь список, как до пагинации
+    optional = False
+
+    def get_page_size(self, request):
+        if self.optional and not (
+                self.page_size_query_param in request.query_params or
+                self.cursor_query_param in request.query_params):
+            return None
+        return super().get_page_size(request)
+
+
+class PollPagination(KeysetPagination):
+    optional = True
+
+
+class QuestionPagination(KeysetPagination):
+    ordering = 'id'
+
+
+class UserPollPagination(KeysetPagination):
+    ordering = '-poll_id'
+    optional = True
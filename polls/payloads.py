@@ -0,0 +1,68 @@
+"""
+Ответы публичных эндпоинтов опросов без сериализаторов DRF.
+
+Словари собираются из строк .values() в том же виде, что дают
+PollSerializer и PollDetailSerializer: те же ключи в том же порядке,
+даты строками ISO 8601. Совпадение с сериализаторами байт в байт
+проверяет tests/test_payloads.py
+"""
+from .instrumentation import timed
+from .models import Poll, Question, QuestionChoice
+
+POLL_FIELDS = ('id', 'title', 'description', 'start_date', 'end_date')
+
+
+def poll_row(row):
+    """
+    Опрос из строки .values(*POLL_FIELDS) в виде PollSerializer
+    """
+    return {
+        'poll_id': row['id'],
+        'title': row['title'],
+        'description': row['description'],
+        'start_date': row['start_date'].isoformat(),
+        'end_date': row['end_date'].isoformat(),
+    }
+
+
+def poll_list(rows):
+    """
+    Список опросов из строк .values(*POLL_FIELDS)
+    """
+    with timed('serializer'):
+        return [poll_row(row) for row in rows]
+
+
+def poll_detail(poll_id):
+    """
+    Опрос с вопросами и вариантами ответа в виде PollDetailSerializer,
+    тремя запросами. Для несуществующего опроса возвращает None
+    """
+    row = Poll.objects.filter(id=poll_id).values(*POLL_FIELDS).first()
+    if row is None:
+        return None
+    questions = list(
+        Question.objects.filter(poll_id=poll_id).order_by('id')
+        .values_list('id', 'question_text', 'question_type')
+    )
+    choices = list(
+        QuestionChoice.objects.filter(question__poll_id=poll_id)
+        .order_by('id').values_list('question_id', 'id', 'choice_text')
+    )
+    with timed('serializer'):
+        data = poll_row(row)
+        by_question = {}
+        poll_questions = []
+        for question_id, question_text, question_type in questions:
+            question_choice = by_question[question_id] = []
+            poll_questions.append({
+                'question_id': question_id,
+                'question_text': question_text,
+                'question_type': question_type,
+                'question_choice': question_choice,
+            })
+        for question_id, choice_id, choice_text in choices:
+            by_question[question_id].append({'choice_id': choice_id,
+                                             'choice_text': choice_text})
+        data['poll_questions'] = poll_questions
+    return data
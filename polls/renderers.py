@@ -0,0 +1,37 @@
+import json
+
+from rest_framework.renderers import (SHORT_SEPARATORS, BrowsableAPIRenderer,
+                                      JSONRenderer)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer для ответов из простых типов (словари, списки, строки,
+    числа): один заранее настроенный кодировщик без кодировщика DRF
+    и без разбора заголовка Accept. Вывод тот же байт в байт, с отступом
+    или для других типов рендерит JSONRenderer
+    """
+    encoder = json.JSONEncoder(ensure_ascii=JSONRenderer.ensure_ascii,
+                               allow_nan=not JSONRenderer.strict,
+                               separators=SHORT_SEPARATORS)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (data is None or not self.compact or
+                (accepted_media_type and
+                 accepted_media_type != self.media_type) or
+                (renderer_context and 'indent' in renderer_context)):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            ret = self.encoder.encode(data)
+        except TypeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        if '\u2028' in ret or '\u2029' in ret:
+            ret = ret.replace('\u2028', '\\u2028').replace('\u2029',
+                                                           '\\u2029')
+        return ret.encode()
+
+
+# JSON по умолчанию и просмотр в браузере, как в настройках DRF
+FAST_RENDERER_CLASSES = (FastJSONRenderer, BrowsableAPIRenderer)
@@ -0,0 +1,293 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import (Case, Count, F, IntegerField, Sum, Value,
+                              When)
+from django.db.models.functions import Coalesce, Length
+from django.utils import timezone
+
+from .models import (Answer, ChoiceResult, Participation, Question,
+                     QuestionChoice, QuestionResult, unpack_choice_ids)
+
+
+# число выборов в строке ответа: компактная строка MULTICHOICE хранит
+# по 4 байта на выбор, остальные строки - один ответ
+SELECTIONS = Coalesce(Length('choice_ids') / 4, Value(1))
+
+
+def selection_count(answer):
+    return len(answer.selected_choice_ids) if answer.choice_ids else 1
+
+
+def _update(model, deltas):
+    """
+    Прибавления - одним UPDATE на все счётчики, CASE по величине
+    прибавления. Вычитания - по UPDATE на каждое различное изменение,
+    счётчик не уходит в минус
+    """
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    added = {delta: pks for delta, pks in by_delta.items() if delta > 0}
+    updated = 0
+    if len(added) == 1:
+        (delta, pks), = added.items()
+        updated += model.objects.filter(pk__in=pks).update(
+            answer_count=F('answer_count') + delta
+        )
+    elif added:
+        updated += model.objects.filter(
+            pk__in=[pk for pks in added.values() for pk in pks]
+        ).update(answer_count=F('answer_count') + Case(
+            *[When(pk__in=pks, then=Value(delta))
+              for delta, pks in added.items()],
+            output_field=IntegerField()
+        ))
+    for delta, pks in by_delta.items():
+        if delta < 0:
+            updated += model.objects.filter(
+                pk__in=pks, answer_count__gte=-delta
+            ).update(answer_count=F('answer_count') + delta)
+    return updated
+
+
+def _apply(model, deltas, defaults):
+    """
+    Прибавляет к счётчикам deltas ({pk: изменение}). Недостающие
+    строки счётчиков создаются на лету из defaults ({pk: поля})
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    updated = _update(model, deltas)
+    if updated == len(deltas):
+        return
+    missing = [pk for pk in deltas if deltas[pk] > 0]
+    if updated:
+        # если не обновилась ни одна строка, отсутствуют все,
+        # как у первых ответов на новые вопросы
+        existing = set(model.objects.filter(pk__in=deltas)
+                       .values_list('pk', flat=True))
+        missing = [pk for pk in missing if pk not in existing]
+    if missing:
+        model.objects.bulk_create(
+            [model(pk=pk, **defaults[pk]) for pk in missing],
+            ignore_conflicts=True
+        )
+        _update(model, {pk: deltas[pk] for pk in missing})
+
+
+def _count(answers, sign=1):
+    question_deltas = Counter()
+    choice_deltas = Counter()
+    question_defaults = {}
+    choice_defaults = {}
+    for answer in answers:
+        question_deltas[answer.question_id] += sign * selection_count(answer)
+        question_defaults[answer.question_id] = {'poll_id': answer.poll_id}
+        for choice_id in answer.selected_choice_ids:
+            choice_deltas[choice_id] += sign
+            choice_defaults[choice_id] = {'question_id': answer.question_id}
+    _apply(QuestionResult, question_deltas, question_defaults)
+    _apply(ChoiceResult, choice_deltas, choice_defaults)
+
+
+def _update_participation(deltas, now):
+    # одно UPDATE на опрос и изменение: пачка ответов обычно из одного
+    # опроса, а пары (user_id, poll) через OR не укладываются в индекс
+    groups = defaultdict(list)
+    for (user_id, poll_id), delta in deltas.items():
+        groups[poll_id, delta].append(user_id)
+    updated = 0
+    for (poll_id, delta), user_ids in groups.items():
+        rows = Participation.objects.filter(poll_id=poll_id,
+                                            user_id__in=user_ids)
+        if delta > 0:
+            updated += rows.update(answer_count=F('answer_count') + delta,
+                                   last_answered_at=now)
+        else:
+            updated += rows.filter(answer_count__gte=-delta).update(
+                answer_count=F('answer_count') + delta
+            )
+            rows.filter(answer_count=0).delete()
+    return updated
+
+
+def count_participation(deltas):
+    """
+    Прибавляет к участию пользователей в опросах deltas
+    ({(user_id, poll_id): изменение числа ответов}). Участие без
+    ответов удаляется
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    now = timezone.now()
+    updated = _update_participation(deltas, now)
+    if updated == len(deltas):
+        return
+    missing = {key: delta for key, delta in deltas.items() if delta > 0}
+    if updated and missing:
+        # если не обновилась ни одна строка, отсутствуют все,
+        # как при первом ответе пользователя в опросе
+        existing = set(Participation.objects.filter(
+            user_id__in={user_id for user_id, _ in missing},
+            poll_id__in={poll_id for _, poll_id in missing}
+        ).values_list('user_id', 'poll_id'))
+        missing = {key: delta for key, delta in missing.items()
+                   if key not in existing}
+    if missing:
+        # параллельная транзакция могла вставить ту же строку
+        Participation.objects.bulk_create(
+            [Participation(user_id=user_id, poll_id=poll_id,
+                           first_answered_at=now, last_answered_at=now)
+             for user_id, poll_id in missing],
+            ignore_conflicts=True
+        )
+        _update_participation(missing, now)
+
+
+def record_answers(answers):
+    """
+    Учитывает новые ответы в итогах и участии пользователей.
+    Вызывается в той же транзакции, что и вставка ответов
+    """
+    _count(answers)
+    deltas = Counter()
+    for answer in answers:
+        deltas[answer.user_id, answer.poll_id] += selection_count(answer)
+    count_participation(deltas)
+
+
+def discard_answers(answers):
+    """
+    Убирает удаляемые ответы из итогов и участия, в транзакции удаления
+    """
+    _count(answers, sign=-1)
+    deltas = Counter()
+    for answer in answers:
+        deltas[answer.user_id, answer.poll_id] -= selection_count(answer)
+    count_participation(deltas)
+
+
+def rebuild_results(poll_id=None):
+    """
+    Пересчитывает итоги с нуля по таблице ответов. Итоги опросов,
+    перенесённых в архив, не трогаются
+    """
+    answers = Answer.objects.filter(poll__archived_at__isnull=True)
+    question_results = QuestionResult.objects.filter(
+        poll__archived_at__isnull=True
+    )
+    choice_results = ChoiceResult.objects.filter(
+        question__poll__archived_at__isnull=True
+    )
+    if poll_id is not None:
+        answers = answers.filter(poll_id=poll_id)
+        question_results = question_results.filter(poll_id=poll_id)
+        choice_results = choice_results.filter(question__poll_id=poll_id)
+    with transaction.atomic():
+        question_results.delete()
+        choice_results.delete()
+        QuestionResult.objects.bulk_create(
+            QuestionResult(question_id=row['question'],
+                           poll_id=row['poll'],
+                           answer_count=row['total'])
+            for row in answers.values('poll', 'question')
+            .annotate(total=Sum(SELECTIONS)).order_by()
+        )
+        choice_counts = {
+            (row['question'], row['choice']): row['total']
+            for row in answers.filter(choice__isnull=False)
+            .values('question', 'choice')
+            .annotate(total=Count('id')).order_by()
+        }
+        # компактные строки MULTICHOICE разбираются на выборы в памяти
+        for question_id, choice_ids in answers.filter(
+                choice_ids__isnull=False
+        ).values_list('question_id', 'choice_ids').iterator():
+            for choice_id in unpack_choice_ids(choice_ids):
+                key = (question_id, choice_id)
+                choice_counts[key] = choice_counts.get(key, 0) + 1
+        ChoiceResult.objects.bulk_create(
+            ChoiceResult(choice_id=choice_id,
+                         question_id=question_id,
+                         answer_count=total)
+            for (question_id, choice_id), total in choice_counts.items()
+        )
+
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def rebuild_participation(poll_id=None):
+    """
+    Пересчитывает участие пользователей по таблице ответов. Время
+    ответов в таблице ответов не хранится: у существующих строк оно
+    сохраняется, у восстановленных - текущее. Участие в опросах,
+    перенесённых в архив, не трогается
+    """
+    answers = Answer.objects.filter(poll__archived_at__isnull=True)
+    participations = Participation.objects.filter(
+        poll__archived_at__isnull=True
+    )
+    if poll_id is not None:
+        answers = answers.filter(poll_id=poll_id)
+        participations = participations.filter(poll_id=poll_id)
+    now = timezone.now()
+    with transaction.atomic():
+        counts = {(row['user_id'], row['poll']): row['total']
+                  for row in answers.values('user_id', 'poll')
+                  .annotate(total=Sum(SELECTIONS)).order_by()}
+        changed = []
+        removed = []
+        for participation in participations.only(
+                'id', 'user_id', 'poll_id', 'answer_count').iterator():
+            total = counts.pop((participation.user_id,
+                                participation.poll_id), 0)
+            if not total:
+                removed.append(participation.id)
+            elif total != participation.answer_count:
+                participation.answer_count = total
+                changed.append(participation)
+        for start in range(0, len(removed), REBUILD_BATCH_SIZE):
+            Participation.objects.filter(
+                id__in=removed[start:start + REBUILD_BATCH_SIZE]
+            ).delete()
+        Participation.objects.bulk_update(changed, ['answer_count'],
+                                          batch_size=REBUILD_BATCH_SIZE)
+        Participation.objects.bulk_create(
+            [Participation(user_id=user_id, poll_id=poll,
+                           first_answered_at=now, last_answered_at=now,
+                           answer_count=total)
+             for (user_id, poll), total in counts.items()],
+            batch_size=REBUILD_BATCH_SIZE
+        )
+    return {'created': len(counts), 'updated': len(changed),
+            'deleted': len(removed)}
+
+
+def poll_results(poll_id):
+    """
+    Итоги опроса из счётчиков: два запроса, без обхода ответов
+    """
+    questions = []
+    by_id = {}
+    for question in Question.objects.filter(poll_id=poll_id).order_by(
+            'id').values('id', 'question_text', 'question_type',
+                         'result__answer_count'):
+        result = {'question_id': question['id'],
+                  'question_text': question['question_text'],
+                  'question_type': question['question_type'],
+                  'answer_count': question['result__answer_count'] or 0,
+                  'choices': []}
+        by_id[question['id']] = result
+        questions.append(result)
+    choices = QuestionChoice.objects.filter(
+        question__poll_id=poll_id
+    ).order_by('id').values('id', 'question_id', 'choice_text',
+                            'result__answer_count')
+    for choice in choices:
+        by_id[choice['question_id']]['choices'].append({
+            'choice_id': choice['id'],
+            'choice_text': choice['choice_text'],
+            'answer_count': choice['result__answer_count'] or 0,
+        })
+    return questions
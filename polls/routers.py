@@ -0,0 +1,29 @@
+from django.conf import settings
+
+ARCHIVE_DATABASE = getattr(settings, 'POLLS_ARCHIVE_DATABASE', 'archive')
+ARCHIVE_MODELS = {'archivedanswer'}
+
+
+class ArchiveRouter:
+    """
+    Архивные модели читаются и пишутся в базе ARCHIVE_DATABASE,
+    остальные - в default. В архивной базе создаются только
+    таблицы архивных моделей
+    """
+
+    def is_archive(self, model):
+        return (model._meta.app_label == 'polls' and
+                model._meta.model_name in ARCHIVE_MODELS)
+
+    def db_for_read(self, model, **hints):
+        return ARCHIVE_DATABASE if self.is_archive(model) else None
+
+    def db_for_write(self, model, **hints):
+        return ARCHIVE_DATABASE if self.is_archive(model) else None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'polls' and model_name in ARCHIVE_MODELS:
+            return db == ARCHIVE_DATABASE
+        if db == ARCHIVE_DATABASE:
+            return False
+        return None
@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+from .models import Poll, Question, QuestionChoice
+
+SCHEMA_CACHE_KEY = 'polls:schema:{}'
+SCHEMA_TIMEOUT = getattr(settings, 'POLLS_SCHEMA_TIMEOUT', 60 * 60)
+
+
+class PollSchema:
+    """
+    Скомпилированная структура опроса: тип каждого вопроса и id
+    допустимых вариантов ответа. Все структурные проверки ответа
+    выполняются в памяти, без запросов к базе
+    """
+    # у схем, закэшированных до появления архива, атрибута нет
+    archived = False
+
+    def __init__(self, poll_id, question_types, question_choices,
+                 archived=False):
+        self.poll_id = poll_id
+        self.question_types = question_types
+        self.question_choices = question_choices
+        self.archived = archived
+
+    def question_type(self, question_id):
+        return self.question_types.get(question_id)
+
+    def choices(self, question_id):
+        return self.question_choices.get(question_id, frozenset())
+
+    def validate_answer(self, question_id, choice_id, answer_text):
+        if self.archived:
+            raise ValidationError('Опрос закрыт и перенесён в архив',
+                                  code='archived_poll')
+
+        question_type = self.question_type(question_id)
+        if question_type is None:
+            raise ValidationError('Вопрос с таким id не существует '
+                                  'в этом опросе', code='unknown_question')
+
+        if choice_id and answer_text:
+            raise ValidationError('Ответ состоит либо из предустановленного '
+                                  'выбора, либо из своего текста',
+                                  code='choice_and_text')
+
+        if question_type in ['CHOICE', 'MULTICHOICE'] and not choice_id:
+            raise ValidationError('На этот вопрос необходимо выбрать ответ',
+                                  code='choice_required')
+
+        if question_type == 'TEXT' and not answer_text:
+            raise ValidationError('На этот вопрос необходимо '
+                                  'написать свой ответ текстом',
+                                  code='text_required')
+
+        choices = self.choices(question_id)
+        if choices and choice_id not in choices:
+            raise ValidationError('Вы выбрали несуществующий вариант '
+                                  'ответа на данный вопрос',
+                                  code='unknown_choice')
+
+
+def compile_schema(poll_id):
+    poll = Poll.objects.filter(id=poll_id).values('archived_at').first()
+    if poll is None:
+        return None
+    question_types = dict(
+        Question.objects.filter(poll_id=poll_id)
+        .values_list('id', 'question_type')
+    )
+    question_choices = {}
+    for question_id, choice_id in (
+            QuestionChoice.objects.filter(question__poll_id=poll_id)
+            .values_list('question_id', 'id')):
+        question_choices.setdefault(question_id, set()).add(choice_id)
+    question_choices = {question_id: frozenset(choices)
+                        for question_id, choices in question_choices.items()}
+    return PollSchema(poll_id, question_types, question_choices,
+                      archived=poll['archived_at'] is not None)
+
+
+def get_schema(poll_id):
+    """
+    Схема опроса из кэша, при промахе компилируется заново.
+    Для несуществующего опроса возвращает None
+    """
+    key = SCHEMA_CACHE_KEY.format(poll_id)
+    schema = cache.get(key)
+    if schema is None:
+        schema = compile_schema(poll_id)
+        if schema is not None:
+            cache.set(key, schema, SCHEMA_TIMEOUT)
+    return schema
+
+
+def invalidate_schema(poll_id):
+    cache.delete(SCHEMA_CACHE_KEY.format(poll_id))
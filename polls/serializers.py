@@ -1,10 +1,21 @@
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.http import Http404
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
-from .models import Answer, Poll, Question, QuestionChoice
+from .instrumentation import TimedListSerializer, TimedModelSerializer
+from .models import (Answer, Poll, Question, QuestionChoice,
+                     unpack_choice_ids)
+from .multichoice import insert_answers
+from .schema import get_schema
+from .versions import bump_user_versions
 
+MAX_ANSWERS_PER_REQUEST = getattr(settings, 'POLLS_MAX_ANSWERS_PER_REQUEST',
+                                  500)
 
-class PollSerializer(serializers.ModelSerializer):
+
+class PollSerializer(TimedModelSerializer):
 
     poll_id = serializers.IntegerField(source='id', read_only=True)
 
@@ -12,6 +23,7 @@ class PollSerializer(serializers.ModelSerializer):
         model = Poll
         fields = ['poll_id', 'title', 'description',
                   'start_date', 'end_date']
+        list_serializer_class = TimedListSerializer
 
     def validate_start_date(self, value):
         if self.instance:
@@ -42,15 +54,15 @@ class PollSerializer(serializers.ModelSerializer):
 
 class QuestionChoiceSerializer(serializers.ModelSerializer):
 
-    choice_id = serializers.IntegerField(source='id',
-                                         read_only=True)
+    # при обновлении вопроса choice_id указывает изменяемый вариант
+    choice_id = serializers.IntegerField(source='id', required=False)
 
     class Meta:
         model = QuestionChoice
         fields = ['choice_id', 'choice_text']
 
 
-class QuestionSerializer(serializers.ModelSerializer):
+class QuestionSerializer(TimedModelSerializer):
 
     question_id = serializers.IntegerField(source='id',
                                            read_only=True)
@@ -61,6 +73,7 @@ class QuestionSerializer(serializers.ModelSerializer):
         model = Question
         fields = ['question_id', 'poll', 'question_text',
                   'question_type', 'question_choice']
+        list_serializer_class = TimedListSerializer
 
     def create(self, validated_data):
         question_choices = validated_data.pop('question_choice')
@@ -74,35 +87,88 @@ class QuestionSerializer(serializers.ModelSerializer):
         return question
 
     def update(self, instance, validated_data):
-        instance.question_text = validated_data.get(
-            'question_text', instance.question_text
-        )
-        instance.question_type = validated_data.get(
-            'question_type', instance.question_type
-        )
-        question_choice = instance.question_choice
-        instance.save()
-        if (instance.question_type in ['CHOICE', 'MULTICHOICE'] and
-                not validated_data.get('question_choice')):
+        question_type = validated_data.get('question_type',
+                                           instance.question_type)
+        choices = validated_data.get('question_choice')
+        if question_type in ['TEXT']:
+            if choices:
+                raise serializers.ValidationError(
+                    'Нельзя создать вариант ответа для '
+                    'вопроса с типом ответа "TEXT"!'
+                )
+            choices = []
+        elif choices is None and instance.question_type in ['TEXT']:
+            # PATCH без вариантов: у текстового вопроса их нет
+            choices = []
+        if question_type in ['CHOICE', 'MULTICHOICE'] and choices == []:
             raise serializers.ValidationError(
                 'Создайте хотя бы один вариант ответа'
             )
-        if (validated_data.get('question_choice') and
-                instance.question_type in ['TEXT']):
-            raise serializers.ValidationError(
-                'Нельзя создать вариант ответа для '
-                'вопроса с типом ответа "TEXT"!'
-            )
-        question_choice.all().delete()
-        if instance.question_type in ['CHOICE', 'MULTICHOICE']:
-            question_choices = validated_data.pop('question_choice')
-            for choice in question_choices:
-                choice = QuestionChoice.objects.create(
-                    question=instance,
-                    choice_text=choice['choice_text']
-                )
+        instance.question_text = validated_data.get(
+            'question_text', instance.question_text
+        )
+        instance.question_type = question_type
+        with transaction.atomic():
+            # сохранение вопроса сбрасывает кэш опроса, в том числе
+            # за bulk_update и bulk_create, которые сигналов не шлют
+            instance.save()
+            if choices is not None:
+                self.update_choices(instance, choices)
         return instance
 
+    def update_choices(self, question, choices):
+        """
+        Приводит варианты ответа вопроса к списку choices. Варианты
+        узнаются по choice_id, без него - по тексту среди ещё не
+        занятых. Неизменённые варианты и ответы на них не трогаются,
+        удаляются только пропавшие из списка
+        """
+        existing = {choice.id: choice
+                    for choice in question.question_choice.all()}
+        by_text = {}
+        for choice in existing.values():
+            by_text.setdefault(choice.choice_text, []).append(choice)
+        claimed = set()
+        for item in choices:
+            choice_id = item.get('id')
+            if choice_id is None:
+                continue
+            if choice_id not in existing or choice_id in claimed:
+                raise serializers.ValidationError({
+                    'question_choice': f'Вариант ответа {choice_id} '
+                                       f'не относится к вопросу'
+                })
+            claimed.add(choice_id)
+        changed = []
+        created = []
+        for item in choices:
+            choice_id = item.get('id')
+            if choice_id is not None:
+                choice = existing[choice_id]
+                if choice.choice_text != item['choice_text']:
+                    choice.choice_text = item['choice_text']
+                    changed.append(choice)
+                continue
+            same_text = [choice for choice
+                         in by_text.get(item['choice_text'], [])
+                         if choice.id not in claimed]
+            if same_text:
+                claimed.add(same_text[0].id)
+            else:
+                created.append(QuestionChoice(
+                    question=question, choice_text=item['choice_text']
+                ))
+        removed = [choice_id for choice_id in existing
+                   if choice_id not in claimed]
+        if removed:
+            # ответы на удаляемые варианты уходят каскадом, из итогов
+            # и участия их убирает сигнал удаления варианта
+            QuestionChoice.objects.filter(id__in=removed).delete()
+        if changed:
+            QuestionChoice.objects.bulk_update(changed, ['choice_text'])
+        if created:
+            QuestionChoice.objects.bulk_create(created)
+
     def validate(self, data):
         if (data.get('question_type') in ['TEXT'] and
                 data.get('question_choice')):
@@ -118,7 +184,7 @@ class QuestionSerializer(serializers.ModelSerializer):
         return data
 
 
-class PollDetailSerializer(serializers.ModelSerializer):
+class PollDetailSerializer(TimedModelSerializer):
 
     poll_id = serializers.IntegerField(source='id')
     poll_questions = QuestionSerializer(many=True)
@@ -129,62 +195,213 @@ class PollDetailSerializer(serializers.ModelSerializer):
                   'start_date', 'end_date', 'poll_questions']
 
 
-class AnswerSerializer(serializers.ModelSerializer):
+class PollTreeSerializer(PollSerializer):
+    """
+    Опрос вместе с вопросами и вариантами ответа одним запросом.
+
+    Вопросы проверяются правилами QuestionSerializer, всё дерево
+    пишется в одной транзакции тремя вставками bulk_create
+    """
+
+    poll_questions = QuestionSerializer(many=True)
+
+    class Meta(PollSerializer.Meta):
+        fields = PollSerializer.Meta.fields + ['poll_questions']
+
+    def create(self, validated_data):
+        questions_data = validated_data.pop('poll_questions')
+        with transaction.atomic():
+            # сохранение опроса сбрасывает его кэши и список активных,
+            # bulk_create для вопросов и вариантов сигналов не шлёт
+            poll = Poll.objects.create(**validated_data)
+            questions = Question.objects.bulk_create([
+                Question(poll=poll,
+                         question_text=question['question_text'],
+                         question_type=question['question_type'])
+                for question in questions_data
+            ])
+            if not connection.features.can_return_rows_from_bulk_insert:
+                # опрос создан в этой транзакции, других вопросов у него
+                # нет; id выдаются в порядке вставки
+                question_ids = Question.objects.filter(
+                    poll=poll
+                ).order_by('id').values_list('id', flat=True)
+                for question, question_id in zip(questions, question_ids):
+                    question.id = question_id
+            QuestionChoice.objects.bulk_create([
+                QuestionChoice(question=question,
+                               choice_text=choice['choice_text'])
+                for question, question_data in zip(questions, questions_data)
+                if question.question_type in ['CHOICE', 'MULTICHOICE']
+                for choice in question_data['question_choice']
+            ])
+        return poll
+
+
+def answer_key(attrs):
+    # ключ совпадает с частичными уникальными ограничениями Answer
+    if attrs['multichoice']:
+        return (attrs['user_id'], attrs['question_id'], attrs.get('choice_id'))
+    return (attrs['user_id'], attrs['question_id'])
+
+
+def duplicate_error(attrs):
+    if attrs['multichoice']:
+        message = 'Вы уже выбрали этот вариант ответа'
+    else:
+        message = 'Вы уже отвечали на этот вопрос'
+    return {api_settings.NON_FIELD_ERRORS_KEY: [message]}
+
+
+def existing_answer_keys(validated_data):
+    """
+    Ключи ответов из validated_data, которые уже есть в базе, одним запросом
+    """
+    keys = set()
+    for user_id, question_id, choice_id, multichoice, choice_ids in (
+            Answer.objects.filter(
+                user_id__in={attrs['user_id'] for attrs in validated_data},
+                question_id__in={attrs['question_id']
+                                 for attrs in validated_data}
+            ).values_list('user_id', 'question_id', 'choice_id',
+                          'multichoice', 'choice_ids')):
+        # компактная строка MULTICHOICE - ключ на каждый выбор
+        for choice_id in (unpack_choice_ids(choice_ids)
+                          if choice_ids is not None else [choice_id]):
+            keys.add(answer_key({'user_id': user_id,
+                                 'question_id': question_id,
+                                 'choice_id': choice_id,
+                                 'multichoice': multichoice}))
+    return keys
+
+
+def fill_answer_ids(answers):
+    """
+    Id ответов, которые bulk_create не вернул (SQLite), одним запросом.
+    Строка однозначна по пользователю, вопросу и варианту; у компактной
+    строки MULTICHOICE вариант пуст
+    """
+    missing = [answer for answer in answers if answer.id is None]
+    if not missing:
+        return
+    ids = {(user_id, question_id, choice_id): pk
+           for pk, user_id, question_id, choice_id in Answer.objects.filter(
+               user_id__in={answer.user_id for answer in missing},
+               question_id__in={answer.question_id for answer in missing}
+           ).values_list('id', 'user_id', 'question_id', 'choice_id')}
+    compact = settings.POLLS_COMPACT_MULTICHOICE
+    for answer in missing:
+        choice_id = answer.choice_id
+        if compact and answer.multichoice and choice_id:
+            choice_id = None
+        answer.id = ids.get((answer.user_id, answer.question_id, choice_id))
+
+
+class AnswerListSerializer(TimedListSerializer):
+    """
+    Пачка ответов пользователя на опрос: проверяется целиком
+    и сохраняется одним bulk insert. Пустая пачка и пачка больше
+    MAX_ANSWERS_PER_REQUEST ответов отклоняются
+    """
+    default_error_messages = dict(
+        TimedListSerializer.default_error_messages,
+        empty='Пачка ответов пуста',
+        max_length='Слишком много ответов в пачке, не больше {max_length}',
+    )
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('allow_empty', False)
+        kwargs.setdefault('max_length', MAX_ANSWERS_PER_REQUEST)
+        super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, data):
+        validated = super().to_internal_value(data)
+        errors = []
+        seen = set()
+        for attrs in validated:
+            key = answer_key(attrs)
+            errors.append(duplicate_error(attrs) if key in seen else {})
+            seen.add(key)
+        if any(errors):
+            raise serializers.ValidationError(errors, code='duplicate')
+        return validated
+
+    def create(self, validated_data):
+        answers = [Answer(**attrs) for attrs in validated_data]
+        try:
+            with transaction.atomic():
+                # bulk_create не отправляет post_save, итоги
+                # записываются там же
+                answers = insert_answers(answers)
+                # id нужны в ответе на запрос
+                fill_answer_ids(answers)
+        except IntegrityError:
+            errors = self.duplicate_errors(validated_data)
+            if not any(errors):
+                raise
+            raise serializers.ValidationError(errors, code='duplicate')
+        bump_user_versions(answer.user_id for answer in answers)
+        return answers
+
+    def duplicate_errors(self, validated_data):
+        existing = existing_answer_keys(validated_data)
+        return [duplicate_error(attrs) if answer_key(attrs) in existing
+                else {} for attrs in validated_data]
+
+
+class AnswerSerializer(TimedModelSerializer):
 
     answer_id = serializers.IntegerField(source='id',
                                          read_only=True)
+    # вопрос и выбор проверяются по схеме опроса, без запросов к базе
+    question = serializers.IntegerField(source='question_id')
+    choice = serializers.IntegerField(source='choice_id',
+                                      required=False,
+                                      allow_null=True)
 
     class Meta:
         model = Answer
         fields = ['answer_id', 'user_id', 'question',
                   'choice', 'answer_text']
+        list_serializer_class = AnswerListSerializer
 
-    def validate(self, data):
-        poll_id = self.context['poll_id']
-        question = data['question']
-        poll = get_object_or_404(Poll, id=poll_id)
-        if question not in poll.poll_questions.all():
-            raise serializers.ValidationError(
-                'Вопрос с таким id не существует в этом опросе'
-            )
-
-        if data.get('choice') and data.get('answer_text'):
-            raise serializers.ValidationError(
-                'Ответ состоит либо из предустановленного '
-                'выбора, либо из своего текста'
-            )
-
-        if (question.question_type in ['CHOICE', 'MULTICHOICE'] and
-                not data.get('choice')):
-            raise serializers.ValidationError(
-                'На этот вопрос необходимо выбрать ответ'
-            )
-
-        if question.question_type == 'TEXT' and not data.get('answer_text'):
-            raise serializers.ValidationError(
-                'На этот вопрос необходимо написать свой ответ текстом'
-            )
-
-        if (data.get('choice') not in question.question_choice.all() and
-                question.question_choice.all()):
-            raise serializers.ValidationError(
-                'Вы выбрали несуществующий вариант '
-                'ответа на данный вопрос'
-            )
-
-        if (question.question_type in ['MULTICHOICE'] and
-            Answer.objects.filter(user_id=data['user_id'],
-                                  question=question,
-                                  choice=data.get('choice')).exists()):
-            raise serializers.ValidationError(
-                'Вы уже выбрали этот вариант ответа'
-            )
-
-        if (question.question_type in ['CHOICE', 'TEXT'] and
-            Answer.objects.filter(user_id=data['user_id'],
-                                  question=question).exists()):
-            raise serializers.ValidationError(
-                'Вы уже отвечали на этот вопрос'
-            )
+    def create(self, validated_data):
+        # повторный ответ отсекают уникальные ограничения Answer,
+        # итоги опроса обновляются в той же транзакции, что и вставка
+        try:
+            with transaction.atomic():
+                if (settings.POLLS_COMPACT_MULTICHOICE and
+                        validated_data['multichoice']):
+                    answer = insert_answers([Answer(**validated_data)])[0]
+                    fill_answer_ids([answer])
+                    bump_user_versions([answer.user_id])
+                    return answer
+                return super().create(validated_data)
+        except IntegrityError:
+            # повтором считается только уже записанный ответ, остальные
+            # нарушения (например, внешний ключ) пробрасываются
+            if (answer_key(validated_data) not in
+                    existing_answer_keys([validated_data])):
+                raise
+            raise serializers.ValidationError(duplicate_error(validated_data),
+                                              code='duplicate')
+
+    def get_schema(self):
+        # схема загружается один раз на запрос, в том числе на всю пачку
+        if 'schema' not in self.context:
+            schema = get_schema(self.context['poll_id'])
+            if schema is None:
+                raise Http404
+            self.context['schema'] = schema
+        return self.context['schema']
 
+    def validate(self, data):
+        schema = self.get_schema()
+        question_id = data['question_id']
+        schema.validate_answer(question_id,
+                               data.get('choice_id'),
+                               data.get('answer_text'))
+        data['multichoice'] = (
+            schema.question_type(question_id) == 'MULTICHOICE'
+        )
         return data
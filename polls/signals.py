@@ -0,0 +1,144 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import versions
+from .multichoice import strip_choices
+from .models import (Answer, ArchivedAnswer, Poll, Question, QuestionChoice,
+                     current_deletion)
+from .results import (SELECTIONS, count_participation, discard_answers,
+                      record_answers)
+from .schema import invalidate_schema
+from .snapshots import invalidate_active_polls, invalidate_poll_detail
+
+
+def invalidate(func, *args):
+    # сбрасываем сразу и ещё раз после коммита, чтобы параллельный
+    # запрос не закэшировал данные из незакоммиченного состояния
+    func(*args)
+    transaction.on_commit(partial(func, *args))
+
+
+def invalidate_poll(poll_id):
+    invalidate(invalidate_schema, poll_id)
+    invalidate(invalidate_poll_detail, poll_id)
+    invalidate(versions.bump_version,
+               versions.POLL.format(poll_id), versions.CATALOG)
+
+
+def invalidate_active():
+    invalidate(invalidate_active_polls)
+    invalidate(versions.bump_version, versions.ACTIVE_POLLS)
+
+
+def cascade_from(*models):
+    # удаление началось с одной из models, а не с самой записи
+    deletion = current_deletion.get()
+    return deletion is not None and deletion.model in models
+
+
+@receiver(post_save, sender=Poll)
+@receiver(post_delete, sender=Poll)
+def poll_changed(sender, instance, **kwargs):
+    invalidate_poll(instance.id)
+    invalidate_active()
+
+
+@receiver(post_delete, sender=Poll)
+def poll_deleted(sender, instance, **kwargs):
+    # архив в другой базе, его чистим только после коммита удаления
+    if instance.archived_at is not None:
+        transaction.on_commit(partial(delete_archived_answers, instance.id))
+
+
+def delete_archived_answers(poll_id):
+    ArchivedAnswer.objects.filter(poll_id=poll_id).delete()
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    invalidate_poll(instance.poll_id)
+
+
+@receiver(pre_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    # ответы на вопрос удаляются каскадом, итоги вопроса тоже, а участие
+    # пользователей в опросе нужно уменьшить самим. При удалении опроса
+    # его участие удаляет каскад одним запросом
+    if cascade_from(Poll):
+        return
+    count_participation({
+        (row['user_id'], row['poll_id']): -row['total']
+        for row in Answer.objects.filter(question_id=instance.id)
+        .values('user_id', 'poll_id').annotate(total=Sum(SELECTIONS))
+        .order_by()
+    })
+
+
+def invalidate_question(question_id):
+    poll_ids = Question.objects.filter(
+        id=question_id
+    ).values_list('poll_id', flat=True)
+    for poll_id in poll_ids:
+        invalidate_poll(poll_id)
+
+
+@receiver(post_save, sender=QuestionChoice)
+def choice_changed(sender, instance, **kwargs):
+    invalidate_question(instance.question_id)
+
+
+@receiver(pre_delete, sender=QuestionChoice)
+def choice_deleting(sender, instance, **kwargs):
+    # при удалении опроса или вопроса итоги удаляет каскад,
+    # а участие уменьшает вопрос
+    if cascade_from(Poll, Question):
+        return
+    # строки с этим выбором удаляются каскадом, убираем их из итогов
+    # и участия, пока они есть
+    answers = list(Answer.objects.filter(choice_id=instance.id).only(
+        'user_id', 'poll_id', 'question_id', 'choice_id', 'choice_ids'
+    ))
+    discard_answers(answers)
+    versions.bump_user_versions([answer.user_id for answer in answers])
+    # все pre_delete приходят до первого post_delete: к нему пачка
+    # удаляемых вариантов каждого вопроса уже собрана
+    deletion = current_deletion.get()
+    if deletion is not None and deletion.model is QuestionChoice:
+        deletion.choices[instance.question_id].append(instance.id)
+
+
+@receiver(post_delete, sender=QuestionChoice)
+def choices_deleted(sender, instance, **kwargs):
+    # при удалении опроса или вопроса схему сбросят они сами,
+    # а ответы на вопрос удалит каскад
+    if cascade_from(Poll, Question) or instance.question_id is None:
+        return
+    deletion = current_deletion.get()
+    if deletion is None:
+        choice_ids = [instance.id]
+    else:
+        choice_ids = deletion.choices.pop(instance.question_id, None)
+        if choice_ids is None:
+            # вопрос уже обработан с первым вариантом пачки
+            return
+    if settings.POLLS_COMPACT_MULTICHOICE:
+        # строки с этими выборами удалены каскадом, а компактные строки
+        # MULTICHOICE ссылаются на варианты только через choice_ids
+        strip_choices(instance.question_id, choice_ids)
+    invalidate_question(instance.question_id)
+
+
+# post_delete для ответов не подключаем: он отключил бы быстрое каскадное
+# удаление ответов вместе с опросом. Удаление опроса и так меняет каталог,
+# а удаление ответов в админке сообщает об этом само
+@receiver(post_save, sender=Answer)
+def answer_saved(sender, instance, created, **kwargs):
+    versions.bump_user_versions([instance.user_id])
+    if created:
+        record_answers([instance])
@@ -0,0 +1,49 @@
+import datetime as dt
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Poll
+from .payloads import POLL_FIELDS, poll_detail, poll_list
+
+ACTIVE_POLLS_CACHE_KEY = 'polls:active:{}'
+POLL_DETAIL_CACHE_KEY = 'polls:detail:{}'
+SNAPSHOT_TIMEOUT = getattr(settings, 'POLLS_SNAPSHOT_TIMEOUT', 60 * 60)
+
+
+def get_active_polls():
+    """
+    Готовый список активных опросов. Ключ содержит текущую дату,
+    поэтому на границе дня список собирается заново
+    """
+    today = dt.date.today()
+    key = ACTIVE_POLLS_CACHE_KEY.format(today.isoformat())
+    data = cache.get(key)
+    if data is None:
+        data = poll_list(Poll.objects.filter(end_date__gte=today)
+                         .values(*POLL_FIELDS))
+        cache.set(key, data, SNAPSHOT_TIMEOUT)
+    return data
+
+
+def get_poll_detail(poll_id):
+    """
+    Готовый детальный опрос с вопросами и вариантами ответа.
+    Для несуществующего опроса возвращает None
+    """
+    key = POLL_DETAIL_CACHE_KEY.format(poll_id)
+    data = cache.get(key)
+    if data is None:
+        data = poll_detail(poll_id)
+        if data is None:
+            return None
+        cache.set(key, data, SNAPSHOT_TIMEOUT)
+    return data
+
+
+def invalidate_active_polls():
+    cache.delete(ACTIVE_POLLS_CACHE_KEY.format(dt.date.today().isoformat()))
+
+
+def invalidate_poll_detail(poll_id):
+    cache.delete(POLL_DETAIL_CACHE_KEY.format(poll_id))
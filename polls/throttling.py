@@ -0,0 +1,130 @@
+"""
+Ограничение приёма ответов.
+
+Корзины токенов на IP клиента и на user_id лежат в общем кэше
+POLLS_THROTTLE_CACHE: корзина вмещает BURST токенов и пополняется
+со скоростью RATE в секунду, каждый запрос забирает токен, пустая
+корзина - 429 с Retry-After. Предел одновременных запросов считается
+в процессе. Обе проверки выполняются до работы с базой
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle
+
+BUCKET_CACHE_KEY = 'polls:throttle:{}:{}'
+
+
+class Overloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Сервис перегружен, повторите запрос позже'
+    default_code = 'overloaded'
+
+
+def take_token(key, rate, burst, now=None):
+    """
+    Забирает токен из корзины key. Возвращает 0 или через сколько
+    секунд появится следующий токен. Чтение и запись корзины
+    не атомарны: при гонке запросов пройдёт на токен-другой больше
+    """
+    cache = caches[settings.POLLS_THROTTLE_CACHE]
+    now = time.time() if now is None else now
+    tokens, updated = cache.get(key, (burst, now))
+    tokens = min(burst, tokens + max(now - updated, 0) * rate)
+    if tokens < 1:
+        return (1 - tokens) / rate
+    # за это время корзина наполнится, и запись можно забыть
+    cache.set(key, (tokens - 1, now), math.ceil(burst / rate) + 1)
+    return 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Корзина токенов на каждый ключ из get_idents. Скорость и объём
+    корзины читаются из настроек rate_setting и burst_setting при
+    каждом запросе, скорость 0 отключает ограничение
+    """
+    scope = None
+    rate_setting = None
+    burst_setting = None
+
+    def get_idents(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        self.delay = 0
+        rate = getattr(settings, self.rate_setting)
+        if rate <= 0:
+            return True
+        burst = max(getattr(settings, self.burst_setting), 1)
+        now = time.time()
+        for ident in self.get_idents(request):
+            key = BUCKET_CACHE_KEY.format(self.scope, ident)
+            self.delay = max(self.delay, take_token(key, rate, burst, now))
+        return not self.delay
+
+    def wait(self):
+        return self.delay
+
+
+class AnswerIPThrottle(TokenBucketThrottle):
+    scope = 'ip'
+    rate_setting = 'POLLS_ANSWER_THROTTLE_RATE_IP'
+    burst_setting = 'POLLS_ANSWER_THROTTLE_BURST_IP'
+
+    def get_idents(self, request):
+        return [self.get_ident(request)]
+
+
+class AnswerUserThrottle(TokenBucketThrottle):
+    """
+    Корзина на каждый user_id из тела запроса: пачка ответов
+    пользователя забирает один токен. Неверный user_id пропускается,
+    его отклонит проверка ответа
+    """
+    scope = 'user'
+    rate_setting = 'POLLS_ANSWER_THROTTLE_RATE_USER'
+    burst_setting = 'POLLS_ANSWER_THROTTLE_BURST_USER'
+
+    def get_idents(self, request):
+        data = request.data
+        items = data if isinstance(data, list) else [data]
+        user_ids = set()
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            try:
+                user_ids.add(int(item.get('user_id')))
+            except (TypeError, ValueError):
+                continue
+        return sorted(user_ids)
+
+
+class ConcurrencyLimit:
+    """
+    Счётчик одновременных запросов процесса. acquire не ждёт:
+    при занятых limit местах возвращает False
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, limit):
+        with self.lock:
+            if limit and self.active >= limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+
+answer_slots = ConcurrencyLimit()
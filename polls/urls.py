@@ -1,9 +1,19 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
 from .views import (CreateAnswerView, PollCreateUpdateDestroyView,
-                    PollRetrieveView, PollView,
-                    QuestionCreateUpdateDestroyView, UserAnswerView)
+                    PollQuestionsView, PollResultsView, PollRetrieveView,
+                    PollView, QuestionCreateUpdateDestroyView,
+                    UserAnswerView, UserPollView)
+
+poll_view = PollView.as_view()
+poll_detail_view = PollRetrieveView.as_view()
+create_answer_view = CreateAnswerView.as_view()
+if settings.POLLS_ASYNC_VIEWS:
+    # под ASGI горячие эндпоинты не блокируют цикл событий
+    from .async_views import (create_answer_view, poll_detail_view,
+                              poll_view)
 
 admin_router_v1 = DefaultRouter()
 admin_router_v1.register('polls', PollCreateUpdateDestroyView)
@@ -13,14 +23,23 @@ admin_router_v1.register('polls/(?P<poll_id>.+)/questions',
 
 urlpatterns = [
     path('admin/', include(admin_router_v1.urls)),
-    path('polls/', PollView.as_view(), name='poll_view'),
+    path('polls/', poll_view, name='poll_view'),
     path('polls/<int:pk>/',
-         PollRetrieveView.as_view(),
+         poll_detail_view,
          name='poll_detail_view'),
+    path('polls/<int:pk>/questions/',
+         PollQuestionsView.as_view(),
+         name='poll_questions_view'),
+    path('polls/<int:pk>/results/',
+         PollResultsView.as_view(),
+         name='poll_results_view'),
     path('polls/<int:poll_id>/answer/',
-         CreateAnswerView.as_view(),
+         create_answer_view,
          name='create_answer_view'),
     path('users/<int:user_id>/answers/',
          UserAnswerView.as_view(),
-         name='user_answer_view')
+         name='user_answer_view'),
+    path('users/<int:user_id>/polls/<int:poll_id>/',
+         UserPollView.as_view(),
+         name='user_poll_view'),
 ]
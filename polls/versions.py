@@ -0,0 +1,86 @@
+import datetime as dt
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+VERSION_CACHE_KEY = 'polls:version:{}'
+VERSION_TIMEOUT = getattr(settings, 'POLLS_VERSION_TIMEOUT', 60 * 60)
+
+# области версий: список активных опросов, отдельный опрос,
+# ответы пользователя и общий каталог опросов, вопросов и вариантов
+ACTIVE_POLLS = 'active'
+CATALOG = 'catalog'
+POLL = 'poll:{}'
+USER = 'user:{}'
+
+
+def new_version():
+    return time.time_ns() // 1000
+
+
+def get_version(scope):
+    """
+    Версия области в микросекундах. Если версия вытеснена из кэша,
+    заводится новая, поэтому старые валидаторы клиентов не совпадут
+    """
+    key = VERSION_CACHE_KEY.format(scope)
+    version = cache.get(key)
+    if version is None:
+        version = new_version()
+        if not cache.add(key, version, VERSION_TIMEOUT):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(*scopes):
+    version = new_version()
+    cache.set_many({VERSION_CACHE_KEY.format(scope): version
+                    for scope in scopes}, VERSION_TIMEOUT)
+
+
+def bump_user_versions(user_ids):
+    scopes = [USER.format(user_id) for user_id in set(user_ids)]
+    if scopes:
+        bump_version(*scopes)
+        transaction.on_commit(partial(bump_version, *scopes))
+
+
+def version_datetime(version):
+    return dt.datetime.fromtimestamp(version / 1000000, tz=timezone.utc)
+
+
+def active_polls_etag(request, *args, **kwargs):
+    return 'W/"active-{}-{}"'.format(dt.date.today().isoformat(),
+                                     get_version(ACTIVE_POLLS))
+
+
+def active_polls_last_modified(request, *args, **kwargs):
+    # на границе дня список меняется без изменения опросов
+    today = timezone.make_aware(
+        dt.datetime.combine(dt.date.today(), dt.time.min)
+    )
+    return max(version_datetime(get_version(ACTIVE_POLLS)), today)
+
+
+def poll_etag(request, pk, *args, **kwargs):
+    return 'W/"poll-{}-{}"'.format(pk, get_version(POLL.format(pk)))
+
+
+def poll_last_modified(request, pk, *args, **kwargs):
+    return version_datetime(get_version(POLL.format(pk)))
+
+
+def user_answers_etag(request, user_id, *args, **kwargs):
+    # ответы пользователя содержат тексты опросов и вопросов
+    return 'W/"user-{}-{}-{}"'.format(user_id,
+                                      get_version(USER.format(user_id)),
+                                      get_version(CATALOG))
+
+
+def user_answers_last_modified(request, user_id, *args, **kwargs):
+    return version_datetime(max(get_version(USER.format(user_id)),
+                                get_version(CATALOG)))
@@ -1,33 +1,113 @@
 import datetime as dt
+import heapq
+import json
+from functools import partial
 
-from rest_framework import generics, mixins, permissions, views, viewsets
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from rest_framework import (generics, mixins, permissions, status, views,
+                            viewsets)
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from .models import Answer, Poll, Question
+from . import metrics, versions
+from .buffer import BufferFull, get_answer_buffer
+from .export import EXPORT_CONTENT_TYPES, EXPORT_FORMATS, iter_export
+from .models import (Answer, ArchivedAnswer, Participation, Poll,
+                     Question)
+from .multichoice import choice_texts, expand_rows
+from .pagination import (PollPagination, QuestionPagination,
+                         UserPollPagination)
+from .payloads import POLL_FIELDS, poll_list
+from .renderers import FAST_RENDERER_CLASSES
+from .results import poll_results
 from .serializers import (AnswerSerializer, PollDetailSerializer,
-                          PollSerializer, QuestionSerializer)
+                          PollSerializer, PollTreeSerializer,
+                          QuestionSerializer)
+from .snapshots import get_active_polls, get_poll_detail
+from .throttling import (AnswerIPThrottle, AnswerUserThrottle, Overloaded,
+                         answer_slots)
 
 
+@method_decorator(condition(versions.active_polls_etag,
+                            versions.active_polls_last_modified),
+                  name='get')
 class PollView(generics.ListAPIView):
     """
     Список активных опросов
+
+    С параметрами ?page_size= или ?cursor= список отдаётся страницами
     """
     serializer_class = PollSerializer
     permission_classes = (permissions.AllowAny,)
+    pagination_class = PollPagination
+    renderer_classes = FAST_RENDERER_CLASSES
+    query_budget = 2
     queryset = Poll.objects.all()
 
     def get_queryset(self):
         queryset = self.queryset.filter(end_date__gte=dt.date.today())
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        # страница - строки .values(), сериализатор не нужен
+        page = self.paginate_queryset(
+            self.get_queryset().values(*POLL_FIELDS)
+        )
+        if page is None:
+            return Response(get_active_polls())
+        return self.get_paginated_response(poll_list(page))
+
 
+@method_decorator(condition(versions.poll_etag,
+                            versions.poll_last_modified),
+                  name='get')
 class PollRetrieveView(generics.RetrieveAPIView):
     """
     Детальный опрос
+
+    С параметром ?questions=0 - только заголовок опроса, вопросы
+    отдаются страницами в PollQuestionsView
     """
     serializer_class = PollDetailSerializer
     permission_classes = (permissions.AllowAny,)
-    queryset = Poll.objects.all()
+    renderer_classes = FAST_RENDERER_CLASSES
+    query_budget = 3
+    queryset = Poll.objects.prefetch_related(
+        'poll_questions__question_choice'
+    )
+
+    def retrieve(self, request, *args, **kwargs):
+        data = get_poll_detail(kwargs['pk'])
+        if data is None:
+            raise Http404
+        if request.query_params.get('questions') in ('0', 'false'):
+            data = {key: value for key, value in data.items()
+                    if key != 'poll_questions'}
+        return Response(data)
+
+
+@method_decorator(condition(versions.poll_etag,
+                            versions.poll_last_modified),
+                  name='get')
+class PollQuestionsView(generics.ListAPIView):
+    """
+    Вопросы опроса с вариантами ответа, страницами по id
+    """
+    serializer_class = QuestionSerializer
+    permission_classes = (permissions.AllowAny,)
+    pagination_class = QuestionPagination
+    query_budget = 3
+
+    def get_queryset(self):
+        get_object_or_404(Poll.objects.values('id'), id=self.kwargs['pk'])
+        return Question.objects.filter(
+            poll_id=self.kwargs['pk']
+        ).prefetch_related('question_choice')
 
 
 class PollCreateUpdateDestroyView(mixins.CreateModelMixin,
@@ -41,6 +121,41 @@ class PollCreateUpdateDestroyView(mixins.CreateModelMixin,
     permission_classes = (permissions.IsAdminUser,)
     queryset = Poll.objects.all()
 
+    @action(detail=False, methods=['post'],
+            serializer_class=PollTreeSerializer)
+    def tree(self, request):
+        """
+        Создать опрос вместе с вопросами и вариантами ответа
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        poll = serializer.save()
+        poll = Poll.objects.prefetch_related(
+            'poll_questions__question_choice'
+        ).get(id=poll.id)
+        return Response(self.get_serializer(poll).data,
+                        status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        Выгрузка ответов опроса потоком: ?output=csv или ?output=ndjson
+        """
+        poll = self.get_object()
+        export_format = request.query_params.get('output', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'output': 'Доступные форматы: '
+                                             + ', '.join(EXPORT_FORMATS)})
+        response = StreamingHttpResponse(
+            iter_export(poll.id, export_format,
+                        archived=poll.archived_at is not None),
+            content_type=EXPORT_CONTENT_TYPES[export_format]
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="poll-{poll.id}.{export_format}"'
+        )
+        return response
+
 
 class QuestionCreateUpdateDestroyView(mixins.CreateModelMixin,
                                       mixins.UpdateModelMixin,
@@ -63,42 +178,241 @@ class CreateAnswerView(generics.CreateAPIView):
     """
     serializer_class = AnswerSerializer
     permission_classes = (permissions.AllowAny,)
+    # пользователь запроса не нужен, а сессия стоила бы запроса к базе
+    # до проверки ограничений
+    authentication_classes = ()
+    throttle_classes = (AnswerIPThrottle, AnswerUserThrottle)
     queryset = Answer.objects.all()
+    # схема опроса, вставка и счётчики итогов - не зависит от размера пачки.
+    # Худший случай - 20 запросов: пачка с компактными выборами MULTICHOICE
+    # на холодной схеме, без строк итогов и участия, с перечитыванием id
+    # на SQLite; обычная пачка - 16, один ответ - 15. Запас - один запрос
+    query_budget = 21
+    answer_slot = False
+
+    def initial(self, request, *args, **kwargs):
+        # до работы с базой: сначала предел одновременных запросов,
+        # затем корзины токенов
+        if not answer_slots.acquire(settings.POLLS_ANSWER_CONCURRENCY):
+            metrics.answers_rejected.inc(reason='overloaded')
+            raise Overloaded
+        self.answer_slot = True
+        super().initial(request, *args, **kwargs)
+
+    def throttled(self, request, wait):
+        metrics.answers_rejected.inc(reason='throttled')
+        super().throttled(request, wait)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            # место освобождается и при необработанном исключении
+            if self.answer_slot:
+                answer_slots.release()
+                self.answer_slot = False
+
+    def get_serializer(self, *args, **kwargs):
+        # список в теле запроса - пачка ответов на опрос
+        if isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+        return super().get_serializer(*args, **kwargs)
 
     def get_serializer_context(self):
         return {'poll_id': self.kwargs['poll_id']}
 
+    def create(self, request, *args, **kwargs):
+        try:
+            if settings.POLLS_ANSWER_BUFFER:
+                response = self.create_buffered(request)
+            else:
+                response = super().create(request, *args, **kwargs)
+        except ValidationError as exc:
+            metrics.record_rejected(exc)
+            raise
+        except Http404:
+            metrics.answers_rejected.inc(reason='unknown_poll')
+            raise
+        except BufferFull:
+            metrics.answers_rejected.inc(reason='buffer_full')
+            raise
+        metrics.answers_accepted.inc(
+            len(response.data) if isinstance(response.data, list) else 1
+        )
+        return response
+
+    def create_buffered(self, request):
+        # отложенная запись: ответы проверены и будут записаны пачкой
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+        if isinstance(validated_data, dict):
+            validated_data = [validated_data]
+        poll_id = self.kwargs['poll_id']
+        get_answer_buffer().put(dict(attrs, poll_id=poll_id)
+                                for attrs in validated_data)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
     def perform_create(self, serializer):
         poll_id = self.kwargs['poll_id']
         serializer.save(poll_id=poll_id)
 
 
+class PollResultsView(views.APIView):
+    """
+    Итоги опроса по вопросам и вариантам ответа
+    """
+    permission_classes = (permissions.AllowAny,)
+    query_budget = 3
+
+    def get(self, request, pk):
+        poll = get_object_or_404(Poll.objects.values('id', 'title'), id=pk)
+        return Response({'poll_id': poll['id'],
+                         'title': poll['title'],
+                         'poll_questions': poll_results(pk)})
+
+
+@method_decorator(condition(versions.user_answers_etag,
+                            versions.user_answers_last_modified),
+                  name='get')
 class UserAnswerView(views.APIView):
     """
     Ответы конкретного пользователя
+
+    С параметром ?stream=1 ответ отдаётся потоком, опрос за опросом,
+    с параметрами ?page_size= или ?cursor= - страницами по опросам
+    """
+    # страница, архивные опросы пользователя, ответы, ответы из архива
+    query_budget = 4
+
+    def get(self, request, user_id):
+        paginator = UserPollPagination()
+        page = paginator.paginate_queryset(
+            Participation.objects.filter(user_id=user_id).values('poll_id'),
+            request, view=self
+        )
+        if page is not None:
+            poll_ids = [row['poll_id'] for row in page]
+            return paginator.get_paginated_response(
+                list(iter_user_polls(user_id, poll_ids))
+            )
+        if request.query_params.get('stream') in ('1', 'true'):
+            return StreamingHttpResponse(
+                stream_json_list(iter_user_polls(user_id)),
+                content_type='application/json'
+            )
+        return Response(list(iter_user_polls(user_id)))
+
+
+@method_decorator(condition(versions.user_answers_etag,
+                            versions.user_answers_last_modified),
+                  name='get')
+class UserPollView(views.APIView):
     """
+    Начал ли пользователь опрос: число его ответов, время первого
+    и последнего ответа
+    """
+    query_budget = 1
+
+    def get(self, request, user_id, poll_id):
+        participation = Participation.objects.filter(
+            user_id=user_id, poll_id=poll_id
+        ).values('answer_count', 'first_answered_at',
+                 'last_answered_at').first()
+        data = {'user_id': user_id,
+                'poll_id': poll_id,
+                'started': participation is not None,
+                'answer_count': 0,
+                'first_answered_at': None,
+                'last_answered_at': None}
+        data.update(participation or {})
+        return Response(data)
+
+
+def iter_archived_answers(user_id, poll_ids=None):
+    """
+    Ответы пользователя на перенесённые в архив опросы в том же виде,
+    что и строки основной таблицы. Опросы берутся из участия, архивная
+    база читается, только если такие опросы есть
+    """
+    polls = Participation.objects.filter(user_id=user_id,
+                                         poll__archived_at__isnull=False)
+    if poll_ids is not None:
+        polls = polls.filter(poll_id__in=poll_ids)
+    polls = {poll_id: (title, description)
+             for poll_id, title, description
+             in polls.values_list('poll_id', 'poll__title',
+                                  'poll__description')}
+    if not polls:
+        return
+    answers = ArchivedAnswer.objects.filter(
+        user_id=user_id, poll_id__in=list(polls)
+    ).order_by(
+        '-poll_id', 'id'
+    ).values_list(
+        'poll_id', 'question_id', 'question_type', 'question_text',
+        'answer_text', 'choice_text', 'choice_ids'
+    )
+    yield from expand_rows(
+        ((poll_id, *polls[poll_id], *answer)
+         for poll_id, *answer in answers.iterator()),
+        partial(choice_texts, question__poll_id__in=list(polls))
+    )
 
-    def get(self, requset, user_id):
-        result = []
-        poll_queryset = Poll.objects.filter(
-            id__in=Answer.objects.filter(user_id=user_id).values('poll'))
-        for poll in poll_queryset:
-            poll_info = {'poll_id': poll.id,
-                         'poll_title': poll.title,
-                         'poll_description': poll.description,
+
+def iter_user_polls(user_id, poll_ids=None):
+    """
+    Опросы пользователя с его ответами: один запрос по ответам
+    с присоединёнными опросом, вопросом и выбором, группировка за один проход.
+    Ответы архивных опросов вливаются в тот же порядок по убыванию id опроса
+    по мере чтения обеих выборок, без загрузки архива в память
+    """
+    archived = iter_archived_answers(user_id, poll_ids)
+    answers = Answer.objects.filter(user_id=user_id,
+                                    poll__archived_at__isnull=True)
+    if poll_ids is not None:
+        answers = answers.filter(poll_id__in=poll_ids)
+    answers = answers.order_by(
+        '-poll_id', 'id'
+    ).values_list(
+        'poll_id', 'poll__title', 'poll__description',
+        'question_id', 'question__question_type',
+        'question__question_text', 'answer_text', 'choice__choice_text',
+        'choice_ids'
+    )
+    answers = expand_rows(answers.iterator(), partial(
+        choice_texts, question__question_answer__user_id=user_id,
+        question__question_answer__choice_ids__isnull=False
+    ))
+    rows = heapq.merge(answers, archived, key=lambda row: -row[0])
+    poll_info = None
+    for (poll_id, poll_title, poll_description, question_id,
+         question_type, question_text, answer_text,
+         choice_text) in rows:
+        if poll_info is None or poll_info['poll_id'] != poll_id:
+            if poll_info is not None:
+                yield poll_info
+            poll_info = {'poll_id': poll_id,
+                         'poll_title': poll_title,
+                         'poll_description': poll_description,
                          'user_answers': []}
-            for answer in Answer.objects.filter(user_id=user_id, poll=poll.id):
-                question_type = answer.question.question_type
-                question_text = answer.question.question_text
-                question_answer = {'question_id': answer.question_id,
-                                   'question_type': question_type,
-                                   'question_text': question_text, }
-                if answer.question.question_type in ['TEXT']:
-                    question_answer['answer_text'] = answer.answer_text
-                    question_answer['choice'] = ""
-                if answer.question.question_type in ['CHOICE', 'MULTICHOICE']:
-                    question_answer['answer_text'] = ""
-                    question_answer['choice'] = answer.choice.choice_text
-                poll_info['user_answers'].append(question_answer)
-            result.append(poll_info)
-        return Response(result)
+        question_answer = {'question_id': question_id,
+                           'question_type': question_type,
+                           'question_text': question_text, }
+        if question_type in ['TEXT']:
+            question_answer['answer_text'] = answer_text
+            question_answer['choice'] = ""
+        if question_type in ['CHOICE', 'MULTICHOICE']:
+            question_answer['answer_text'] = ""
+            question_answer['choice'] = choice_text
+        poll_info['user_answers'].append(question_answer)
+    if poll_info is not None:
+        yield poll_info
+
+
+def stream_json_list(items):
+    separator = '['
+    for item in items:
+        yield separator + json.dumps(item, ensure_ascii=False)
+        separator = ','
+    yield ']' if separator == ',' else '[]'
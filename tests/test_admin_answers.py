@@ -0,0 +1,116 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from django.urls.base import reverse
+from polls.admin import EstimatedCountPaginator
+from polls.models import (Answer, ChoiceResult, Poll, Question,
+                          QuestionChoice, QuestionResult)
+
+User = get_user_model()
+
+
+class TestAnswerAdmin(TestCase):
+    def setUp(self):
+        self.admin = Client()
+        self.user = User.objects.create_superuser(
+            username='user',
+            email='user@mail.ru',
+            password='user'
+        )
+        self.admin.force_login(self.user)
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2021-12-31'
+        )
+        self.question = Question.objects.create(
+            poll=self.poll,
+            question_text='Как дела?',
+            question_type='CHOICE'
+        )
+        self.choice = QuestionChoice.objects.create(question=self.question,
+                                                    choice_text='Хорошо')
+        self.url = reverse('admin:polls_answer_changelist')
+
+    def add_answers(self, count, start=0):
+        Answer.objects.bulk_create(
+            Answer(user_id=user_id, poll=self.poll, question=self.question,
+                   choice=self.choice)
+            for user_id in range(start, start + count)
+        )
+
+    def test_changelist_queries_do_not_grow(self):
+        self.add_answers(2)
+        self.admin.get(self.url)
+        with self.assertNumQueries(5):
+            response = self.admin.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.add_answers(50, start=2)
+        with self.assertNumQueries(5):
+            response = self.admin.get(self.url)
+        self.assertContains(response, 'Хорошо')
+
+    def test_search_by_user_id(self):
+        self.add_answers(3)
+        response = self.admin.get(self.url, {'q': '1'})
+        self.assertEqual(
+            [answer.user_id for answer in response.context['cl'].result_list],
+            [1]
+        )
+        response = self.admin.get(self.url, {'q': 'Хорошо'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 0)
+
+    def test_question_filter_limited_to_poll(self):
+        other = Poll.objects.create(title='other', description='other',
+                                    start_date='2021-12-26',
+                                    end_date='2021-12-31')
+        Question.objects.create(poll=other, question_text='Чужой вопрос',
+                                question_type='TEXT')
+        Question.objects.create(poll=self.poll, question_text='Свой вопрос',
+                                question_type='TEXT')
+        response = self.admin.get(self.url)
+        self.assertNotContains(response, 'Чужой вопрос')
+        response = self.admin.get(self.url,
+                                  {'poll__id__exact': self.poll.id})
+        self.assertContains(response, 'Свой вопрос')
+        self.assertNotContains(response, 'Чужой вопрос')
+
+    def test_estimated_count(self):
+        self.add_answers(5)
+        answers = Answer.objects.order_by('-id')
+        with mock.patch('polls.admin.ADMIN_COUNT_LIMIT', 3):
+            self.assertEqual(EstimatedCountPaginator(answers, 2).count,
+                             Answer.objects.last().id)
+            filtered = answers.filter(poll=self.poll)
+            self.assertEqual(EstimatedCountPaginator(filtered, 2).count, 3)
+        self.assertEqual(EstimatedCountPaginator(answers, 2).count, 5)
+
+    def test_answer_form(self):
+        response = self.admin.get(reverse('admin:polls_answer_add'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<select name="question"')
+        self.assertNotContains(response, '<select name="choice"')
+        self.assertContains(response, 'admin-autocomplete')
+
+    def test_answer_edit_moves_vote(self):
+        other = QuestionChoice.objects.create(question=self.question,
+                                              choice_text='Плохо')
+        answer = Answer.objects.create(user_id=1, poll=self.poll,
+                                       question=self.question,
+                                       choice=self.choice)
+        response = self.admin.post(
+            reverse('admin:polls_answer_change', args=[answer.id]),
+            {'user_id': 1, 'poll': self.poll.id,
+             'question': self.question.id, 'choice': other.id,
+             'answer_text': ''}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            dict(ChoiceResult.objects.values_list('choice_id',
+                                                  'answer_count')),
+            {self.choice.id: 0, other.id: 1}
+        )
+        self.assertEqual(QuestionResult.objects.get().answer_count, 1)
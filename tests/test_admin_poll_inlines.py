@@ -0,0 +1,152 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from django.urls.base import reverse
+from polls.models import (Answer, Participation, Poll, Question,
+                          QuestionChoice)
+
+User = get_user_model()
+
+
+def form_data(form):
+    data = {}
+    for name in form.fields:
+        value = form[name].value()
+        if value not in (None, False):
+            data[form.add_prefix(name)] = str(value)
+    return data
+
+
+def formset_data(formset):
+    data = {f'{formset.prefix}-{key}': str(value)
+            for key, value in formset.management_form.initial.items()}
+    for form in formset.forms:
+        data.update(form_data(form))
+        for nested_formset in getattr(form, 'nested_formsets', []):
+            data.update(formset_data(nested_formset))
+    return data
+
+
+class TestPollAdminInlines(TestCase):
+    def setUp(self):
+        self.admin = Client()
+        self.user = User.objects.create_superuser(
+            username='user',
+            email='user@mail.ru',
+            password='user'
+        )
+        self.admin.force_login(self.user)
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2021-12-31'
+        )
+        self.url = reverse('admin:polls_poll_change', args=[self.poll.id])
+
+    def add_questions(self, count):
+        for number in range(count):
+            question = Question.objects.create(
+                poll=self.poll,
+                question_text=f'Вопрос {number}',
+                question_type='CHOICE'
+            )
+            QuestionChoice.objects.bulk_create(
+                QuestionChoice(question=question, choice_text=text)
+                for text in ('Да', 'Нет', 'Не знаю')
+            )
+
+    def post_data(self, response):
+        data = form_data(response.context['adminform'].form)
+        for inline_admin_formset in response.context['inline_admin_formsets']:
+            data.update(formset_data(inline_admin_formset.formset))
+        return data
+
+    def questions(self, response):
+        formset = response.context['inline_admin_formsets'][0].formset
+        return [form.instance.question_text for form in formset.forms]
+
+    def test_questions_paginated(self):
+        self.add_questions(25)
+        response = self.admin.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.questions(response)), 20)
+        self.assertContains(response, '?questions_page=2')
+        response = self.admin.get(self.url, {'questions_page': 2})
+        self.assertEqual(self.questions(response),
+                         [f'Вопрос {number}' for number in range(20, 25)])
+
+    def test_continue_keeps_page(self):
+        self.add_questions(25)
+        page_url = f'{self.url}?questions_page=2'
+        data = self.post_data(self.admin.get(page_url))
+        data['_continue'] = '1'
+        response = self.admin.post(page_url, data)
+        self.assertRedirects(response, page_url)
+
+    def test_add_page(self):
+        response = self.admin.get(reverse('admin:polls_poll_add'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_page_queries_do_not_grow(self):
+        self.add_questions(5)
+        with self.assertNumQueries(8):
+            self.admin.get(self.url)
+        self.add_questions(40)
+        with self.assertNumQueries(8):
+            self.admin.get(self.url)
+
+    def test_unchanged_save(self):
+        self.add_questions(20)
+        data = self.post_data(self.admin.get(self.url))
+        with self.assertNumQueries(10):
+            response = self.admin.post(self.url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(QuestionChoice.objects.count(), 60)
+
+    def test_changed_save(self):
+        self.add_questions(25)
+        page_url = f'{self.url}?questions_page=2'
+        response = self.admin.get(page_url)
+        data = self.post_data(response)
+        formset = response.context['inline_admin_formsets'][0].formset
+        question = formset.forms[0]
+        choice = question.nested_formsets[0].forms[1]
+        data[choice.add_prefix('choice_text')] = 'Скорее нет'
+        data[formset.forms[1].add_prefix('DELETE')] = 'on'
+        response = self.admin.post(page_url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(QuestionChoice.objects.get(id=choice.instance.id)
+                         .choice_text, 'Скорее нет')
+        self.assertFalse(Question.objects.filter(
+            id=formset.forms[1].instance.id
+        ).exists())
+        self.assertEqual(Question.objects.count(), 24)
+        self.assertEqual(
+            QuestionChoice.objects.filter(choice_text='Нет').count(), 23
+        )
+
+    def test_deleted_choice_discounted(self):
+        self.add_questions(1)
+        question = Question.objects.get()
+        choices = list(question.question_choice.order_by('id'))
+        for user_id, choice in ((1, choices[0]), (2, choices[1])):
+            Answer.objects.create(user_id=user_id, poll=self.poll,
+                                  question=question, choice=choice)
+        response = self.admin.get(self.url)
+        data = self.post_data(response)
+        formset = response.context['inline_admin_formsets'][0].formset
+        deleted = formset.forms[0].nested_formsets[0].forms[0]
+        data[deleted.add_prefix('DELETE')] = 'on'
+        response = self.admin.post(self.url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Answer.objects.filter(user_id=1).exists())
+        self.assertEqual(
+            list(Participation.objects.values_list('user_id',
+                                                   'answer_count')),
+            [(2, 1)]
+        )
+        response = self.admin.get(reverse('user_answer_view',
+                                          kwargs={'user_id': 1}))
+        self.assertEqual(json.loads(response.content), [])
@@ -1,7 +1,9 @@
+import json
+
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase
 from django.urls.base import reverse
-from polls.models import Poll
+from polls.models import Answer, Poll, Question
 
 User = get_user_model()
 
@@ -104,3 +106,87 @@ class TestPoll(TestCase):
         response2 = unauthorized_client.get(url)
         self.assertEqual(response1.status_code, 403)
         self.assertEqual(response2.status_code, 403)
+
+    def test_poll_export(self):
+        poll = Poll.objects.create(**self.poll_data)
+        question = Question.objects.create(poll=poll,
+                                           question_text='Name?',
+                                           question_type='TEXT')
+        Answer.objects.create(poll=poll, user_id=1, question=question,
+                              answer_text='Paul')
+        Answer.objects.create(poll=poll, user_id=2, question=question,
+                              answer_text='Ann')
+        url = reverse('poll-export', kwargs={'pk': poll.id})
+        response = self.admin.get(url)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(lines), 3)
+        self.assertIn('question_text', lines[0])
+        response = self.admin.get(url, {'output': 'ndjson'})
+        rows = [json.loads(line) for line in
+                b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows[1].get('answer_text'), 'Ann')
+        self.assertEqual(rows[1].get('question_text'), 'Name?')
+
+    def test_unauthorized_client_export(self):
+        poll = Poll.objects.create(**self.poll_data)
+        url = reverse('poll-export', kwargs={'pk': poll.id})
+        response = Client().get(url)
+        self.assertEqual(response.status_code, 403)
+
+    def poll_tree(self, questions):
+        data = dict(self.poll_data)
+        data['poll_questions'] = [
+            {'question_text': 'Как вас зовут?',
+             'question_type': 'TEXT',
+             'question_choice': []},
+            {'question_text': 'Как дела?',
+             'question_type': 'CHOICE',
+             'question_choice': [{'choice_text': 'Хорошо'},
+                                 {'choice_text': 'Плохо'}]},
+        ] * (questions // 2)
+        return data
+
+    def test_poll_tree_creation(self):
+        url = reverse('poll-tree')
+        response = self.admin.post(url, self.poll_tree(2),
+                                   content_type='application/json')
+        data = json.loads(response.content)
+        poll = Poll.objects.get()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(data['poll_id'], poll.id)
+        self.assertEqual(poll.poll_questions.count(), 2)
+        self.assertEqual(
+            [[choice['choice_text'] for choice in question['question_choice']]
+             for question in data['poll_questions']],
+            [[], ['Хорошо', 'Плохо']]
+        )
+        question = poll.poll_questions.get(question_type='CHOICE')
+        self.assertEqual(data['poll_questions'][1]['question_id'],
+                         question.id)
+        self.assertEqual(question.question_choice.count(), 2)
+
+    def test_poll_tree_constant_queries(self):
+        url = reverse('poll-tree')
+        with self.assertNumQueries(11):
+            self.admin.post(url, self.poll_tree(2),
+                            content_type='application/json')
+        with self.assertNumQueries(11):
+            self.admin.post(url, self.poll_tree(40),
+                            content_type='application/json')
+        self.assertEqual(Question.objects.count(), 42)
+
+    def test_poll_tree_invalid_question(self):
+        url = reverse('poll-tree')
+        data = self.poll_tree(2)
+        data['poll_questions'][1]['question_choice'] = []
+        response = self.admin.post(url, data,
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('poll_questions', json.loads(response.content))
+        self.assertEqual(Poll.objects.count(), 0)
+
+    def test_unauthorized_client_poll_tree(self):
+        response = Client().post(reverse('poll-tree'), self.poll_tree(2),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 403)
@@ -2,7 +2,8 @@ from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
 from django.test import Client, TestCase
 from django.urls.base import reverse
-from polls.models import Poll, Question, QuestionChoice
+from polls.models import (Answer, ChoiceResult, Poll, Question,
+                          QuestionChoice)
 
 User = get_user_model()
 
@@ -160,6 +161,102 @@ class TestQuestion(TestCase):
         self.assertEqual(QuestionChoice.objects.count(), 3)
         self.assertEqual(QuestionChoice.objects.first().choice_text, 'Хорошо')
 
+    def choice_question_with_answers(self):
+        question = Question.objects.create(
+            poll=self.poll,
+            question_text='Как дела?',
+            question_type='CHOICE',
+        )
+        choices = [QuestionChoice.objects.create(question=question,
+                                                 choice_text=text)
+                   for text in ('Хорошо', 'Плохо', 'Не знаю')]
+        for user_id, choice in enumerate(choices):
+            Answer.objects.create(user_id=user_id, poll=self.poll,
+                                  question=question, choice=choice)
+        url = reverse('question-detail', kwargs={'poll_id': self.poll.id,
+                                                 'pk': question.id})
+        return url, choices
+
+    def test_question_edit_choices_by_id(self):
+        url, (good, bad, unknown) = self.choice_question_with_answers()
+        data = {
+            'question_text': 'Как дела?',
+            'question_type': 'CHOICE',
+            'question_choice': [
+                {'choice_id': good.id, 'choice_text': 'Хорошо'},
+                {'choice_id': bad.id, 'choice_text': 'Так себе'},
+                {'choice_text': 'Отлично'},
+            ]
+        }
+        response = self.admin.put(url, data,
+                                  content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(QuestionChoice.objects.order_by('id')
+                 .values_list('id', 'choice_text')),
+            [(good.id, 'Хорошо'), (bad.id, 'Так себе'),
+             (unknown.id + 1, 'Отлично')]
+        )
+        self.assertEqual(
+            sorted(Answer.objects.values_list('choice_id', flat=True)),
+            [good.id, bad.id]
+        )
+        self.assertFalse(ChoiceResult.objects.filter(
+            choice_id=unknown.id
+        ).exists())
+
+    def test_question_edit_choices_by_text(self):
+        url, (good, bad, unknown) = self.choice_question_with_answers()
+        data = dict(self.choice_question_data)
+        data['question_choice'] = [{'choice_text': 'Не знаю'},
+                                   {'choice_text': 'Хорошо'}]
+        response = self.admin.put(url, data,
+                                  content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(QuestionChoice.objects.values_list('id', flat=True)),
+            [good.id, unknown.id]
+        )
+        self.assertEqual(Answer.objects.count(), 2)
+
+    def test_question_edit_unchanged_choices(self):
+        url, choices = self.choice_question_with_answers()
+        data = dict(self.choice_question_data)
+        data['question_choice'] = [
+            {'choice_id': choice.id, 'choice_text': choice.choice_text}
+            for choice in choices
+        ]
+        with self.assertNumQueries(8):
+            response = self.admin.put(url, data,
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Answer.objects.count(), 3)
+
+    def test_question_edit_foreign_choice(self):
+        url, choices = self.choice_question_with_answers()
+        other = Question.objects.create(poll=self.poll,
+                                        question_text='Другой',
+                                        question_type='CHOICE')
+        foreign = QuestionChoice.objects.create(question=other,
+                                                choice_text='Чужой')
+        data = dict(self.choice_question_data)
+        data['question_choice'] = [{'choice_id': foreign.id,
+                                    'choice_text': 'Мой'}]
+        response = self.admin.put(url, data,
+                                  content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.choice_text, 'Чужой')
+        self.assertEqual(QuestionChoice.objects.count(), 4)
+
+    def test_question_patch_keeps_choices(self):
+        url, choices = self.choice_question_with_answers()
+        response = self.admin.patch(url, {'question_text': 'Ну как?'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(QuestionChoice.objects.count(), 3)
+        self.assertEqual(Answer.objects.count(), 3)
+
     def test_question_delete(self):
         url = reverse('question-detail', kwargs={'poll_id': 1,
                                                  'pk': 1})
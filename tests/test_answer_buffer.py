@@ -0,0 +1,139 @@
+import json
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import Client, TestCase, override_settings
+from django.urls.base import reverse
+from polls import buffer
+from polls.buffer import AnswerBuffer, BufferFull
+from polls.models import Answer, Poll, Question, QuestionResult
+
+
+class TestAnswerBuffer(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2999-12-31'
+        )
+        self.question = Question.objects.create(
+            poll=self.poll,
+            question_text='Write your name',
+            question_type='TEXT'
+        )
+        self.buffer = AnswerBuffer(max_size=3, batch_size=2,
+                                   interval=0.05, timeout=0)
+
+    def answer(self, user_id):
+        return {'user_id': user_id,
+                'poll_id': self.poll.id,
+                'question_id': self.question.id,
+                'choice_id': None,
+                'answer_text': 'name',
+                'multichoice': False}
+
+    def test_flush_writes_batches(self):
+        self.buffer.put([self.answer(1), self.answer(2), self.answer(3)])
+        self.assertFalse(Answer.objects.exists())
+        self.buffer.flush()
+        self.assertEqual(Answer.objects.count(), 3)
+        self.assertEqual(
+            QuestionResult.objects.get(question=self.question).answer_count, 3
+        )
+        metrics = self.buffer.metrics()
+        self.assertEqual(metrics['flushes'], 2)
+        self.assertEqual(metrics['max_batch_size'], 2)
+        self.assertEqual(metrics['written'], 3)
+        self.assertEqual(metrics['queue_size'], 0)
+
+    def test_duplicates_are_dropped(self):
+        Answer.objects.create(user_id=1, poll=self.poll,
+                              question=self.question, answer_text='name')
+        self.buffer.put([self.answer(1), self.answer(2)])
+        self.buffer.put([self.answer(2)])
+        self.buffer.flush()
+        self.assertEqual(Answer.objects.filter(user_id=1).count(), 1)
+        self.assertEqual(Answer.objects.filter(user_id=2).count(), 1)
+        self.assertEqual(self.buffer.metrics()['duplicates'], 2)
+
+    def test_failed_flush_retried(self):
+        self.buffer.retry_delay = 0
+        self.buffer.put([self.answer(1), self.answer(2), self.answer(3)])
+        save_answers = buffer.save_answers
+        failures = [OperationalError('database is locked')] * 2
+
+        def flaky_save(batch):
+            if failures:
+                raise failures.pop()
+            return save_answers(batch)
+
+        with mock.patch('polls.buffer.save_answers',
+                        side_effect=flaky_save), \
+                self.assertLogs('polls.buffer', 'ERROR') as logs:
+            self.buffer.flush()
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(Answer.objects.count(), 3)
+        metrics = self.buffer.metrics()
+        self.assertEqual(metrics['queue_size'], 0)
+        self.assertEqual(metrics['written'], 3)
+        self.assertEqual(metrics['dropped'], 0)
+        self.assertEqual(self.buffer.failures, 0)
+
+    def test_failed_flush_dropped_after_retries(self):
+        self.buffer.retry_delay = 0
+        self.buffer.retries = 2
+        self.buffer.put([self.answer(1), self.answer(2)])
+        with mock.patch('polls.buffer.save_answers',
+                        side_effect=OperationalError('database is locked')
+                        ) as save, \
+                self.assertLogs('polls.buffer', 'ERROR'):
+            self.buffer.flush()
+        self.assertEqual(save.call_count, 3)
+        self.assertFalse(Answer.objects.exists())
+        metrics = self.buffer.metrics()
+        self.assertEqual(metrics['queue_size'], 0)
+        self.assertEqual(metrics['dropped'], 2)
+
+    def test_backoff(self):
+        self.buffer.retry_delay = 0.1
+        self.assertEqual(self.buffer.backoff(), 0)
+        self.buffer.failures = 3
+        self.assertEqual(self.buffer.backoff(), 0.4)
+        self.buffer.failures = 20
+        self.assertEqual(self.buffer.backoff(), buffer.MAX_RETRY_DELAY)
+
+    def test_backpressure(self):
+        self.buffer.put([self.answer(1), self.answer(2)])
+        with self.assertRaises(BufferFull):
+            self.buffer.put([self.answer(3), self.answer(4)])
+        self.assertEqual(self.buffer.metrics()['queue_size'], 2)
+        self.assertEqual(self.buffer.metrics()['rejected_full'], 2)
+
+    @override_settings(POLLS_ANSWER_BUFFER=True)
+    def test_view_accepts_into_buffer(self):
+        url = reverse('create_answer_view', args=[self.poll.id])
+        with mock.patch('polls.views.get_answer_buffer',
+                        return_value=self.buffer):
+            response = self.client.post(
+                url,
+                data=json.dumps({'user_id': 1,
+                                 'question': self.question.id,
+                                 'answer_text': 'name'}),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json()['user_id'], 1)
+            self.assertFalse(Answer.objects.exists())
+            response = self.client.post(
+                url,
+                data=json.dumps([{'user_id': user_id,
+                                  'question': self.question.id,
+                                  'answer_text': 'name'}
+                                 for user_id in (2, 3, 4)]),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 503)
+        self.buffer.flush()
+        self.assertEqual(Answer.objects.get().user_id, 1)
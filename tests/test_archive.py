@@ -0,0 +1,215 @@
+import datetime as dt
+import json
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls.base import reverse
+from polls import archive
+from polls.archive import archive_poll, chunk_answers, copy_answers
+from polls.models import (Answer, ArchivedAnswer, Participation, Poll,
+                          Question, QuestionChoice, unpack_choice_ids)
+from polls.results import rebuild_results
+from polls.views import iter_user_polls
+
+User = get_user_model()
+
+
+class TestArchive(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.client = Client()
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2021-12-31'
+        )
+        self.question1 = Question.objects.create(
+            poll=self.poll,
+            question_text='Write your name',
+            question_type='TEXT'
+        )
+        self.question2 = Question.objects.create(
+            poll=self.poll,
+            question_text='Choose something',
+            question_type='MULTICHOICE',
+        )
+        self.choice1 = QuestionChoice.objects.create(
+            question=self.question2,
+            choice_text='First choice'
+        )
+        self.choice2 = QuestionChoice.objects.create(
+            question=self.question2,
+            choice_text='Second choice'
+        )
+        for user_id in (1, 2):
+            self.answer(self.poll, [
+                {'user_id': user_id, 'question': self.question1.id,
+                 'answer_text': f'user {user_id}'},
+                {'user_id': user_id, 'question': self.question2.id,
+                 'choice': self.choice1.id},
+                {'user_id': user_id, 'question': self.question2.id,
+                 'choice': self.choice2.id},
+            ])
+
+    def answer(self, poll, data):
+        url = reverse('create_answer_view', kwargs={'poll_id': poll.id})
+        return self.client.post(url, data, content_type='application/json')
+
+    def archive(self, **options):
+        call_command('archive_answers', stdout=StringIO(), **options)
+
+    def get_json(self, url, params=None):
+        return json.loads(self.client.get(url, params).content)
+
+    def test_answers_moved(self):
+        answer_ids = set(Answer.objects.values_list('id', flat=True))
+        self.archive(chunk_size=2)
+        self.assertFalse(Answer.objects.exists())
+        self.assertEqual(set(ArchivedAnswer.objects.values_list('id',
+                                                                flat=True)),
+                         answer_ids)
+        self.poll.refresh_from_db()
+        self.assertIsNotNone(self.poll.archived_at)
+        archived = ArchivedAnswer.objects.get(user_id=1,
+                                              choice_id=self.choice2.id)
+        self.assertEqual(archived.choice_text, 'Second choice')
+        self.assertEqual(archived.question_type, 'MULTICHOICE')
+
+    def test_grace_period(self):
+        recent = Poll.objects.create(
+            title='recent', description='recent',
+            start_date=dt.date.today() - dt.timedelta(days=20),
+            end_date=dt.date.today() - dt.timedelta(days=10)
+        )
+        question = Question.objects.create(poll=recent,
+                                           question_text='Name?',
+                                           question_type='TEXT')
+        Answer.objects.create(poll=recent, user_id=1, question=question,
+                              answer_text='Paul')
+        out = StringIO()
+        call_command('archive_answers', dry_run=True, stdout=out)
+        self.assertIn(str(self.poll.id), out.getvalue())
+        self.assertNotIn(str(recent.id), out.getvalue())
+        self.assertEqual(Answer.objects.count(), 7)
+        self.archive()
+        self.assertEqual(Answer.objects.get().poll_id, recent.id)
+        self.archive(grace_days=5)
+        self.assertFalse(Answer.objects.exists())
+
+    def test_user_answers_read_through(self):
+        active = Poll.objects.create(title='active', description='active',
+                                     start_date='2021-12-26',
+                                     end_date='2999-12-31')
+        question = Question.objects.create(poll=active,
+                                           question_text='Age',
+                                           question_type='TEXT')
+        self.answer(active, [{'user_id': 1, 'question': question.id,
+                              'answer_text': '20'}])
+        url = reverse('user_answer_view', kwargs={'user_id': 1})
+        before = self.get_json(url)
+        first_page = self.get_json(url, {'page_size': 1})
+        self.archive()
+        self.assertEqual(Answer.objects.get().poll_id, active.id)
+        self.assertEqual(self.get_json(url), before)
+        self.assertEqual(self.get_json(url, {'page_size': 1}), first_page)
+        second_page = self.get_json(first_page['next'])
+        self.assertEqual(second_page['results'], before[1:])
+        with self.assertNumQueries(2), \
+                self.assertNumQueries(1, using='archive'):
+            self.client.get(url)
+
+    def test_archived_answers_merged_lazily(self):
+        pulled = []
+
+        def archived_answers(user_id, poll_ids=None):
+            for poll_id in range(1000, 1, -1):
+                pulled.append(poll_id)
+                yield (poll_id, 'title', 'description', 1, 'TEXT',
+                       'Name?', 'Paul', None)
+
+        with mock.patch('polls.views.iter_archived_answers',
+                        archived_answers):
+            polls = iter_user_polls(1)
+            self.assertEqual(next(polls)['poll_id'], 1000)
+        # архив читается по мере слияния, а не целиком
+        self.assertLess(len(pulled), 5)
+
+    def test_results_and_participation_kept(self):
+        results_url = reverse('poll_results_view',
+                              kwargs={'pk': self.poll.id})
+        results = self.get_json(results_url)
+        participation = list(Participation.objects.values())
+        self.archive()
+        self.assertEqual(self.get_json(results_url), results)
+        rebuild_results()
+        call_command('rebuild_participation', stdout=StringIO())
+        self.assertEqual(self.get_json(results_url), results)
+        self.assertEqual(list(Participation.objects.values()), participation)
+
+    def test_export_read_through(self):
+        admin = Client()
+        admin.force_login(User.objects.create_superuser(
+            username='user', email='user@mail.ru', password='user'
+        ))
+        url = reverse('poll-export', kwargs={'pk': self.poll.id})
+        before = b''.join(admin.get(url).streaming_content)
+        self.archive()
+        self.assertEqual(b''.join(admin.get(url).streaming_content), before)
+
+    def test_archived_poll_rejects_answers(self):
+        self.archive()
+        response = self.answer(self.poll, [
+            {'user_id': 3, 'question': self.question1.id,
+             'answer_text': 'late'}
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Answer.objects.exists())
+
+    def test_interrupted_archive_resumed(self):
+        # первая порция уже в архиве, опрос помечен, ответы не удалены
+        ids = list(Answer.objects.order_by('id').values_list('id',
+                                                             flat=True))
+        copy_answers(chunk_answers(self.poll.id, ids[:2]))
+        Poll.objects.filter(id=self.poll.id).update(archived_at=dt.datetime(
+            2022, 2, 1, tzinfo=dt.timezone.utc
+        ))
+        self.archive()
+        self.assertFalse(Answer.objects.exists())
+        self.assertEqual(ArchivedAnswer.objects.count(), len(ids))
+        self.assertEqual(archive_poll(self.poll.id),
+                         {'deleted': 0, 'archived': len(ids)})
+
+    @override_settings(POLLS_COMPACT_MULTICHOICE=True)
+    def test_row_changed_after_copy(self):
+        self.answer(self.poll, [{'user_id': 3, 'question': self.question2.id,
+                                 'choice': self.choice1.id}])
+        copied = []
+
+        def copy_then_answer(answers, **kwargs):
+            copy_answers(answers, **kwargs)
+            if not copied:
+                # выбор дописывается в уже скопированную компактную строку
+                copied.append(True)
+                self.answer(self.poll, [
+                    {'user_id': 3, 'question': self.question2.id,
+                     'choice': self.choice2.id}
+                ])
+
+        with mock.patch.object(archive, 'copy_answers', copy_then_answer):
+            archive_poll(self.poll.id)
+        self.assertFalse(Answer.objects.exists())
+        archived = ArchivedAnswer.objects.get(user_id=3)
+        self.assertEqual(unpack_choice_ids(archived.choice_ids),
+                         [self.choice1.id, self.choice2.id])
+
+    def test_deleted_poll_removed_from_archive(self):
+        self.archive()
+        self.poll.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.poll.delete()
+        self.assertFalse(ArchivedAnswer.objects.exists())
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from django.http import HttpResponse
+from django.test import (AsyncClient, RequestFactory, SimpleTestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import path
+from polls.async_views import create_answer_view, poll_detail_view
+from polls.metrics import registry
+from polls.models import Answer, Poll, Question
+
+SLOW_VIEW_DELAY = 0.2
+
+
+async def slow_view(request):
+    await asyncio.sleep(SLOW_VIEW_DELAY)
+    return HttpResponse('ok')
+
+
+urlpatterns = [path('slow/', slow_view, name='slow_view')]
+
+
+class TestAsyncViews(TransactionTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2999-12-31'
+        )
+        self.question = Question.objects.create(
+            poll=self.poll,
+            question_text='Write your name',
+            question_type='TEXT'
+        )
+
+    def test_create_answer(self):
+        request = self.factory.post(
+            f'/api/v1/polls/{self.poll.id}/answer/',
+            data=json.dumps({'user_id': 1,
+                             'question': self.question.id,
+                             'answer_text': 'name'}),
+            content_type='application/json'
+        )
+        response = async_to_sync(create_answer_view)(
+            request, poll_id=self.poll.id
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Answer.objects.filter(user_id=1).exists())
+
+    def test_poll_detail(self):
+        request = self.factory.get(f'/api/v1/polls/{self.poll.id}/')
+        response = async_to_sync(poll_detail_view)(request, pk=self.poll.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['poll_id'], self.poll.id)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class TestAsyncMiddleware(SimpleTestCase):
+    def requests_total(self):
+        line = ('polls_http_requests_total'
+                '{method="GET",route="slow_view",status="200"}')
+        for row in registry.render().splitlines():
+            if row.startswith(line + ' '):
+                return float(row.rsplit(' ', 1)[1])
+        return 0
+
+    def test_concurrent_requests(self):
+        # синхронное промежуточное ПО выполнило бы запросы по очереди
+        # в одном потоке, и четыре запроса шли бы вчетверо дольше
+        client = AsyncClient()
+        before = self.requests_total()
+
+        async def run():
+            started = time.perf_counter()
+            responses = await asyncio.gather(
+                *(client.get('/slow/') for _ in range(4))
+            )
+            return time.perf_counter() - started, responses
+
+        elapsed, responses = async_to_sync(run)()
+        self.assertEqual([response.status_code for response in responses],
+                         [200] * 4)
+        self.assertLess(elapsed, SLOW_VIEW_DELAY * 2)
+        self.assertEqual(self.requests_total(), before + 4)
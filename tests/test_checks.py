@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from polls.checks import check_shared_cache
+
+
+class TestSharedCacheCheck(SimpleTestCase):
+    def test_local_cache(self):
+        self.assertEqual([warning.id for warning in check_shared_cache(None)],
+                         ['polls.W001'])
+
+    def test_shared_cache(self):
+        caches = dict(settings.CACHES, default={
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'polls_cache',
+        })
+        with override_settings(CACHES=caches):
+            self.assertEqual(check_shared_cache(None), [])
@@ -0,0 +1,50 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from polls.db import check_connections, configure_sqlite
+from polls.instrumentation import RequestMetrics, current_metrics
+
+
+class TestDatabaseProfile(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_sqlite_pragmas(self):
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('cache_size'), -64000)
+
+    @override_settings(POLLS_DB_HEALTH_CHECKS=True)
+    def test_health_check_skips_open_transaction(self):
+        connection.ensure_connection()
+        with mock.patch.object(connection, 'is_usable',
+                               return_value=False) as is_usable:
+            check_connections(sender=None)
+        is_usable.assert_not_called()
+        self.assertIsNotNone(connection.connection)
+
+
+class TestHealthCheck(TransactionTestCase):
+    @override_settings(POLLS_DB_HEALTH_CHECKS=True)
+    def test_unusable_connection_is_closed(self):
+        connection.ensure_connection()
+        with mock.patch.object(connection, 'is_usable', return_value=False), \
+                mock.patch.object(connection, 'close') as close:
+            check_connections(sender=None)
+        close.assert_called_once_with()
+
+
+class TestConnectionSetup(TransactionTestCase):
+    def test_pragmas_not_counted(self):
+        # настройка нового соединения не расходует бюджет запросов
+        connection.ensure_connection()
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            configure_sqlite(sender=None, connection=connection)
+        finally:
+            current_metrics.reset(token)
+        self.assertEqual(metrics.queries, 0)
@@ -0,0 +1,117 @@
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from polls.importer import PollImporter, iter_json_array
+from polls.management.commands.import_polls import default_checkpoint
+from polls.models import Answer, ChoiceResult, Poll, Question, QuestionChoice
+
+
+class TestImportPolls(TestCase):
+    def setUp(self):
+        self.records = [
+            {'model': 'polls.poll', 'pk': 10,
+             'fields': {'title': 'imported', 'description': 'imported',
+                        'start_date': '2021-12-26',
+                        'end_date': '2022-12-31'}},
+            {'model': 'polls.question', 'pk': 20,
+             'fields': {'poll': 10, 'question_text': 'Choose',
+                        'question_type': 'CHOICE'}},
+            {'model': 'polls.questionchoice', 'pk': 30,
+             'fields': {'question': 20, 'choice_text': 'First'}},
+            {'model': 'polls.answer',
+             'fields': {'user_id': 1, 'poll': 10, 'question': 20,
+                        'choice': 30, 'answer_text': ''}},
+            # повторный ответ того же пользователя отклоняется
+            {'model': 'polls.answer',
+             'fields': {'user_id': 1, 'poll': 10, 'question': 20,
+                        'choice': 30, 'answer_text': ''}},
+            {'model': 'polls.answer',
+             'fields': {'user_id': 2, 'poll': 10, 'question': 20,
+                        'choice': 30, 'answer_text': ''}},
+            {'model': 'sessions.session', 'pk': 'abc', 'fields': {}},
+        ]
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'polls.ndjson')
+        with open(self.path, 'w') as file:
+            for record in self.records:
+                file.write(json.dumps(record) + '\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+        if os.path.exists(default_checkpoint(self.path)):
+            os.remove(default_checkpoint(self.path))
+
+    def import_polls(self, *args):
+        with open(os.devnull, 'w') as devnull:
+            call_command('import_polls', self.path, *args,
+                         stdout=devnull, stderr=devnull)
+
+    def test_import(self):
+        self.import_polls('--batch-size', '2')
+        self.assertEqual(Poll.objects.get().title, 'imported')
+        self.assertEqual(Question.objects.get().poll_id, 10)
+        self.assertEqual(QuestionChoice.objects.get().question_id, 20)
+        self.assertEqual(Answer.objects.count(), 2)
+        self.assertEqual(ChoiceResult.objects.get().answer_count, 2)
+
+    def test_resume(self):
+        self.import_polls('--batch-size', '2')
+        self.import_polls('--resume')
+        self.assertEqual(Poll.objects.count(), 1)
+        self.assertEqual(Answer.objects.count(), 2)
+        # checkpoint не пишется рядом с входным файлом
+        self.assertEqual(os.listdir(self.directory.name), ['polls.ndjson'])
+        with open(default_checkpoint(self.path)) as file:
+            self.assertEqual(file.read(), str(len(self.records)))
+
+    def test_json_read_by_record(self):
+        path = os.path.join(self.directory.name, 'polls.json')
+        with open(path, 'w') as file:
+            json.dump(self.records, file, indent=2)
+        # кусок меньше записи - записи собираются из нескольких кусков
+        with open(path) as file:
+            self.assertEqual(list(iter_json_array(file, chunk_size=16)),
+                             self.records)
+        self.path = path
+        self.import_polls()
+        self.assertEqual(Answer.objects.count(), 2)
+
+    def import_queries(self, poll_id, count):
+        records = [{'model': 'polls.poll', 'pk': poll_id,
+                    'fields': {'title': 'bulk', 'start_date': '2021-12-26',
+                               'end_date': '2022-12-31'}}]
+        for number in range(count):
+            pk = poll_id * 100 + number
+            records.append({'model': 'polls.question', 'pk': pk,
+                            'fields': {'poll': poll_id,
+                                       'question_type': 'CHOICE'}})
+            records.append({'model': 'polls.questionchoice', 'pk': pk,
+                            'fields': {'question': pk}})
+        with CaptureQueriesContext(connection) as queries:
+            stats = PollImporter().run(records)
+        self.assertEqual(stats['questions'], count)
+        return len(queries)
+
+    def test_existing_ids_not_queried_per_record(self):
+        self.assertEqual(self.import_queries(1, 2),
+                         self.import_queries(2, 40))
+
+    def test_existing_question_and_choice_rejected(self):
+        self.import_polls()
+        importer = PollImporter()
+        stats = importer.run(self.records[1:3])
+        self.assertEqual(stats['rejected'], 2)
+        self.assertEqual([number for number, _ in importer.errors], [1, 2])
+
+    def test_existing_answer_rejected_with_number(self):
+        self.import_polls()
+        importer = PollImporter()
+        stats = importer.run(self.records[3:6])
+        self.assertEqual(stats['rejected'], 3)
+        self.assertEqual(sorted(number for number, _ in importer.errors),
+                         [1, 2, 3])
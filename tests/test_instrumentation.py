@@ -0,0 +1,64 @@
+import json
+from unittest import mock
+
+from django.test import Client, TestCase, override_settings
+from django.urls.base import reverse
+from polls.instrumentation import QueryBudgetExceeded
+from polls.models import Poll, Question
+from polls.views import PollResultsView
+
+
+class TestInstrumentation(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2999-12-31'
+        )
+        self.question = Question.objects.create(
+            poll=self.poll,
+            question_text='Write your name',
+            question_type='TEXT'
+        )
+        self.results_url = reverse('poll_results_view',
+                                   kwargs={'pk': self.poll.id})
+
+    @override_settings(POLLS_SERVER_TIMING=True)
+    def test_server_timing(self):
+        response = self.client.post(
+            reverse('create_answer_view', args=[self.poll.id]),
+            data=json.dumps({'user_id': 1,
+                             'question': self.question.id,
+                             'answer_text': 'name'}),
+            content_type='application/json'
+        )
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('serializer;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    def test_server_timing_disabled(self):
+        # по умолчанию заголовок не отдаётся
+        response = self.client.get(self.results_url)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_query_budget_fails_tests(self):
+        # предупреждение пишется в лог и в строгом режиме
+        with mock.patch.object(PollResultsView, 'query_budget', 1), \
+                self.assertLogs('polls.instrumentation', 'WARNING'):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(self.results_url)
+
+    @override_settings(POLLS_QUERY_BUDGET_STRICT=False)
+    def test_query_budget_warning(self):
+        with mock.patch.object(PollResultsView, 'query_budget', 1), \
+                self.assertLogs('polls.instrumentation', 'WARNING') as logs:
+            response = self.client.get(self.results_url)
+        self.assertEqual(response.status_code, 200)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'poll_results_view')
+        self.assertEqual(record['query_budget'], 1)
+        self.assertGreater(record['queries'], 1)
+        self.assertTrue(record['slowest'])
@@ -0,0 +1,100 @@
+import json
+import tempfile
+from unittest import mock
+
+from django.test import Client, TestCase, override_settings
+from django.urls.base import reverse
+from polls.metrics import Registry
+from polls.models import Poll, Question
+
+
+def sample(text, line):
+    for row in text.splitlines():
+        if row.startswith(line + ' '):
+            return float(row.rsplit(' ', 1)[1])
+    return 0
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2999-12-31'
+        )
+        self.question = Question.objects.create(
+            poll=self.poll,
+            question_text='Write your name',
+            question_type='TEXT'
+        )
+        self.answer_url = reverse('create_answer_view', args=[self.poll.id])
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requests_per_route(self):
+        line = ('polls_http_requests_total'
+                '{method="GET",route="poll_view",status="200"}')
+        before = sample(self.scrape(), line)
+        self.client.get(reverse('poll_view'))
+        self.client.get(reverse('poll_view'))
+        text = self.scrape()
+        self.assertEqual(sample(text, line), before + 2)
+        self.assertIn('polls_http_request_duration_seconds_bucket'
+                      '{method="GET",route="poll_view",le="+Inf"}', text)
+
+    def test_answers_accepted_and_rejected(self):
+        accepted = 'polls_answers_accepted_total'
+        rejected = 'polls_answers_rejected_total{reason="text_required"}'
+        duplicate = 'polls_answers_rejected_total{reason="duplicate"}'
+        text = self.scrape()
+        before = [sample(text, line)
+                  for line in (accepted, rejected, duplicate)]
+        answers = [{'user_id': user_id, 'question': self.question.id,
+                    'answer_text': 'name'} for user_id in (1, 2)]
+        self.client.post(self.answer_url, json.dumps(answers),
+                         content_type='application/json')
+        self.client.post(self.answer_url, json.dumps(answers[0]),
+                         content_type='application/json')
+        self.client.post(self.answer_url,
+                         json.dumps({'user_id': 3,
+                                     'question': self.question.id}),
+                         content_type='application/json')
+        text = self.scrape()
+        after = [sample(text, line)
+                 for line in (accepted, rejected, duplicate)]
+        self.assertEqual([a - b for a, b in zip(after, before)], [2, 1, 1])
+
+    @override_settings(POLLS_METRICS_TOKEN='secret')
+    def test_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class TestRegistry(TestCase):
+    def test_processes_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            worker = Registry(directory)
+            scraper = Registry(directory)
+            for registry in (worker, scraper):
+                registry.counter('requests_total', 'Запросы')
+                registry.histogram('latency_seconds', 'Время',
+                                   buckets=(0.1, 1))
+            with mock.patch('polls.metrics.os.getpid', return_value=-1):
+                worker.inc('requests_total', (('route', 'a'),), 2)
+                worker.observe('latency_seconds', (), (0.1, 1), 0.5)
+                worker.flush()
+            scraper.inc('requests_total', (('route', 'a'),), 1)
+            scraper.observe('latency_seconds', (), (0.1, 1), 0.05)
+            text = scraper.render()
+        self.assertIn('requests_total{route="a"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('latency_seconds_count 2', text)
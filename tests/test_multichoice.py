@@ -0,0 +1,219 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls.base import reverse
+from polls.buffer import save_answers
+from polls.models import (Answer, Participation, Poll, Question,
+                          QuestionChoice, pack_choice_ids)
+from polls.results import rebuild_results
+
+
+class TestCompactMultichoice(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.client = Client()
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2999-12-31'
+        )
+        self.text_question = Question.objects.create(
+            poll=self.poll,
+            question_text='Write your name',
+            question_type='TEXT'
+        )
+        self.question = Question.objects.create(
+            poll=self.poll,
+            question_text='Choose something',
+            question_type='MULTICHOICE',
+        )
+        self.choices = [
+            QuestionChoice.objects.create(question=self.question,
+                                          choice_text=text)
+            for text in ('First', 'Second', 'Third')
+        ]
+        self.answer_url = reverse('create_answer_view',
+                                  kwargs={'poll_id': self.poll.id})
+        self.results_url = reverse('poll_results_view',
+                                   kwargs={'pk': self.poll.id})
+
+    def answer(self, data):
+        return self.client.post(self.answer_url, data,
+                                content_type='application/json')
+
+    def choice_answers(self, user_id, *choices):
+        return [{'user_id': user_id, 'question': self.question.id,
+                 'choice': choice.id} for choice in choices]
+
+    def get_json(self, url):
+        return json.loads(self.client.get(url).content)
+
+    def user_answers(self, user_id):
+        return self.get_json(reverse('user_answer_view',
+                                     kwargs={'user_id': user_id}))
+
+    def question_results(self):
+        return self.get_json(self.results_url)['poll_questions'][1]
+
+    def choice_counts(self):
+        return {choice['choice_text']: choice['answer_count']
+                for choice in self.question_results()['choices']}
+
+    @override_settings(POLLS_COMPACT_MULTICHOICE=True)
+    def test_choices_stored_in_one_row(self):
+        response = self.answer(
+            [{'user_id': 1, 'question': self.text_question.id,
+              'answer_text': 'Paul'}] +
+            self.choice_answers(1, self.choices[0], self.choices[2])
+        )
+        self.assertEqual(response.status_code, 201)
+        answer = Answer.objects.get(question=self.question)
+        self.assertIsNone(answer.choice_id)
+        self.assertEqual(answer.selected_choice_ids,
+                         [self.choices[0].id, self.choices[2].id])
+        self.assertEqual([item['answer_id'] for item
+                          in json.loads(response.content)[1:]],
+                         [answer.id, answer.id])
+        self.assertEqual(self.choice_counts(),
+                         {'First': 1, 'Second': 0, 'Third': 1})
+        self.assertEqual(Participation.objects.get(user_id=1).answer_count,
+                         3)
+
+    @override_settings(POLLS_COMPACT_MULTICHOICE=True)
+    def test_single_choice_answer_id(self):
+        response = self.answer(self.choice_answers(1, self.choices[0])[0])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)['answer_id'],
+                         Answer.objects.get().id)
+
+    @override_settings(POLLS_COMPACT_MULTICHOICE=True)
+    def test_choices_merged(self):
+        self.answer(self.choice_answers(1, self.choices[0]))
+        response = self.answer(self.choice_answers(1, self.choices[1])[0])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Answer.objects.get().selected_choice_ids,
+                         [self.choices[0].id, self.choices[1].id])
+        response = self.answer(self.choice_answers(1, self.choices[2],
+                                                   self.choices[0]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)[1],
+                         {'non_field_errors':
+                          ['Вы уже выбрали этот вариант ответа']})
+        self.assertEqual(len(Answer.objects.get().selected_choice_ids), 2)
+        self.assertEqual(self.choice_counts(),
+                         {'First': 1, 'Second': 1, 'Third': 0})
+
+    @override_settings(POLLS_COMPACT_MULTICHOICE=True)
+    def test_buffered_answers(self):
+        answers = [dict(user_id=1, poll_id=self.poll.id,
+                        question_id=self.question.id, choice_id=choice.id,
+                        multichoice=True) for choice in self.choices]
+        self.assertEqual(save_answers(answers[:2]), 2)
+        self.assertEqual(save_answers(answers), 1)
+        self.assertEqual(len(Answer.objects.get().selected_choice_ids), 3)
+
+    def test_compact_command_keeps_reads(self):
+        self.answer(self.choice_answers(1, self.choices[0], self.choices[2]))
+        self.answer(self.choice_answers(2, self.choices[1]))
+        # строка, уже свёрнутая при включённой настройке
+        Answer.objects.create(user_id=2, poll=self.poll,
+                              question=self.question, multichoice=True,
+                              choice_ids=pack_choice_ids([self.choices[0].id]))
+        Answer.objects.filter(choice_ids__isnull=False).update(user_id=3)
+        self.answer(self.choice_answers(3, self.choices[1]))
+        answers = {user_id: self.user_answers(user_id)
+                   for user_id in (1, 2, 3)}
+        results = self.get_json(self.results_url)
+        call_command('compact_multichoice', batch_size=2, stdout=StringIO())
+        self.assertEqual(Answer.objects.count(), 3)
+        self.assertFalse(Answer.objects.filter(choice__isnull=False)
+                         .exists())
+        self.assertEqual(Answer.objects.get(user_id=3).selected_choice_ids,
+                         [self.choices[0].id, self.choices[1].id])
+        for user_id in (1, 2):
+            self.assertEqual(self.user_answers(user_id), answers[user_id])
+        self.assertEqual(self.get_json(self.results_url), results)
+        rebuild_results()
+        self.assertEqual(self.get_json(self.results_url), results)
+        call_command('rebuild_participation', stdout=StringIO())
+        self.assertEqual(Participation.objects.get(user_id=1).answer_count,
+                         2)
+
+    @override_settings(POLLS_COMPACT_MULTICHOICE=True)
+    def test_export(self):
+        self.answer(self.choice_answers(1, self.choices[0], self.choices[1]))
+        out = StringIO()
+        call_command('export_answers', self.poll.id, export_format='ndjson',
+                     stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(row['choice_id'], row['choice_text'])
+                          for row in rows],
+                         [(self.choices[0].id, 'First'),
+                          (self.choices[1].id, 'Second')])
+
+    @override_settings(POLLS_COMPACT_MULTICHOICE=True)
+    def test_deleted_choice_stripped(self):
+        self.answer(self.choice_answers(1, self.choices[0], self.choices[1]))
+        self.answer(self.choice_answers(2, self.choices[0]))
+        self.choices[0].delete()
+        self.assertEqual(Answer.objects.get().selected_choice_ids,
+                         [self.choices[1].id])
+        self.assertEqual(self.choice_counts(), {'Second': 1, 'Third': 0})
+        self.assertEqual(self.question_results()['answer_count'], 1)
+        self.assertFalse(Participation.objects.filter(user_id=2).exists())
+        self.question.delete()
+        self.assertFalse(Participation.objects.exists())
+
+    def strip_queries(self, queries):
+        return [query for query in queries
+                if '"choice_ids" IS NOT NULL' in query['sql']]
+
+    @override_settings(POLLS_COMPACT_MULTICHOICE=True)
+    def test_deleted_choices_stripped_once(self):
+        self.answer(self.choice_answers(1, *self.choices))
+        self.answer(self.choice_answers(2, self.choices[0]))
+        with CaptureQueriesContext(connection) as queries:
+            QuestionChoice.objects.filter(
+                id__in=[self.choices[0].id, self.choices[1].id]
+            ).delete()
+        self.assertEqual(len(self.strip_queries(queries)), 1)
+        self.assertEqual(Answer.objects.get().selected_choice_ids,
+                         [self.choices[2].id])
+        self.assertEqual(self.question_results()['answer_count'], 1)
+
+    @override_settings(POLLS_COMPACT_MULTICHOICE=True)
+    def test_cascade_not_stripped(self):
+        self.answer(self.choice_answers(1, *self.choices))
+        with CaptureQueriesContext(connection) as queries:
+            self.question.delete()
+        self.assertFalse(self.strip_queries(queries))
+        self.assertFalse(Participation.objects.exists())
+        with CaptureQueriesContext(connection) as queries:
+            self.poll.delete()
+        self.assertFalse(self.strip_queries(queries))
+
+    def test_not_stripped_without_compact(self):
+        self.answer(self.choice_answers(1, *self.choices))
+        with CaptureQueriesContext(connection) as queries:
+            self.choices[0].delete()
+        self.assertFalse(self.strip_queries(queries))
+        self.assertEqual(self.choice_counts(), {'Second': 1, 'Third': 1})
+
+    @override_settings(POLLS_COMPACT_MULTICHOICE=True)
+    def test_archived_answers(self):
+        self.answer(self.choice_answers(1, self.choices[0], self.choices[2]))
+        answers = self.user_answers(1)
+        Poll.objects.filter(id=self.poll.id).update(end_date='2022-01-01')
+        call_command('archive_answers', stdout=StringIO())
+        self.assertFalse(Answer.objects.exists())
+        self.assertEqual(self.user_answers(1), answers)
+        self.assertEqual(
+            [answer['choice'] for answer in answers[0]['user_answers']],
+            ['First', 'Third']
+        )
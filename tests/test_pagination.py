@@ -0,0 +1,92 @@
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls.base import reverse
+from polls.models import Answer, Poll, Question, QuestionChoice
+
+
+class TestKeysetPagination(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.polls = [
+            Poll.objects.create(title=f'poll {number}',
+                                description='description',
+                                start_date='2021-12-26',
+                                end_date='2999-12-31')
+            for number in range(5)
+        ]
+        self.poll = self.polls[0]
+        self.questions = [
+            Question.objects.create(poll=self.poll,
+                                    question_text=f'question {number}',
+                                    question_type='CHOICE')
+            for number in range(5)
+        ]
+        for question in self.questions:
+            QuestionChoice.objects.create(question=question,
+                                          choice_text='choice')
+        for poll in self.polls:
+            question = Question.objects.create(poll=poll,
+                                               question_text='name',
+                                               question_type='TEXT')
+            Answer.objects.create(user_id=1, poll=poll, question=question,
+                                  answer_text='name')
+
+    def pages(self, url, **params):
+        results = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            results.append(data['results'])
+            if not data['next']:
+                return results
+            response = self.client.get(data['next'])
+
+    def test_poll_list_pages(self):
+        pages = self.pages(reverse('poll_view'), page_size=2)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual([poll['poll_id'] for page in pages for poll in page],
+                         [poll.id for poll in reversed(self.polls)])
+
+    def test_poll_list_without_params_is_not_paginated(self):
+        response = self.client.get(reverse('poll_view'))
+        self.assertEqual(len(response.json()), len(self.polls))
+
+    def test_deep_page_uses_keyset(self):
+        url = reverse('poll_view')
+        response = self.client.get(url, {'page_size': 2})
+        next_url = response.json()['next']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(next_url)
+        sql = queries.captured_queries[-1]['sql']
+        self.assertIn('"polls_poll"."id" <', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_poll_questions_pages(self):
+        url = reverse('poll_questions_view', kwargs={'pk': self.poll.id})
+        pages = self.pages(url, page_size=2)
+        questions = [question for page in pages for question in page]
+        self.assertEqual([question['question_id'] for question in questions],
+                         [question.id for question in self.questions] +
+                         [self.poll.poll_questions.last().id])
+        self.assertEqual(len(questions[0]['question_choice']), 1)
+
+    def test_poll_questions_nonexistent_poll(self):
+        url = reverse('poll_questions_view', kwargs={'pk': 1000})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_poll_header_without_questions(self):
+        url = reverse('poll_detail_view', kwargs={'pk': self.poll.id})
+        data = self.client.get(url, {'questions': 0}).json()
+        self.assertEqual(data['poll_id'], self.poll.id)
+        self.assertNotIn('poll_questions', data)
+
+    def test_user_answers_pages(self):
+        url = reverse('user_answer_view', kwargs={'user_id': 1})
+        unpaginated = self.client.get(url).json()
+        pages = self.pages(url, page_size=2)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual([poll for page in pages for poll in page],
+                         unpaginated)
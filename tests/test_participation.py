@@ -0,0 +1,138 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls.base import reverse
+from polls.models import (Answer, Participation, Poll, Question,
+                          QuestionChoice)
+
+
+class TestParticipation(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2999-12-31'
+        )
+        self.question1 = Question.objects.create(
+            poll=self.poll,
+            question_text='Write your name',
+            question_type='TEXT'
+        )
+        self.question2 = Question.objects.create(
+            poll=self.poll,
+            question_text='Choose something',
+            question_type='MULTICHOICE',
+        )
+        self.choice1 = QuestionChoice.objects.create(
+            question=self.question2,
+            choice_text='First choice'
+        )
+        self.choice2 = QuestionChoice.objects.create(
+            question=self.question2,
+            choice_text='Second choice'
+        )
+        self.answer_url = reverse('create_answer_view',
+                                  kwargs={'poll_id': self.poll.id})
+
+    def answer(self, data):
+        response = self.client.post(self.answer_url, data,
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+    def text_answer(self, user_id):
+        return {'user_id': user_id, 'question': self.question1.id,
+                'answer_text': 'name'}
+
+    def choice_answers(self, user_id):
+        return [{'user_id': user_id, 'question': self.question2.id,
+                 'choice': choice.id}
+                for choice in (self.choice1, self.choice2)]
+
+    def user_poll(self, user_id):
+        url = reverse('user_poll_view', kwargs={'user_id': user_id,
+                                                'poll_id': self.poll.id})
+        return json.loads(self.client.get(url).content)
+
+    def test_answers_counted(self):
+        self.answer(self.text_answer(1))
+        participation = Participation.objects.get(user_id=1)
+        self.assertEqual(participation.answer_count, 1)
+        first_answered_at = participation.first_answered_at
+        self.answer(self.choice_answers(1))
+        participation.refresh_from_db()
+        self.assertEqual(participation.answer_count, 3)
+        self.assertEqual(participation.first_answered_at, first_answered_at)
+        self.assertGreater(participation.last_answered_at, first_answered_at)
+
+    def test_user_poll_view(self):
+        self.assertEqual(self.user_poll(1)['started'], False)
+        self.answer(self.choice_answers(1))
+        data = self.user_poll(1)
+        self.assertEqual(data['started'], True)
+        self.assertEqual(data['answer_count'], 2)
+        self.assertEqual(data['poll_id'], self.poll.id)
+        url = reverse('user_poll_view', kwargs={'user_id': 1,
+                                                'poll_id': self.poll.id})
+        with self.assertNumQueries(1):
+            self.client.get(url)
+
+    def test_user_history_paginated(self):
+        other = Poll.objects.create(title='other', description='other',
+                                    start_date='2021-12-26',
+                                    end_date='2999-12-31')
+        question = Question.objects.create(poll=other,
+                                           question_text='Age',
+                                           question_type='TEXT')
+        Answer.objects.create(user_id=1, poll=other, question=question,
+                              answer_text='20')
+        self.answer(self.text_answer(1))
+        url = reverse('user_answer_view', kwargs={'user_id': 1})
+        data = json.loads(self.client.get(url, {'page_size': 1}).content)
+        self.assertEqual([poll['poll_id'] for poll in data['results']],
+                         [other.id])
+        data = json.loads(self.client.get(data['next']).content)
+        self.assertEqual([poll['poll_id'] for poll in data['results']],
+                         [self.poll.id])
+
+    def test_deleted_answers_discounted(self):
+        self.answer([self.text_answer(1)] + self.choice_answers(1))
+        self.answer(self.choice_answers(2))
+        self.question1.delete()
+        self.assertEqual(Participation.objects.get(user_id=1).answer_count, 2)
+        QuestionChoice.objects.filter(question=self.question2).delete()
+        call_command('rebuild_participation', stdout=StringIO())
+        self.assertFalse(Participation.objects.exists())
+
+    def test_poll_delete(self):
+        self.answer([self.text_answer(1)] + self.choice_answers(1))
+        self.answer([self.text_answer(2)])
+        with CaptureQueriesContext(connection) as queries:
+            self.poll.delete()
+        self.assertFalse(Participation.objects.exists())
+        # участие не пересчитывается по каждому вопросу
+        self.assertFalse([query for query in queries
+                          if 'SUM(' in query['sql']])
+
+    def test_rebuild(self):
+        self.answer(self.text_answer(1))
+        participation = Participation.objects.get(user_id=1)
+        Participation.objects.update(answer_count=10)
+        # bulk_create не обновляет участие
+        Answer.objects.bulk_create([
+            Answer(user_id=2, poll=self.poll, question=self.question1,
+                   answer_text='bulk')
+        ])
+        call_command('rebuild_participation', poll_id=self.poll.id,
+                     stdout=StringIO())
+        rebuilt = Participation.objects.get(user_id=1)
+        self.assertEqual(rebuilt.answer_count, 1)
+        self.assertEqual(rebuilt.first_answered_at,
+                         participation.first_answered_at)
+        self.assertEqual(Participation.objects.get(user_id=2).answer_count,
+                         1)
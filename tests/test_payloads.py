@@ -0,0 +1,104 @@
+import json
+
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls.base import reverse
+from polls.models import Poll, Question, QuestionChoice
+from polls.renderers import FastJSONRenderer
+from polls.serializers import PollDetailSerializer, PollSerializer
+from rest_framework.renderers import JSONRenderer
+
+
+class TestPayloads(TestCase):
+    """
+    Ответы без сериализаторов совпадают с выводом сериализаторов
+    байт в байт
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.polls = [
+            Poll.objects.create(
+                title=f'Опрос "{number}"',
+                description='строка \\ слэш\nперевод \u2028',
+                start_date='2021-12-26',
+                end_date='2999-12-31'
+            ) for number in range(3)
+        ]
+        Poll.objects.create(title='closed', description='closed',
+                            start_date='2021-12-01', end_date='2021-12-02')
+        poll = self.polls[0]
+        Question.objects.create(poll=poll, question_text='Имя',
+                                question_type='TEXT')
+        for question_type in ('CHOICE', 'MULTICHOICE'):
+            question = Question.objects.create(
+                poll=poll, question_text=f'Выберите ({question_type})',
+                question_type=question_type
+            )
+            for text in ('Первый', '', 'emoji \U0001f600'):
+                QuestionChoice.objects.create(question=question,
+                                              choice_text=text)
+        # вариант первого вопроса, созданный последним
+        QuestionChoice.objects.create(
+            question=Question.objects.get(question_type='CHOICE'),
+            choice_text='Поздний'
+        )
+
+    def render(self, data):
+        return JSONRenderer().render(data, 'application/json')
+
+    def detail_url(self, poll):
+        return reverse('poll_detail_view', kwargs={'pk': poll.id})
+
+    def expected_detail(self, poll):
+        poll = Poll.objects.prefetch_related(
+            'poll_questions__question_choice'
+        ).get(id=poll.id)
+        return PollDetailSerializer(poll).data
+
+    def test_poll_list(self):
+        expected = self.render(PollSerializer(
+            Poll.objects.filter(end_date__gte='2022-01-01'), many=True
+        ).data)
+        response = self.client.get(reverse('poll_view'))
+        self.assertEqual(response.content, expected)
+        # второй ответ - из снимка в кэше
+        self.assertEqual(self.client.get(reverse('poll_view')).content,
+                         expected)
+
+    def test_poll_list_pages(self):
+        response = self.client.get(reverse('poll_view'), {'page_size': 2})
+        data = json.loads(response.content)
+        self.assertEqual(
+            response.content,
+            self.render({'next': data['next'], 'previous': None,
+                         'results': PollSerializer(self.polls[:0:-1],
+                                                   many=True).data})
+        )
+
+    def test_poll_detail(self):
+        for poll in self.polls:
+            expected = self.render(self.expected_detail(poll))
+            response = self.client.get(self.detail_url(poll))
+            self.assertEqual(response.content, expected)
+            self.assertEqual(self.client.get(self.detail_url(poll)).content,
+                             expected)
+
+    def test_poll_detail_without_questions(self):
+        data = self.expected_detail(self.polls[0])
+        del data['poll_questions']
+        response = self.client.get(self.detail_url(self.polls[0]),
+                                   {'questions': '0'})
+        self.assertEqual(response.content, self.render(data))
+
+    def test_renderer(self):
+        data = self.expected_detail(self.polls[0])
+        renderer = FastJSONRenderer()
+        self.assertEqual(renderer.render(json.loads(self.render(data)),
+                                         'application/json'),
+                         self.render(data))
+        self.assertEqual(renderer.render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data,
+                                               'application/json; indent=4'))
+        self.assertEqual(renderer.render(None), b'')
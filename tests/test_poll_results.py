@@ -0,0 +1,110 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls.base import reverse
+from polls.models import (Answer, ChoiceResult, Poll, Question,
+                          QuestionChoice, QuestionResult)
+
+
+class TestPollResults(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2022-12-31'
+        )
+        self.question1 = Question.objects.create(
+            poll=self.poll,
+            question_text='Write your name',
+            question_type='TEXT'
+        )
+        self.question2 = Question.objects.create(
+            poll=self.poll,
+            question_text='Choose something',
+            question_type='MULTICHOICE',
+        )
+        self.choice1 = QuestionChoice.objects.create(
+            question=self.question2,
+            choice_text='First choice'
+        )
+        self.choice2 = QuestionChoice.objects.create(
+            question=self.question2,
+            choice_text='Second choice'
+        )
+        self.answer_url = reverse('create_answer_view',
+                                  kwargs={'poll_id': self.poll.id})
+        self.results_url = reverse('poll_results_view',
+                                   kwargs={'pk': self.poll.id})
+
+    def answer(self, user_id):
+        return [
+            {'user_id': user_id, 'question': self.question1.id,
+             'answer_text': 'name'},
+            {'user_id': user_id, 'question': self.question2.id,
+             'choice': self.choice1.id},
+            {'user_id': user_id, 'question': self.question2.id,
+             'choice': self.choice2.id},
+        ]
+
+    def test_results_counters(self):
+        self.client.post(self.answer_url,
+                         self.answer(1),
+                         content_type='application/json')
+        self.client.post(self.answer_url,
+                         self.answer(2)[1],
+                         content_type='application/json')
+        response = self.client.get(self.results_url)
+        data = json.loads(response.content)
+        questions = data.get('poll_questions')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(questions[0].get('answer_count'), 1)
+        self.assertEqual(questions[1].get('answer_count'), 3)
+        self.assertEqual(
+            [choice.get('answer_count')
+             for choice in questions[1].get('choices')],
+            [2, 1]
+        )
+
+    def choice_counts(self):
+        questions = json.loads(
+            self.client.get(self.results_url).content
+        )['poll_questions']
+        return questions[1]['answer_count'], {
+            choice['choice_text']: choice['answer_count']
+            for choice in questions[1]['choices']
+        }
+
+    def test_deleted_choice_discounted(self):
+        for user_id in (1, 2):
+            self.client.post(self.answer_url,
+                             self.answer(user_id),
+                             content_type='application/json')
+        self.choice1.delete()
+        self.assertEqual(self.choice_counts(), (2, {'Second choice': 2}))
+        QuestionChoice.objects.filter(id=self.choice2.id).delete()
+        self.assertEqual(QuestionResult.objects.get(
+            question=self.question2
+        ).answer_count, 0)
+
+    def test_rebuild_results(self):
+        Answer.objects.create(poll=self.poll, user_id=1,
+                              question=self.question2, choice=self.choice2)
+        QuestionResult.objects.all().delete()
+        ChoiceResult.objects.all().delete()
+        call_command('rebuild_results', stdout=StringIO())
+        self.assertEqual(
+            QuestionResult.objects.get(question=self.question2).answer_count,
+            1
+        )
+        self.assertEqual(
+            ChoiceResult.objects.get(choice=self.choice2).answer_count, 1
+        )
+
+    def test_results_nonexistent_poll(self):
+        url = reverse('poll_results_view', kwargs={'pk': 222})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
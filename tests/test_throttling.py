@@ -0,0 +1,123 @@
+from django.core.cache import caches
+from django.test import Client, TestCase, override_settings
+from django.urls.base import reverse
+from polls.models import Answer, Poll, Question
+from polls.throttling import answer_slots, take_token
+
+
+@override_settings(POLLS_ANSWER_THROTTLE_RATE_IP=0.01,
+                   POLLS_ANSWER_THROTTLE_BURST_IP=3,
+                   POLLS_ANSWER_THROTTLE_RATE_USER=0.01,
+                   POLLS_ANSWER_THROTTLE_BURST_USER=2)
+class TestAnswerThrottling(TestCase):
+    def setUp(self):
+        caches['throttle'].clear()
+        self.client = Client()
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2999-12-31'
+        )
+        self.question = Question.objects.create(
+            poll=self.poll,
+            question_text='Write your name',
+            question_type='TEXT'
+        )
+        self.url = reverse('create_answer_view',
+                           kwargs={'poll_id': self.poll.id})
+
+    def answer(self, user_id, ip='127.0.0.1'):
+        return self.client.post(
+            self.url,
+            {'user_id': user_id, 'question': self.question.id,
+             'answer_text': 'name'},
+            content_type='application/json', REMOTE_ADDR=ip
+        )
+
+    def test_ip_bucket(self):
+        for user_id in (1, 2, 3):
+            self.assertEqual(self.answer(user_id).status_code, 201)
+        with self.assertNumQueries(0):
+            response = self.answer(4)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.answer(4, ip='10.0.0.1').status_code, 201)
+        self.assertEqual(Answer.objects.count(), 4)
+
+    @override_settings(POLLS_ANSWER_THROTTLE_BURST_IP=1)
+    def test_forwarded_for_ignored(self):
+        self.assertEqual(self.answer(1).status_code, 201)
+        for user_id, ip in enumerate(('10.0.0.1', '10.0.0.2, 10.0.0.3'), 2):
+            response = self.client.post(
+                self.url,
+                {'user_id': user_id, 'question': self.question.id,
+                 'answer_text': 'name'},
+                content_type='application/json', REMOTE_ADDR='127.0.0.1',
+                HTTP_X_FORWARDED_FOR=ip
+            )
+            self.assertEqual(response.status_code, 429)
+
+    @override_settings(POLLS_ANSWER_THROTTLE_BURST_IP=1,
+                       REST_FRAMEWORK={'NUM_PROXIES': 1})
+    def test_trusted_proxy(self):
+        def answer(user_id, forwarded_for):
+            return self.client.post(
+                self.url,
+                {'user_id': user_id, 'question': self.question.id,
+                 'answer_text': 'name'},
+                content_type='application/json', REMOTE_ADDR='10.0.0.100',
+                HTTP_X_FORWARDED_FOR=forwarded_for
+            )
+
+        self.assertEqual(answer(1, '10.0.0.1').status_code, 201)
+        # подделанный адрес перед адресом от прокси не меняет ключ
+        self.assertEqual(answer(2, '1.2.3.4, 10.0.0.1').status_code, 429)
+        self.assertEqual(answer(3, '10.0.0.2').status_code, 201)
+
+    def test_user_bucket(self):
+        self.assertEqual(self.answer(1, ip='10.0.0.1').status_code, 201)
+        # повтор отклоняет проверка ответа, но токен уже забран
+        self.assertEqual(self.answer(1, ip='10.0.0.2').status_code, 400)
+        self.assertEqual(self.answer(1, ip='10.0.0.3').status_code, 429)
+        response = self.client.post(
+            self.url,
+            [{'user_id': 2, 'question': self.question.id,
+              'answer_text': 'name'},
+             {'user_id': 1, 'question': self.question.id,
+              'answer_text': 'name'}],
+            content_type='application/json', REMOTE_ADDR='10.0.0.4'
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.answer(2, ip='10.0.0.5').status_code, 201)
+
+    @override_settings(POLLS_ANSWER_THROTTLE_RATE_IP=0,
+                       POLLS_ANSWER_THROTTLE_RATE_USER=0)
+    def test_disabled(self):
+        for _ in range(5):
+            self.assertNotEqual(self.answer(1).status_code, 429)
+
+    def test_refill(self):
+        self.assertEqual(take_token('bucket', 2, 2, now=100), 0)
+        self.assertEqual(take_token('bucket', 2, 2, now=100), 0)
+        self.assertEqual(take_token('bucket', 2, 2, now=100), 0.5)
+        self.assertEqual(take_token('bucket', 2, 2, now=100.25), 0.25)
+        self.assertEqual(take_token('bucket', 2, 2, now=100.5), 0)
+        # корзина не переполняется за время простоя
+        self.assertEqual(take_token('bucket', 2, 2, now=200), 0)
+        self.assertEqual(take_token('bucket', 2, 2, now=200), 0)
+        self.assertEqual(take_token('bucket', 2, 2, now=200), 0.5)
+
+    @override_settings(POLLS_ANSWER_CONCURRENCY=1)
+    def test_concurrency_limit(self):
+        self.assertTrue(answer_slots.acquire(1))
+        try:
+            with self.assertNumQueries(0):
+                response = self.answer(1)
+        finally:
+            answer_slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Answer.objects.exists())
+        self.assertEqual(self.answer(1).status_code, 201)
+        self.assertEqual(self.answer(1).status_code, 400)
+        self.assertEqual(answer_slots.active, 0)
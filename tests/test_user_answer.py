@@ -1,8 +1,16 @@
+import datetime as dt
 import json
+import time
+from io import StringIO
+from unittest import mock
 
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls.base import reverse
+from polls import versions
 from polls.models import Answer, Poll, Question, QuestionChoice
 
 User = get_user_model()
@@ -180,3 +188,349 @@ class TestUser(TestCase):
         self.assertEqual(Answer.objects.count(), 1)
         self.assertEqual(data.get('non_field_errors')[0],
                          'Вы уже отвечали на этот вопрос')
+
+    def test_post_answer_batch(self):
+        url = reverse('create_answer_view', kwargs={'poll_id': 1})
+        response = self.unauthorized_client.post(
+            url,
+            [self.text_answer_data, self.choice_answer_data],
+            content_type='application/json'
+        )
+        data = json.loads(response.content)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(data), 2)
+        self.assertEqual(Answer.objects.count(), 2)
+        self.assertEqual([item['answer_id'] for item in data],
+                         [Answer.objects.get(question_id=item['question']).id
+                          for item in data])
+
+    def test_post_answer_batch_item_errors(self):
+        url = reverse('create_answer_view', kwargs={'poll_id': 1})
+        self.choice_answer_data.pop('choice')
+        response = self.unauthorized_client.post(
+            url,
+            [self.text_answer_data, self.choice_answer_data],
+            content_type='application/json'
+        )
+        data = json.loads(response.content)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data[0], {})
+        self.assertEqual(data[1].get('non_field_errors')[0],
+                         'На этот вопрос необходимо выбрать ответ')
+        self.assertEqual(Answer.objects.count(), 0)
+
+    def test_post_answer_batch_duplicates(self):
+        url = reverse('create_answer_view', kwargs={'poll_id': 1})
+        response = self.unauthorized_client.post(
+            url,
+            [self.text_answer_data, self.text_answer_data],
+            content_type='application/json'
+        )
+        data = json.loads(response.content)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data[0], {})
+        self.assertEqual(data[1].get('non_field_errors')[0],
+                         'Вы уже отвечали на этот вопрос')
+        self.assertEqual(Answer.objects.count(), 0)
+
+    def test_post_answer_query_count(self):
+        url = reverse('create_answer_view', kwargs={'poll_id': 1})
+        self.unauthorized_client.post(url,
+                                      [dict(self.choice_answer_data,
+                                            user_id=2),
+                                       dict(self.text_answer_data,
+                                            user_id=2)],
+                                      content_type='application/json')
+        # схема опроса в кэше, счётчики итогов уже созданы, дубли
+        # отсекает ограничение: вставка и два счётчика в точке сохранения,
+        # первое участие пользователя в опросе - ещё три запроса
+        with self.assertNumQueries(8):
+            response = self.unauthorized_client.post(
+                url,
+                self.choice_answer_data,
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 201)
+        # дальше участие обновляется одним запросом; у текстового
+        # вопроса нет счётчика вариантов
+        with self.assertNumQueries(5):
+            response = self.unauthorized_client.post(
+                url,
+                self.text_answer_data,
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def test_schema_invalidated_on_choice_change(self):
+        url = reverse('create_answer_view', kwargs={'poll_id': 1})
+        self.unauthorized_client.post(url,
+                                      self.text_answer_data,
+                                      content_type='application/json')
+        new_choice = QuestionChoice.objects.create(
+            question=self.question2,
+            choice_text='Third choice'
+        )
+        self.choice_answer_data['choice'] = new_choice.id
+        response = self.unauthorized_client.post(
+            url,
+            self.choice_answer_data,
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_schema_invalidated_on_choice_delete(self):
+        url = reverse('create_answer_view', kwargs={'poll_id': 1})
+        self.unauthorized_client.post(url,
+                                      self.text_answer_data,
+                                      content_type='application/json')
+        self.choice1.delete()
+        response = self.unauthorized_client.post(
+            url,
+            self.choice_answer_data,
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        QuestionChoice.objects.create(question=self.question2,
+                                      choice_text='Third choice')
+        QuestionChoice.objects.filter(id=self.choice2.id).delete()
+        self.choice_answer_data['choice'] = self.choice2.id
+        response = self.unauthorized_client.post(
+            url,
+            self.choice_answer_data,
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_poll_delete_skips_choice_lookups(self):
+        for number in range(3):
+            question = Question.objects.create(
+                poll=self.poll,
+                question_text=f'Question {number}',
+                question_type='CHOICE'
+            )
+            for text in ('First', 'Second', 'Third'):
+                QuestionChoice.objects.create(question=question,
+                                              choice_text=text)
+        with CaptureQueriesContext(connection) as queries:
+            self.poll.delete()
+        # вопросы выбирает только каскад, варианты вопрос не ищут
+        self.assertEqual(
+            sum(query['sql'].startswith('SELECT') and
+                'FROM "polls_question"' in query['sql']
+                for query in queries), 1
+        )
+
+    def test_answer_list_query_count(self):
+        url = reverse('user_answer_view', kwargs={'user_id': 1})
+        second_poll = Poll.objects.create(
+            title='second',
+            description='second',
+            start_date='2021-12-26',
+            end_date='2022-12-31'
+        )
+        second_question = Question.objects.create(
+            poll=second_poll,
+            question_text='Write something',
+            question_type='TEXT'
+        )
+        Answer.objects.create(poll=self.poll, user_id=1,
+                              question=self.question2, choice=self.choice1)
+        Answer.objects.create(poll=second_poll, user_id=1,
+                              question=second_question, answer_text='bla')
+        # архивные опросы пользователя и его ответы
+        with self.assertNumQueries(2):
+            response = self.unauthorized_client.get(url)
+        data = json.loads(response.content)
+        self.assertEqual([poll['poll_id'] for poll in data],
+                         [second_poll.id, self.poll.id])
+        self.assertEqual(data[1]['user_answers'][0]['choice'],
+                         self.choice1.choice_text)
+
+    def test_answer_list_stream(self):
+        url = reverse('user_answer_view', kwargs={'user_id': 1})
+        Answer.objects.create(poll=self.poll, user_id=1,
+                              question=self.question1, answer_text='Paul')
+        response = self.unauthorized_client.get(url)
+        stream_response = self.unauthorized_client.get(url, {'stream': 1})
+        stream_data = json.loads(b''.join(stream_response.streaming_content))
+        self.assertEqual(stream_response.status_code, 200)
+        self.assertEqual(stream_data, json.loads(response.content))
+
+    def test_poll_detail_snapshot(self):
+        url = reverse('poll_detail_view', kwargs={'pk': 1})
+        self.unauthorized_client.get(url)
+        with self.assertNumQueries(0):
+            response = self.unauthorized_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        Question.objects.create(
+            poll=self.poll,
+            question_text='New question',
+            question_type='TEXT'
+        )
+        response = self.unauthorized_client.get(url)
+        data = json.loads(response.content)
+        self.assertEqual(len(data.get('poll_questions')), 3)
+
+    def test_active_polls_snapshot(self):
+        url = reverse('poll_view')
+        self.unauthorized_client.get(url)
+        with self.assertNumQueries(0):
+            self.unauthorized_client.get(url)
+        poll = Poll.objects.create(
+            title='active',
+            description='active',
+            start_date=dt.date.today(),
+            end_date=dt.date.today() + dt.timedelta(days=1)
+        )
+        response = self.unauthorized_client.get(url)
+        data = json.loads(response.content)
+        self.assertEqual(data[0].get('poll_id'), poll.id)
+
+    def test_poll_detail_not_modified(self):
+        url = reverse('poll_detail_view', kwargs={'pk': 1})
+        response = self.unauthorized_client.get(url)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.unauthorized_client.get(
+                url, HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        self.question1.question_text = 'Changed'
+        self.question1.save()
+        response = self.unauthorized_client.get(url,
+                                                HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_poll_detail_version_expires(self):
+        # версия, которую не сбросил другой процесс, живёт ограниченно
+        url = reverse('poll_detail_view', kwargs={'pk': 1})
+        etag = self.unauthorized_client.get(url)['ETag']
+        expired = time.time() + versions.VERSION_TIMEOUT + 1
+        with mock.patch('time.time', return_value=expired):
+            response = self.unauthorized_client.get(url,
+                                                    HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_answer_list_not_modified(self):
+        url = reverse('user_answer_view', kwargs={'user_id': 1})
+        answer_url = reverse('create_answer_view', kwargs={'poll_id': 1})
+        response = self.unauthorized_client.get(url)
+        etag = response['ETag']
+        response = self.unauthorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.unauthorized_client.post(answer_url,
+                                      [self.text_answer_data],
+                                      content_type='application/json')
+        response = self.unauthorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_set_multichoice_flags(self):
+        question = Question.objects.create(poll=self.poll,
+                                           question_text='Choose many',
+                                           question_type='MULTICHOICE')
+        choice = QuestionChoice.objects.create(question=question,
+                                               choice_text='Many')
+        # bulk_create не вызывает save и флаг не ставит, как у старых строк
+        Answer.objects.bulk_create([
+            Answer(user_id=1, poll=self.poll, question=question,
+                   choice=choice),
+            Answer(user_id=1, poll=self.poll, question=self.question1,
+                   answer_text='name', multichoice=True),
+        ])
+        out = StringIO()
+        call_command('set_multichoice_flags', stdout=out)
+        self.assertIn('Исправлено ответов: 2', out.getvalue())
+        self.assertEqual(
+            dict(Answer.objects.values_list('question_id', 'multichoice')),
+            {question.id: True, self.question1.id: False}
+        )
+
+    def test_post_answer_batch_existing_answer(self):
+        url = reverse('create_answer_view', kwargs={'poll_id': 1})
+        self.unauthorized_client.post(url,
+                                      self.choice_answer_data,
+                                      content_type='application/json')
+        response = self.unauthorized_client.post(
+            url,
+            [self.text_answer_data, self.choice_answer_data],
+            content_type='application/json'
+        )
+        data = json.loads(response.content)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data[0], {})
+        self.assertEqual(data[1].get('non_field_errors')[0],
+                         'Вы уже отвечали на этот вопрос')
+        self.assertEqual(Answer.objects.count(), 1)
+
+    def test_post_answer_batch_empty(self):
+        url = reverse('create_answer_view', kwargs={'poll_id': 1})
+        response = self.unauthorized_client.post(
+            url, [], content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content),
+                         {'non_field_errors': ['Пачка ответов пуста']})
+
+    def test_post_answer_batch_too_large(self):
+        url = reverse('create_answer_view', kwargs={'poll_id': 1})
+        with mock.patch('polls.serializers.MAX_ANSWERS_PER_REQUEST', 1):
+            response = self.unauthorized_client.post(
+                url,
+                [self.text_answer_data, self.choice_answer_data],
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content),
+                         {'non_field_errors':
+                          ['Слишком много ответов в пачке, не больше 1']})
+        self.assertEqual(Answer.objects.count(), 0)
+
+
+class TestAnswerIntegrity(TransactionTestCase):
+    def setUp(self):
+        self.client = Client()
+        self.poll = Poll.objects.create(
+            title='testtitle',
+            description='testdescription',
+            start_date='2021-12-26',
+            end_date='2999-12-31'
+        )
+        self.question = Question.objects.create(
+            poll=self.poll,
+            question_text='Choose something',
+            question_type='CHOICE',
+        )
+        self.choice = QuestionChoice.objects.create(
+            question=self.question,
+            choice_text='First choice'
+        )
+        self.url = reverse('create_answer_view',
+                           kwargs={'poll_id': self.poll.id})
+
+    def answer(self, user_id, choice=None):
+        return self.client.post(self.url,
+                                {'user_id': user_id,
+                                 'question': self.question.id,
+                                 'choice': (choice or self.choice).id},
+                                content_type='application/json')
+
+    def test_duplicate(self):
+        self.assertEqual(self.answer(1).status_code, 201)
+        response = self.answer(1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['non_field_errors'],
+                         ['Вы уже отвечали на этот вопрос'])
+
+    def test_other_violation_not_duplicate(self):
+        removed = QuestionChoice.objects.create(question=self.question,
+                                                choice_text='Removed')
+        self.assertEqual(self.answer(1).status_code, 201)
+        # вариант удалён в обход сигналов: схема в кэше его ещё знает
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM polls_questionchoice WHERE id = %s',
+                           [removed.id])
+        with self.assertRaises(IntegrityError):
+            self.answer(2, removed)
+        self.assertEqual(Answer.objects.count(), 1)